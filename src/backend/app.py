@@ -2,270 +2,415 @@
 Virtual Outfit Try-On API - Flask backend for clothing and accessory virtual 
 try-on.
 """
-from flask import Flask, request, jsonify
+import startup  # first, so the startup timings cover the imports below
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import cv2
-import numpy as np
-import base64
-from io import BytesIO
-from PIL import Image
+import json
 import os
 import sys
+import time
+
+import numpy as np
 
 # Add backend directory to Python path for local imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Import all ML models and functions
-from ml_models.tshirt_tryon import (
-    remove_white_background, 
-    overlay_image, 
-    simple_tshirt_tryon,
-    process_tshirt_tryon,
-    calculate_distance,
-    get_coords,
-    fit_color
+from codec import (
+    ImageDecodeError,
+    OutputFormat,
+    OutputFormatError,
+    decode_data_url,
+    decode_image,
+    encode_jpeg
 )
-from ml_models.earring_tryon import (
-    simple_earring_tryon,
-    remove_white_background as earring_remove_white_background,
-    overlay_image as earring_overlay_image,
-    process_earring_tryon
+from deadline import DEFAULT_BUDGET_MS, DeadlineExceeded, scheduler
+from detection_cache import cache_lookups
+from inference_pool import InferencePool, InferencePoolBusy, execution_mode
+from pipeline import (
+    ParameterError,
+    parse_deadline,
+    parse_size,
+    request_deadline,
+    served_path,
+    server_timing
 )
+from result_cache import (
+    content_digest,
+    result_cache,
+    result_cache_lookups,
+    result_key
+)
+from roi import parse_region
+from tryon import (
+    detector_status,
+    detectors_ready,
+    get_pipeline,
+    tshirt_pipeline,
+    earrings_pipeline
+)
+from streaming import run_stream
+import metrics
 
-app = Flask(__name__)
-CORS(app)
-
-# Try to import MediaPipe (but continue if it fails)
+# WebSocket support is optional, like MediaPipe
 try:
-    import mediapipe as mp
-    # Initialize MediaPipe with proper configuration
-    mp_pose = mp.solutions.pose
-    mp_face_mesh = mp.solutions.face_mesh
-    # Configure with explicit model and input specifications to avoid warnings
-    mediapipe_pose = mp_pose.Pose(
-        static_image_mode=True, 
-        model_complexity=1,
-        enable_segmentation=False,
-        min_detection_confidence=0.5
-    )
-    mediapipe_face_mesh = mp_face_mesh.FaceMesh(
-        static_image_mode=True, 
-        max_num_faces=1,
-        refine_landmarks=True,
-        min_detection_confidence=0.5
-    )
-    MEDIAPIPE_AVAILABLE = True
-    print("MediaPipe successfully imported and initialized.")
+    from flask_sock import Sock
 except ImportError:
-    MEDIAPIPE_AVAILABLE = False
-    print("MediaPipe not available. Using fallback detection methods.")
-    mp_pose = None
-    mp_face_mesh = None
-
-
-# Function to use a simple approach if advanced detection fails
-def fallback_detection(frame, item_type):
-    height, width = frame.shape[:2]
-    
-    if item_type == 'tshirt' or item_type == 'dress':
-        # Fallback for shirt: assume upper half of image
-        return [width//4, height//8, width//2, height//2]
-    elif item_type == 'earrings':
-        # Fallback for earrings: assume face is in center upper third
-        return [width//3, height//6, width//3, height//3]
-    
-    return None
+    Sock = None
+
+app = Flask(__name__)
+# Let the browser UI read which path rendered a frame, whether it came from
+# the result cache, and its ETag for If-None-Match
+CORS(app, expose_headers=['X-TryOn-Path', 'X-TryOn-Cache', 'ETag'])
+
+# With WEARX_EXECUTION_MODE=process, detection and compositing run in a pool
+# of worker processes instead of the request thread
+inference_pool = InferencePool() if execution_mode() == 'process' else None
+
+
+def error_response(e, status=500):
+    import traceback
+    traceback.print_exc()
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), status
+
+
+def busy_response(e):
+    # Load shedding is expected under overload; no traceback
+    response = jsonify({
+        'success': False,
+        'error': str(e)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def run_pipeline(pipeline, data, timings, **kwargs):
+    """Run a pipeline in this thread or, in process mode, in the worker pool"""
+    if inference_pool is None:
+        return pipeline.process(data, timings, **kwargs)
+    return inference_pool.process(pipeline, data, timings, **kwargs)
+
+
+def request_session_id(data=None):
+    """
+    Client session id from the X-Session-Id header, the `session` query or
+    form field, or the `session` key of a JSON body (None if absent)
+    """
+    session_id = (request.headers.get('X-Session-Id')
+                  or request.args.get('session'))
+    if not session_id and request.mimetype == 'multipart/form-data':
+        session_id = request.form.get('session')
+    if not session_id and isinstance(data, dict):
+        session_id = data.get('session')
+    return str(session_id)[:128] if session_id else None
+
+
+def request_param(name, data=None):
+    """
+    Rendering parameter from the query string, the multipart form, or the
+    JSON body (None if absent)
+    """
+    value = request.args.get(name)
+    if not value and request.mimetype == 'multipart/form-data':
+        value = request.form.get(name)
+    if not value and isinstance(data, dict):
+        value = data.get(name)
+    return value
+
+
+def request_budget(data=None):
+    """
+    Latency budget in seconds from the `deadline_ms` parameter or the
+    X-Deadline-Ms header, else WEARX_DEADLINE_MS (0: no deadline)
+    """
+    budget = parse_deadline(request_param('deadline_ms', data)
+                            or request.headers.get('X-Deadline-Ms'))
+    if budget is None:
+        budget = DEFAULT_BUDGET_MS / 1000.0
+    return budget
+
+
+def render_options(data=None):
+    """
+    Per-request rendering options:
+        roi: [x, y, width, height] pixel box where the subject is expected
+        detect_size: Long side (px) to run detection at (0: native)
+        output_size: Long side (px) to composite and return at
+        deadline: When the response is due, counted from the request's
+            arrival at the ASGI server if it came through one
+    """
+    return {
+        'deadline': request_deadline(request_budget(data),
+                                     request.environ.get('wearx.received_at')),
+        'session_id': request_session_id(data),
+        'roi': parse_region(request_param('roi', data)),
+        'detect_size': parse_size(request_param('detect_size', data),
+                                  'detect_size'),
+        'output_size': parse_size(request_param('output_size', data),
+                                  'output_size'),
+    }
+
+
+def output_format(data=None):
+    """
+    Encoder settings from the `format` (jpeg, webp, png), `quality`,
+    `subsampling` (444, 422, 420), `optimize` and `progressive` parameters
+    """
+    return OutputFormat.parse(*(request_param(name, data) for name in (
+        'format', 'quality', 'subsampling', 'optimize', 'progressive'
+    )))
+
+
+def record_request(pipeline, status, start):
+    seconds = time.perf_counter() - start
+    metrics.requests.inc(item=pipeline.name, endpoint=request.endpoint,
+                         status=status)
+    metrics.request_seconds.observe(seconds, item=pipeline.name,
+                                    endpoint=request.endpoint)
+    if status == 'ok':
+        startup.first_request(pipeline.name, seconds)
+
+
+def result_cache_key(pipeline, data, kind, output, options):
+    """
+    Result cache key (and ETag) of a request: a digest of its input, the
+    pipeline and the version of its garments, and every option that changes
+    the output. None when the cache is disabled.
+    """
+    if not result_cache.enabled:
+        return None
+    return result_key(content_digest(data), pipeline.key,
+                      pipeline.asset_version(), kind, tuple(output),
+                      options['roi'], options['detect_size'],
+                      options['output_size'])
+
+
+def cacheable(pipeline, timings):
+    # Results placed from a deadline's cached detection or a fallback after
+    # an error would be served again after the subject was found
+    return pipeline.detector is None or served_path(timings) == 'detect'
+
+
+def result_headers(response, timings, path, key=None):
+    response.headers['Server-Timing'] = server_timing(timings)
+    response.headers['X-TryOn-Path'] = path
+    if key is not None:
+        response.set_etag(key)
+    return response
+
+
+def cached_response(key, respond):
+    """
+    Response for a request whose result is cached, without running the
+    pipeline: 304 when If-None-Match already names it, else the cached
+    result through respond(value, path, timings). None on a miss.
+    """
+    if key is None:
+        return None
+    start = time.perf_counter()
+    if key in request.if_none_match and key in result_cache:
+        result_cache_lookups.inc(result='not_modified')
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+    entry = result_cache.get(key)
+    if entry is None:
+        return None
+    value, path = entry
+    response = respond(value, path, {'cache': time.perf_counter() - start})
+    response.headers['X-TryOn-Cache'] = 'hit'
+    return response
+
+
+def record_cached(pipeline, response, start):
+    record_request(pipeline, 'not_modified' if response.status_code == 304
+                   else 'cached', start)
+    return response
+
+
+def json_try_on(pipeline):
+    """Run a pipeline on the data-URL image of a JSON request"""
+    start = time.perf_counter()
+    try:
+        data = request.json
+        output = output_format(data)
+        options = render_options(data)
+        key = result_cache_key(pipeline, data['image'], 'data_url', output,
+                               options)
+
+        def respond(result_image, path, timings):
+            response = jsonify({
+                'success': True,
+                'image': result_image,
+                'path': path
+            })
+            return result_headers(response, timings, path, key)
+
+        cached = cached_response(
+            key, lambda value, path, timings: respond(value.decode('ascii'),
+                                                      path, timings))
+        if cached is not None:
+            return record_cached(pipeline, cached, start)
+
+        timings = {}
+        result_image = run_pipeline(
+            pipeline, data['image'], timings,
+            decoder=decode_data_url,
+            encoder=output.encode_data_url,
+            **options
+        )
+        path = served_path(timings)
+        if key is not None and cacheable(pipeline, timings):
+            result_cache.put(key, result_image.encode('ascii'), path)
+        else:
+            key = None  # no ETag either
+        response = respond(result_image, path, timings)
+        response.headers['X-TryOn-Cache'] = 'miss'
+        record_request(pipeline, 'ok', start)
+        return response
+
+    except (ImageDecodeError, OutputFormatError, ParameterError) as e:
+        record_request(pipeline, 'bad_request', start)
+        return error_response(e, 400)
+    except InferencePoolBusy as e:
+        record_request(pipeline, 'busy', start)
+        return busy_response(e)
+    except DeadlineExceeded as e:
+        record_request(pipeline, 'shed', start)
+        return busy_response(e)
+    except Exception as e:
+        record_request(pipeline, 'error', start)
+        return error_response(e)
+
+
+def read_request_image():
+    """
+    Get the encoded image bytes of a binary request
+
+    Accepts either a raw `image/*` body or a multipart form with an `image`
+    file field.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            raise ImageDecodeError("Missing 'image' file field")
+        return upload.read()
+    return request.get_data(cache=False)
+
+
+def binary_try_on(pipeline):
+    """
+    Run a pipeline on a binary image request and return the encoded image
+    (JPEG unless the request asks for another format)
+    """
+    start = time.perf_counter()
+    try:
+        output = output_format()
+        options = render_options()
+        data = read_request_image()
+        key = result_cache_key(pipeline, data, 'binary', output, options)
+
+        def respond(buffer, path, timings):
+            response = Response(buffer, mimetype=output.mimetype)
+            return result_headers(response, timings, path, key)
+
+        cached = cached_response(key, respond)
+        if cached is not None:
+            return record_cached(pipeline, cached, start)
+
+        timings = {}
+        buffer = run_pipeline(pipeline, data, timings, encoder=output.encode,
+                              **options).tobytes()
+        path = served_path(timings)
+        if key is not None and cacheable(pipeline, timings):
+            result_cache.put(key, buffer, path)
+        else:
+            key = None  # no ETag either
+        response = respond(buffer, path, timings)
+        response.headers['X-TryOn-Cache'] = 'miss'
+        record_request(pipeline, 'ok', start)
+        return response
+
+    except (ImageDecodeError, OutputFormatError, ParameterError) as e:
+        record_request(pipeline, 'bad_request', start)
+        return error_response(e, 400)
+    except InferencePoolBusy as e:
+        record_request(pipeline, 'busy', start)
+        return busy_response(e)
+    except DeadlineExceeded as e:
+        record_request(pipeline, 'shed', start)
+        return busy_response(e)
+    except Exception as e:
+        record_request(pipeline, 'error', start)
+        return error_response(e)
+
+
+result_cache_stats = metrics.registry.gauge(
+    'tryon_result_cache', 'Rendered-result cache statistics', ('stat',)
+)
+
+
+def collect_result_cache_stats():
+    for stat, value in result_cache.stats().items():
+        result_cache_stats.set(value, stat=stat)
+
+
+detection_cache_hit_ratio = metrics.registry.gauge(
+    'tryon_detection_cache_hit_ratio',
+    'Share of detector calls answered from the near-duplicate frame cache'
+)
+
+
+def collect_detection_cache_stats():
+    # From the lookup counts, which include those of inference workers
+    hits = cache_lookups.total(result='hit')
+    total = hits + cache_lookups.total(result='miss')
+    detection_cache_hit_ratio.set(hits / total if total else 0.0)
+
+
+metrics.registry.add_collector(collect_detection_cache_stats)
+metrics.registry.add_collector(collect_result_cache_stats)
+metrics.registry.add_collector(scheduler.collect)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the try-on metrics"""
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once the detectors warmed at startup are loaded,
+    503 before. Reports each detector's state and the startup timings.
+    """
+    is_ready = detectors_ready()
+    body = dict(detector_status(), ready=is_ready, timings=startup.report())
+    return jsonify(body), 200 if is_ready else 503
 
 
 @app.route('/api/try-on', methods=['POST'])
 def try_on():
+    """
+    JSON try-on. `type` is one item type or several, as a list or a
+    comma-separated string (e.g. ["tshirt", "earrings"]), rendered together
+    in one pass
+    """
     try:
-        data = request.json
-        image_data = data['image'].split(',')[1]
-        item_type = data['type'].lower()  # Normalize to lowercase
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(BytesIO(image_bytes))
-        frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        h, w = frame.shape[:2]
-        
-        if item_type == 'tshirt' or item_type == 'dress':
-            # Use the item path based on type
-            item_path = "503.png" if item_type == 'tshirt' else "504.png"
-            
-            # Try to use MediaPipe for better tracking if available
-            if MEDIAPIPE_AVAILABLE and mediapipe_pose is not None:
-                try:
-                    # Convert to RGB as MediaPipe requires RGB input
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Process with explicit image dimensions
-                    pose_result = mediapipe_pose.process(frame_rgb)
-                    
-                    if pose_result.pose_landmarks:
-                        # Use the landmarks to create a body box
-                        landmarks = pose_result.pose_landmarks.landmark
-                        
-                        # Calculate body box from landmarks
-                        # Get shoulder landmarks
-                        l_shoulder = landmarks[11]  # LEFT_SHOULDER
-                        r_shoulder = landmarks[12]  # RIGHT_SHOULDER
-                        
-                        # Get coordinates
-                        lsx, lsy = int(l_shoulder.x * w), int(l_shoulder.y * h)
-                        rsx, rsy = int(r_shoulder.x * w), int(r_shoulder.y * h)
-                        
-                        # Calculate body box
-                        shoulder_width = abs(rsx - lsx)
-                        center_x = (lsx + rsx) // 2
-                        x = max(0, center_x - shoulder_width)
-                        y = max(0, min(lsy, rsy) - int(shoulder_width * 0.2))
-                        width = shoulder_width * 2
-                        height = int(width * 1.5)
-                        
-                        body_box = [x, y, width, height]
-                        frame = simple_tshirt_tryon(
-                            frame, body_box, tshirt_image_path=item_path
-                        )
-                    else:
-                        # Fall back to basic detection
-                        body_box = fallback_detection(frame, item_type)
-                        frame = simple_tshirt_tryon(
-                            frame, body_box, tshirt_image_path=item_path
-                        )
-                except Exception as e:
-                    print(f"Error in MediaPipe processing: {e}")
-                    # Fall back to basic detection
-                    body_box = fallback_detection(frame, item_type)
-                    frame = simple_tshirt_tryon(
-                        frame, body_box, tshirt_image_path=item_path
-                    )
-            else:
-                # Use basic detection
-                body_box = fallback_detection(frame, item_type)
-                frame = simple_tshirt_tryon(
-                    frame, body_box, tshirt_image_path=item_path
-                )
-        
-        elif item_type == 'earrings':
-            left_path = "left_ear.png"
-            right_path = "right_ear.png"
-            
-            # Try to use MediaPipe for better tracking if available
-            if MEDIAPIPE_AVAILABLE and mediapipe_face_mesh is not None:
-                try:
-                    # Convert to RGB as MediaPipe requires RGB input
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Process with explicit image dimensions
-                    face_result = mediapipe_face_mesh.process(frame_rgb)
-                    
-                    if face_result.multi_face_landmarks:
-                        # Use landmarks to create face box
-                        face_landmarks = (
-                            face_result.multi_face_landmarks[0].landmark
-                        )
-                        
-                        # Get face bounds
-                        x_coords = [int(lm.x * w) for lm in face_landmarks]
-                        y_coords = [int(lm.y * h) for lm in face_landmarks]
-                        
-                        x = min(x_coords)
-                        y = min(y_coords)
-                        width = max(x_coords) - x
-                        height = max(y_coords) - y
-                        
-                        face_box = [x, y, width, height]
-                        
-                        # Find ear landmarks
-                        left_ear = face_landmarks[234]
-                        right_ear = face_landmarks[454]
-                        
-                        # Get earring positions
-                        left_x = int(left_ear.x * w)
-                        left_y = int(left_ear.y * h)
-                        right_x = int(right_ear.x * w)
-                        right_y = int(right_ear.y * h)
-                        
-                        # Create custom parameters for earrings
-                        earring_width = width // 5
-                        earring_height = height // 3
-                        
-                        # Manually apply earrings at the ear positions
-                        frame_copy = frame.copy()
-                        
-                        # Load and prepare earring images
-                        left_earring = cv2.imread(
-                            left_path, cv2.IMREAD_UNCHANGED
-                        )
-                        right_earring = cv2.imread(
-                            right_path, cv2.IMREAD_UNCHANGED
-                        )
-                        
-                        left_earring = earring_remove_white_background(left_earring)
-                        right_earring = earring_remove_white_background(right_earring)
-                        
-                        # Position earrings at ear locations
-                        frame = earring_overlay_image(
-                            frame_copy, 
-                            left_earring, 
-                            left_x - earring_width // 2, 
-                            left_y, 
-                            earring_width, 
-                            earring_height
-                        )
-                        
-                        frame = earring_overlay_image(
-                            frame, 
-                            right_earring, 
-                            right_x - earring_width // 2, 
-                            right_y, 
-                            earring_width, 
-                            earring_height
-                        )
-                    else:
-                        # Fall back to basic detection
-                        face_box = fallback_detection(frame, 'earrings')
-                        frame = simple_earring_tryon(
-                            frame, face_box,
-                                                    left_earring_path=left_path, 
-                            right_earring_path=right_path
-                        )
-                except Exception as e:
-                    print(f"Error in MediaPipe processing: {e}")
-                    # Fall back to basic detection
-                    face_box = fallback_detection(frame, 'earrings')
-                    frame = simple_earring_tryon(
-                        frame, face_box,
-                                                left_earring_path=left_path, 
-                        right_earring_path=right_path
-                    )
-            else:
-                # Use basic detection
-                face_box = fallback_detection(frame, 'earrings')
-                frame = simple_earring_tryon(
-                    frame, face_box,
-                    left_earring_path=left_path,
-                    right_earring_path=right_path
-                )
-        
-        # Convert the result back to base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        result_image = base64.b64encode(buffer).decode('utf-8')
-        
-        return jsonify({
-            'success': True,
-            'image': f'data:image/jpeg;base64,{result_image}'
-        })
-        
+        item_type = request.json['type']
+    except Exception as e:
+        return error_response(e, 400)
+    try:
+        pipeline = get_pipeline(item_type)
+    except ParameterError as e:
+        return error_response(e, 400)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(e)
+    return json_try_on(pipeline)
 
 
 @app.route('/api/try-on/tshirt', methods=['POST'])
@@ -274,131 +419,7 @@ def try_on_tshirt():
     Dedicated endpoint for t-shirt try-on that demonstrates using all 
     tshirt_tryon.py functions
     """
-    try:
-        data = request.json
-        image_data = data['image'].split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(BytesIO(image_bytes))
-        frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        h, w = frame.shape[:2]
-        
-        # Use the item path
-        tshirt_image_path = "503.png"
-        
-        # Load the T-shirt image
-        tshirt = cv2.imread(tshirt_image_path, cv2.IMREAD_UNCHANGED)
-        if tshirt is None:
-            print(f"T-shirt image not found at: {tshirt_image_path}")
-            # Create a simple colored rectangle as placeholder
-            tshirt = np.zeros((600, 500, 4), dtype=np.uint8)
-            cv2.rectangle(tshirt, (100, 150), (400, 550), (30, 100, 255, 200), -1)
-            cv2.rectangle(tshirt, (50, 150), (100, 300), (30, 100, 255, 200), -1)
-            cv2.rectangle(tshirt, (400, 150), (450, 300), (30, 100, 255, 200), -1)
-        
-        # Demonstrate using remove_white_background
-        tshirt = remove_white_background(tshirt)
-        
-        # Try to use MediaPipe for body detection if available
-        if MEDIAPIPE_AVAILABLE and mediapipe_pose is not None:
-            try:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pose_result = mediapipe_pose.process(frame_rgb)
-                
-                if pose_result.pose_landmarks:
-                    landmarks = pose_result.pose_landmarks.landmark
-                    
-                    # Demonstrate using get_coords
-                    l_sh = get_coords(landmarks, frame.shape, 11)  # LEFT_SHOULDER
-                    r_sh = get_coords(landmarks, frame.shape, 12)  # RIGHT_SHOULDER
-                    l_hip = get_coords(landmarks, frame.shape, 23)  # LEFT_HIP
-                    r_hip = get_coords(landmarks, frame.shape, 24)  # RIGHT_HIP
-                    
-                    # Demonstrate using calculate_distance
-                    shoulder_width = calculate_distance(l_sh, r_sh)
-                    hip_width = calculate_distance(l_hip, r_hip)
-                    
-                    # Calculate torso measurements
-                    center_x = (l_sh[0] + r_sh[0]) // 2
-                    tshirt_width = int(shoulder_width * 2)
-                    tshirt_height = int(tshirt_width * 1.4)
-                    x = max(0, center_x - tshirt_width // 2)
-                    y = max(0, min(l_sh[1], r_sh[1]) - int(tshirt_height * 0.2))
-                    
-                    # Demonstrate using overlay_image
-                    result_frame = frame.copy()
-                    result_frame = overlay_image(
-                        result_frame, 
-                        tshirt, 
-                        x, 
-                        y, 
-                        tshirt_width, 
-                        tshirt_height
-                    )
-                    
-                    # Add measurements display (optional)
-                    size = "M"  # Default size
-                    expected_width = 42  # Example expected width in cm
-                    
-                    # Demonstrate using fit_color
-                    color = fit_color(shoulder_width / 10, expected_width)
-                    
-                    # Draw measurement info
-                    cv2.putText(
-                        result_frame, 
-                        f"Size: {size}", 
-                        (10, 30), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 
-                        0.8, 
-                        color, 
-                        2
-                    )
-                    
-                    # Return the enhanced frame
-                    frame = result_frame
-                else:
-                    # Fall back to simple_tshirt_tryon if no landmarks
-                    body_box = fallback_detection(frame, 'tshirt')
-                    frame = simple_tshirt_tryon(
-                        frame, body_box, tshirt_image_path=tshirt_image_path
-                    )
-            except Exception as e:
-                print(f"Error in advanced T-shirt try-on: {e}")
-                # Fall back to process_tshirt_tryon
-                # Save frame temporarily
-                temp_path = "temp_frame.jpg"
-                cv2.imwrite(temp_path, frame)
-                frame = process_tshirt_tryon(temp_path)
-                # Clean up temp file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-        else:
-            # Use the full process_tshirt_tryon function as fallback
-            # Save frame temporarily
-            temp_path = "temp_frame.jpg"
-            cv2.imwrite(temp_path, frame)
-            frame = process_tshirt_tryon(temp_path)
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        
-        # Convert the result back to base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        result_image = base64.b64encode(buffer).decode('utf-8')
-        
-        return jsonify({
-            'success': True,
-            'image': f'data:image/jpeg;base64,{result_image}'
-        })
-        
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    return json_try_on(tshirt_pipeline)
 
 
 @app.route('/api/try-on/earrings', methods=['POST'])
@@ -407,138 +428,84 @@ def try_on_earrings():
     Dedicated endpoint for earrings try-on that demonstrates using all 
     earring_tryon.py functions
     """
+    return json_try_on(earrings_pipeline)
+
+
+@app.route('/api/try-on/image', methods=['POST'])
+def try_on_image():
+    """
+    Binary variant of /api/try-on: send the frame as an `image/jpeg` (or
+    multipart `image`) body with the item in the `type` query/form field
+    (comma-separate several items), and get `image/jpeg` back
+    """
+    item_type = request.args.get('type') or request.form.get('type')
+    if not item_type:
+        return error_response(ValueError("Missing 'type' parameter"), 400)
+    return binary_try_on(get_pipeline(item_type))
+
+
+@app.route('/api/try-on/tshirt/image', methods=['POST'])
+def try_on_tshirt_image():
+    """Binary variant of /api/try-on/tshirt"""
+    return binary_try_on(tshirt_pipeline)
+
+
+@app.route('/api/try-on/earrings/image', methods=['POST'])
+def try_on_earrings_image():
+    """Binary variant of /api/try-on/earrings"""
+    return binary_try_on(earrings_pipeline)
+
+
+def serve_stream(ws, args):
+    """
+    Serve a streaming try-on connection
+
+    Args:
+        ws: WebSocket with blocking receive()/send()
+        args: The connection's query parameters (dict or MultiDict)
+    """
     try:
-        data = request.json
-        image_data = data['image'].split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(BytesIO(image_bytes))
-        frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        h, w = frame.shape[:2]
-        
-        left_path = "left_ear.png"
-        right_path = "right_ear.png"
-        
-        # Try MediaPipe for face detection if available
-        if MEDIAPIPE_AVAILABLE and mediapipe_face_mesh is not None:
-            try:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                face_result = mediapipe_face_mesh.process(frame_rgb)
-                
-                if face_result.multi_face_landmarks:
-                    face_landmarks = face_result.multi_face_landmarks[0].landmark
-                    
-                    # Find ear landmarks
-                    left_ear = face_landmarks[234]
-                    right_ear = face_landmarks[454]
-                    
-                    # Get earring positions
-                    left_x = int(left_ear.x * w)
-                    left_y = int(left_ear.y * h)
-                    right_x = int(right_ear.x * w)
-                    right_y = int(right_ear.y * h)
-                    
-                    # Create face box for possible additional processing
-                    x_coords = [int(lm.x * w) for lm in face_landmarks]
-                    y_coords = [int(lm.y * h) for lm in face_landmarks]
-                    
-                    x = min(x_coords)
-                    y = min(y_coords)
-                    width = max(x_coords) - x
-                    height = max(y_coords) - y
-                    
-                    # Size earrings based on face dimensions
-                    earring_width = width // 5
-                    earring_height = height // 3
-                    
-                    # Load and prepare earring images
-                    left_earring = cv2.imread(
-                        left_path, cv2.IMREAD_UNCHANGED
-                    )
-                    right_earring = cv2.imread(
-                        right_path, cv2.IMREAD_UNCHANGED
-                    )
-                    
-                    # Demonstrate using remove_white_background from earring_tryon
-                    left_earring = earring_remove_white_background(
-                        left_earring
-                    )
-                    right_earring = earring_remove_white_background(
-                        right_earring
-                    )
-                    
-                    # Create a copy of the frame for overlay
-                    result_frame = frame.copy()
-                    
-                    # Demonstrate using overlay_image from earring_tryon
-                    result_frame = earring_overlay_image(
-                        result_frame, 
-                        left_earring, 
-                        left_x - earring_width // 2, 
-                        left_y, 
-                        earring_width, 
-                        earring_height
-                    )
-                    
-                    result_frame = earring_overlay_image(
-                        result_frame, 
-                        right_earring, 
-                        right_x - earring_width // 2, 
-                        right_y, 
-                        earring_width, 
-                        earring_height
-                    )
-                    
-                    # Return the enhanced frame
-                    frame = result_frame
-                else:
-                    # Fall back to simple_earring_tryon
-                    face_box = fallback_detection(frame, 'earrings')
-                    frame = simple_earring_tryon(
-                        frame, face_box,
-                                            left_earring_path=left_path, 
-                        right_earring_path=right_path
-                    )
-            except Exception as e:
-                print(f"Error in advanced earring try-on: {e}")
-                # Fall back to process_earring_tryon
-                # Save frame temporarily
-                temp_path = "temp_frame.jpg"
-                cv2.imwrite(temp_path, frame)
-                frame = process_earring_tryon(temp_path)
-                # Clean up temp file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-        else:
-            # Use the full process_earring_tryon function as fallback
-            # Save frame temporarily
-            temp_path = "temp_frame.jpg"
-            cv2.imwrite(temp_path, frame)
-            frame = process_earring_tryon(temp_path)
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        
-        # Convert the result back to base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        result_image = base64.b64encode(buffer).decode('utf-8')
-        
-        return jsonify({
-            'success': True,
-            'image': f'data:image/jpeg;base64,{result_image}'
-        })
-        
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        options = {
+            'detect_size': parse_size(args.get('detect_size'), 'detect_size'),
+            'output_size': parse_size(args.get('output_size'), 'output_size'),
+        }
+    except ParameterError as e:
+        ws.send(json.dumps({'error': str(e)}))
+        return
+    run_stream(ws, get_pipeline, args.get('type', 'tshirt'), **options)
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/api/try-on/stream')
+    def try_on_stream(ws):
+        """
+        Streaming try-on over a WebSocket: send JPEG frames as binary
+        messages (and `{"type": ...}` text messages to switch items), get
+        composited JPEG frames back. The initial item comes from `?type=`;
+        `detect_size` and `output_size` apply to every frame.
+        """
+        serve_stream(ws, request.args)
+else:
+    print("flask-sock not available. Streaming try-on endpoint disabled.")
+
+
+def warm_up_codecs():
+    """Encode and decode a small JPEG, so OpenCV's codec setup is not paid
+    by the first request"""
+    start = time.perf_counter()
+    decode_image(encode_jpeg(np.zeros((64, 64, 3), dtype=np.uint8)).tobytes())
+    startup.record('opencv_warm_up', time.perf_counter() - start)
+
+
+warm_up_codecs()
+startup.record('import', startup.since_start())
 
 
 if __name__ == '__main__':
+    # Development server with the reloader and debugger; serve production
+    # traffic with `python asgi.py` instead
     print("Starting Virtual Outfit Helper...")
     print("Starting Flask server on port 5000...")
     app.run(debug=True, port=5000)
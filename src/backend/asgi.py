@@ -0,0 +1,376 @@
+"""
+Production entry point: the Flask app behind an ASGI server (uvicorn).
+
+    python asgi.py
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Connections, request bodies and response bodies are handled on the event
+loop. Each request's Flask route (decode, detect, composite, encode) runs
+on a bounded thread pool, so a slow client uploading or downloading a frame
+never holds a worker thread, and requests beyond the pool and its queue get
+503 like a full inference pool. With WEARX_EXECUTION_MODE=process the routes
+hand rendering on to the inference process pool as under any server. The
+routes are the same functions the development server runs.
+
+/api/try-on/stream is served over ASGI WebSockets, each connection running
+run_stream on a thread of a separate stream pool.
+
+Settings (environment):
+    WEARX_HOST, WEARX_PORT: Listen address (default 127.0.0.1:8000)
+    WEARX_ASGI_THREADS: Request threads (default: detector pool size)
+    WEARX_ASGI_QUEUE: Requests waiting for a thread before new ones are
+        rejected (default: 2 x threads)
+    WEARX_ASGI_STREAMS: Concurrent streaming connections (default 32)
+    WEARX_MAX_BODY_BYTES: Largest request body or WebSocket message
+        (default 16 MiB)
+    WEARX_KEEPALIVE: Seconds an idle keep-alive connection is kept open
+        (default 5)
+    WEARX_SERVER_WORKERS: Server processes, each with its own pools and
+        detectors (default 1)
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import metrics
+from detectors import default_pool_size
+
+asgi_in_flight = metrics.registry.gauge(
+    'tryon_asgi_in_flight', 'HTTP requests queued or running on the ASGI request threads'
+)
+asgi_rejected = metrics.registry.counter(
+    'tryon_asgi_rejected_total', 'HTTP requests rejected by the ASGI server', ('reason',)
+)
+
+# Response bodies go out in chunks of this size, so a slow reader holds the
+# event loop's send buffer rather than a request thread
+SEND_CHUNK = 64 * 1024
+
+
+class ServerSettings(namedtuple('ServerSettings',
+                                'host port threads queue streams max_body '
+                                'keepalive workers')):
+    """Serving settings, see the module docstring"""
+
+    @classmethod
+    def from_env(cls, env=None):
+        env = os.environ if env is None else env
+        threads = int(env.get("WEARX_ASGI_THREADS", 0)) or default_pool_size()
+        return cls(
+            host=env.get("WEARX_HOST", "127.0.0.1"),
+            port=int(env.get("WEARX_PORT", 8000)),
+            threads=threads,
+            queue=int(env.get("WEARX_ASGI_QUEUE", threads * 2)),
+            streams=int(env.get("WEARX_ASGI_STREAMS", 32)),
+            max_body=int(env.get("WEARX_MAX_BODY_BYTES", 16 * 2 ** 20)),
+            keepalive=int(env.get("WEARX_KEEPALIVE", 5)),
+            workers=int(env.get("WEARX_SERVER_WORKERS", 1)),
+        )
+
+
+def wsgi_environ(scope, body, received_at=None):
+    """
+    PEP 3333 environ for an ASGI HTTP scope and its complete body, with the
+    time.monotonic() the request arrived at as `wearx.received_at`, so
+    request deadlines include the time spent queued here
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+        'wearx.received_at': received_at,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """
+    Run a WSGI app to completion (on a request thread)
+
+    Returns:
+        (status code, ASGI header list, body chunks)
+    """
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                               for k, v in headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        chunks.extend(chunk for chunk in result if chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], chunks
+
+
+class ThreadWebSocket:
+    """
+    Blocking receive()/send() over an ASGI WebSocket, for a handler running
+    on a worker thread (the interface run_stream and flask-sock share)
+    """
+
+    def __init__(self, loop, receive, send):
+        self.loop = loop
+        self._receive = receive
+        self._send = send
+        self.closed = False
+
+    def _wait(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def receive(self):
+        """Next text (str) or binary (bytes) message; None once closed"""
+        if self.closed:
+            return None
+        message = self._wait(self._receive())
+        if message['type'] == 'websocket.disconnect':
+            self.closed = True
+            return None
+        text = message.get('text')
+        return text if text is not None else message.get('bytes')
+
+    def send(self, data):
+        if self.closed:
+            raise ConnectionError("WebSocket is closed")
+        if isinstance(data, str):
+            message = {'type': 'websocket.send', 'text': data}
+        else:
+            message = {'type': 'websocket.send', 'bytes': bytes(data)}
+        self._wait(self._send(message))
+
+
+class WSGIBridge:
+    """
+    ASGI application serving a WSGI app from a bounded thread pool
+
+    Args:
+        wsgi_app: WSGI callable (the Flask app)
+        settings: ServerSettings
+        websocket_routes: {path: handler(ws, args)} served over ASGI
+            WebSockets, with ws a ThreadWebSocket and args the query
+            parameters; handlers run on the stream pool
+        on_shutdown: Called once when the server shuts down
+    """
+
+    def __init__(self, wsgi_app, settings, websocket_routes=None,
+                 on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.settings = settings
+        self.websocket_routes = websocket_routes or {}
+        self.on_shutdown = on_shutdown
+        self.executor = ThreadPoolExecutor(settings.threads,
+                                           thread_name_prefix='asgi-request')
+        self.stream_executor = ThreadPoolExecutor(settings.streams,
+                                                  thread_name_prefix='asgi-stream')
+        # Only touched from the event loop
+        self._pending = 0
+        self._streams = 0
+
+    @property
+    def max_pending(self):
+        return self.settings.threads + self.settings.queue
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self._websocket(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    async def _respond(self, send, status, body, headers=()):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode()),
+                                *headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _reject(self, send, status, reason, error, headers=()):
+        asgi_rejected.inc(reason=reason)
+        body = json.dumps({'success': False, 'error': error}).encode()
+        await self._respond(send, status, body, headers)
+
+    async def _read_body(self, scope, receive, send):
+        """Request body, or None if the client left or it was too large"""
+        max_body = self.settings.max_body
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and value.isdigit() and int(value) > max_body:
+                await self._reject(send, 413, 'too_large',
+                                   f"Request body exceeds {max_body} bytes")
+                return None
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body += message.get('body', b'')
+            if len(body) > max_body:
+                await self._reject(send, 413, 'too_large',
+                                   f"Request body exceeds {max_body} bytes")
+                return None
+            if not message.get('more_body', False):
+                return bytes(body)
+
+    async def _http(self, scope, receive, send):
+        received_at = time.monotonic()
+        body = await self._read_body(scope, receive, send)
+        if body is None:
+            return
+        if self._pending >= self.max_pending:
+            # Load shedding, as with a full inference pool
+            await self._reject(send, 503, 'busy',
+                               f"Server busy ({self._pending} pending)",
+                               [(b'retry-after', b'1')])
+            return
+        self._pending += 1
+        asgi_in_flight.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, chunks = await loop.run_in_executor(
+                self.executor, call_wsgi, self.wsgi_app,
+                wsgi_environ(scope, body, received_at)
+            )
+        except Exception as e:
+            print(f"Unhandled error serving {scope['path']}: {e}")
+            await self._respond(send, 500, json.dumps(
+                {'success': False, 'error': 'Internal server error'}).encode())
+            return
+        finally:
+            self._pending -= 1
+            asgi_in_flight.dec()
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers})
+        if scope['method'] == 'HEAD':
+            chunks = []
+        payload = memoryview(b''.join(chunks))
+        for start in range(0, len(payload), SEND_CHUNK):
+            await send({'type': 'http.response.body',
+                        'body': bytes(payload[start:start + SEND_CHUNK]),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _websocket(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        handler = self.websocket_routes.get(scope['path'])
+        if handler is None:
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+        if self._streams >= self.settings.streams:
+            asgi_rejected.inc(reason='streams')
+            # 1013: try again later
+            await send({'type': 'websocket.close', 'code': 1013})
+            return
+        await send({'type': 'websocket.accept'})
+
+        loop = asyncio.get_running_loop()
+        ws = ThreadWebSocket(loop, receive, send)
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self._streams += 1
+        try:
+            await loop.run_in_executor(self.stream_executor, handler, ws, args)
+        except Exception as e:
+            print(f"Stream handler ended with an error: {e}")
+        finally:
+            self._streams -= 1
+            if not ws.closed:
+                ws.closed = True
+                await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
+        if self.on_shutdown is not None:
+            self.on_shutdown()
+
+
+settings = ServerSettings.from_env()
+
+# One detector instance per request thread, so no thread waits for one
+os.environ.setdefault("WEARX_DETECTOR_POOL_SIZE", str(settings.threads))
+
+import app as web  # noqa: E402  (after the detector pool size is set)
+
+
+def _shutdown_app():
+    if web.inference_pool is not None:
+        web.inference_pool.shutdown(wait=False)
+
+
+app = WSGIBridge(web.app, settings,
+                 websocket_routes={'/api/try-on/stream': web.serve_stream},
+                 on_shutdown=_shutdown_app)
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is not installed: pip install uvicorn")
+    print(f"Serving on http://{settings.host}:{settings.port} with "
+          f"{settings.threads} request threads")
+    uvicorn.run(
+        # Several worker processes need the app by import path
+        'asgi:app' if settings.workers > 1 else app,
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        timeout_keep_alive=settings.keepalive,
+        ws_max_size=settings.max_body,
+        lifespan='on',
+    )
+
+
+if __name__ == "__main__":
+    main()
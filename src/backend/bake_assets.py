@@ -0,0 +1,97 @@
+"""
+Asset build step: bake garment images into mmap-able .wxa files.
+
+Each image is decoded, background-removed with the preprocess function its
+try-on model uses, premultiplied and turned into the resize pyramid once,
+and written next to the image with its opaque box and attach points (see
+ml_models.baked). The asset store then maps the baked file instead of
+decoding the image; rebake after editing a garment (stale files are
+ignored, not used).
+
+Run from src/backend:
+    python bake_assets.py
+    python bake_assets.py my_shirt.png:ml_models.tshirt_tryon.remove_white_background
+"""
+import argparse
+import importlib
+import os
+import re
+
+import cv2
+
+from ml_models.assets import as_bgra, build_levels, premultiply
+from ml_models.baked import attach_points, baked_path, source_digest, write_baked
+
+# Garment images and their preprocess functions, as the try-on models load them
+GARMENTS = [
+    ('503.png', 'ml_models.tshirt_tryon.remove_white_background'),
+    ('504.png', 'ml_models.tshirt_tryon.remove_white_background'),
+    ('left_ear.png', 'ml_models.earring_tryon.remove_white_background'),
+    ('right_ear.png', 'ml_models.earring_tryon.remove_white_background'),
+    # No pipeline loads the necklace yet; baked ahead of the necklace item
+    # (see tryon.Z_NECKLACE), with the earring preprocess it will share
+    ('necklase1.png', 'ml_models.earring_tryon.remove_white_background'),
+]
+
+# Dotted function name after the last ':' of an entry
+PREPROCESS_NAME = re.compile(r'[A-Za-z_][\w.]*$')
+
+
+def parse_entry(entry):
+    """
+    (path, preprocess name or None) from an image or image:preprocess
+    entry. Only a dotted name after the last ':' is a preprocess function,
+    so Windows paths (C:\\garments\\shirt.png) are left whole.
+    """
+    path, _, preprocess = entry.rpartition(':')
+    # A lone letter before the ':' is a drive (C:shirt.png)
+    if len(path) > 1 and PREPROCESS_NAME.match(preprocess):
+        return path, preprocess
+    return entry, None
+
+
+def resolve_preprocess(name):
+    """Function from its dotted name, e.g. ml_models.tshirt_tryon.remove_white_background"""
+    module, _, attr = name.rpartition('.')
+    return getattr(importlib.import_module(module), attr)
+
+
+def bake(path, preprocess_name=None):
+    """
+    Bake one garment image next to it
+
+    Returns:
+        (baked path, header)
+    """
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f"Could not read {path}")
+    if preprocess_name:
+        image = resolve_preprocess(preprocess_name)(image)
+        if image is None:
+            raise ValueError(f"Preprocessing {path} failed")
+    image = premultiply(as_bgra(image))
+    out = baked_path(path)
+    header = write_baked(out, build_levels(image), preprocess_name,
+                         source_digest(path), attach_points(image))
+    return out, header
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("garments", nargs="*",
+                        help="image or image:preprocess.function entries "
+                             "(default: the garments the pipelines use)")
+    args = parser.parse_args()
+
+    entries = [parse_entry(entry) for entry in args.garments]
+    for path, preprocess in entries or GARMENTS:
+        out, header = bake(path, preprocess)
+        level0 = header['levels'][0]
+        print(f"{out}: {level0['width']}x{level0['height']}, "
+              f"{len(header['levels'])} levels, bbox {header['bbox']}, "
+              f"{os.path.getsize(out) / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+Offline batch try-on: render every input image with every item and write
+the results to a directory or a .zip/.tar archive.
+
+An I/O thread reads and decodes the inputs ahead of the render workers
+(at most --prefetch images wait decoded). Workers are threads rendering
+with the in-process detectors, or with --mode process the InferencePool's
+worker processes. Results are encoded by the workers and written by the
+main thread, so archives are only touched from one thread. Outputs that
+already exist are skipped, which makes an interrupted run resumable.
+
+Results are stored as <item>/<input path relative to the inputs' common
+directory> with the output format's extension.
+
+Run from src/backend:
+    python batch.py 'photos/**/*.jpg' --items tshirt earrings tshirt,earrings --out renders
+    python batch.py photos --items dress --out renders.zip --workers 8
+"""
+import argparse
+import glob
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+
+from codec import FORMATS, ImageDecodeError, OutputFormat, decode_image
+from pipeline import parse_size, timed
+
+# Files picked up when an input is a directory
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Order of the stages in the timing report
+STAGES = ('read', 'decode', 'resize', 'detect', 'place', 'composite',
+          'fallback', 'encode', 'write')
+
+
+def expand_inputs(patterns):
+    """
+    Input image paths from glob patterns, files and directories (searched
+    recursively), sorted and without duplicates
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.update(os.path.join(root, f) for f in files
+                             if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.update(p for p in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(p))
+    return sorted(paths)
+
+
+def output_names(paths, label, extension):
+    """
+    Archive/directory names for the paths rendered with one item. Inputs
+    that only differ in their extension (photo.jpg, photo.png) keep it, e.g.
+    photo.jpg.jpg and photo.png.jpg.
+    """
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p))
+                               for p in paths])
+    rels = [os.path.relpath(os.path.abspath(path), root) for path in paths]
+    stems = [os.path.splitext(rel)[0] for rel in rels]
+    # Case-insensitive, like the file systems the results may land on
+    counts = Counter(stem.lower() for stem in stems)
+    stems = [stem if counts[stem.lower()] == 1 else rel
+             for stem, rel in zip(stems, rels)]
+    if len({stem.lower() for stem in stems}) < len(stems):
+        # A kept name matches another input's stem (photo.jpg.png)
+        stems = rels
+    return ['/'.join([label, *stem.split(os.sep)]) + extension
+            for stem in stems]
+
+
+class DirectoryOutput:
+    """Write results as files under a directory"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, name):
+        return os.path.join(self.path, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def write(self, name, data):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Never leave a partial file behind that would be skipped on resume
+        tmp = path + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def close(self):
+        pass
+
+
+class ZipOutput:
+    """Append results to a .zip archive (stored, images are compressed)"""
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, 'a', zipfile.ZIP_STORED)
+        self.names = set(self.archive.namelist())
+
+    def exists(self, name):
+        return name in self.names
+
+    def write(self, name, data):
+        self.archive.writestr(name, data)
+        self.names.add(name)
+
+    def close(self):
+        self.archive.close()
+
+
+class TarOutput:
+    """Append results to an uncompressed .tar archive"""
+
+    def __init__(self, path):
+        self.archive = tarfile.open(path, 'a')
+        self.names = set(self.archive.getnames())
+
+    def exists(self, name):
+        return name in self.names
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.archive.addfile(info, BytesIO(data))
+        self.names.add(name)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_output(path):
+    """DirectoryOutput, ZipOutput or TarOutput depending on the extension"""
+    lower = path.lower()
+    if lower.endswith('.zip'):
+        return ZipOutput(path)
+    if lower.endswith('.tar'):
+        return TarOutput(path)
+    if lower.endswith(('.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+        raise ValueError("Compressed tar archives cannot be appended to; "
+                         "use .tar or .zip")
+    return DirectoryOutput(path)
+
+
+# An input image and the (pipeline, output name) renders it still needs
+Job = namedtuple('Job', 'path renders')
+
+# A decoded input, or the error that prevented decoding it
+Decoded = namedtuple('Decoded', 'job frame error')
+
+
+class Prefetcher:
+    """
+    Read and decode jobs' images on a background I/O thread
+
+    Iterating yields Decoded tuples in job order; at most depth of them
+    wait decoded, so memory stays bounded however many inputs there are.
+
+    Args:
+        jobs: Job list
+        depth: Decoded images buffered ahead of the consumer
+        max_side: Passed on to decode_image (reduced JPEG decoding)
+        stats: BatchStats receiving the read/decode times
+    """
+
+    _DONE = object()
+
+    def __init__(self, jobs, depth, max_side, stats):
+        self.jobs = jobs
+        self.max_side = max_side
+        self.stats = stats
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='batch-prefetch',
+                                        daemon=True)
+        self._thread.start()
+
+    def _load(self, job):
+        timings = {}
+        try:
+            with timed(timings, 'read'):
+                with open(job.path, 'rb') as f:
+                    data = f.read()
+            with timed(timings, 'decode'):
+                frame = decode_image(data, max_side=self.max_side)
+            return Decoded(job, frame, None)
+        except (OSError, ImageDecodeError) as e:
+            return Decoded(job, None, e)
+        finally:
+            self.stats.add_timings(timings)
+
+    def _run(self):
+        try:
+            for job in self.jobs:
+                if self._stop.is_set():
+                    return
+                self._put(self._load(job))
+        finally:
+            self._put(self._DONE)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class BatchStats:
+    """Thread-safe counters and summed per-stage seconds of a batch run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.images = 0
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = 0
+        self.fallbacks = 0
+        self.start = time.perf_counter()
+
+    def add_timings(self, timings):
+        with self._lock:
+            for stage, seconds in timings.items():
+                self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def count(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def report(self):
+        """Summary lines: counts, throughput and per-stage timing"""
+        elapsed = time.perf_counter() - self.start
+        lines = [
+            f"{self.images} images, {self.rendered} rendered, "
+            f"{self.skipped} skipped, {self.failed} failed, "
+            f"{self.fallbacks} heuristic fallbacks",
+            f"{elapsed:.1f} s: {self.images / elapsed if elapsed else 0:.2f} images/s, "
+            f"{self.rendered / elapsed if elapsed else 0:.2f} renders/s",
+            "",
+            f"{'stage':<11}{'total s':>9}{'ms/render':>11}",
+        ]
+        renders = max(1, self.rendered)
+        for stage in sorted(self.timings, key=lambda s: (
+                STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            seconds = self.timings[stage]
+            lines.append(f"{stage:<11}{seconds:>9.2f}{seconds * 1000 / renders:>11.1f}")
+        return lines
+
+
+def render_one(render, pipeline, frame, output, detect_size, output_size, stats):
+    """Render and encode one item (runs on a worker thread)"""
+    timings = {}
+    try:
+        result = render(pipeline, frame, timings, detect_size, output_size)
+        with timed(timings, 'encode'):
+            return output.encode(result).tobytes(), 'fallback' in timings
+    finally:
+        stats.add_timings(timings)
+
+
+def run_batch(inputs, items, out, workers=None, output=None, detect_size=None,
+              output_size=None, prefetch=8, mode='thread', log=print):
+    """
+    Render every input with every item type
+
+    Args:
+        inputs: Glob patterns, files or directories
+        items: Item types; "tshirt,earrings" renders an outfit
+        out: Output directory, or a .zip/.tar archive (appended to)
+        workers: Render workers (default: CPU count)
+        output: OutputFormat of the results (default: server JPEG defaults)
+        detect_size, output_size: As for TryOnPipeline.render
+        prefetch: Decoded images buffered ahead of the workers
+        mode: 'thread' to render in this process, 'process' for the
+            InferencePool's worker processes
+        log: Progress/error sink
+
+    Returns:
+        BatchStats
+    """
+    workers = workers or os.cpu_count() or 1
+    output = output or OutputFormat.parse()
+    # In process mode only the workers load detectors (see tryon)
+    os.environ["WEARX_EXECUTION_MODE"] = mode
+    if mode == 'thread':
+        # One detector instance per worker thread, so none waits for one
+        os.environ.setdefault("WEARX_DETECTOR_POOL_SIZE", str(workers))
+    import tryon
+
+    pipelines = []
+    for item in items:
+        unknown = [t for t in tryon.item_types(item) if t not in tryon.PIPELINES]
+        if unknown:
+            raise ValueError(f"Unknown item type(s) {unknown}, expected "
+                             f"{sorted(tryon.PIPELINES)}")
+        pipelines.append(tryon.get_pipeline(item))
+
+    pool = None
+    if mode == 'process':
+        from inference_pool import InferencePool
+        pool = InferencePool(workers=workers, max_queue=0)
+
+        def render(pipeline, frame, timings, detect_size, output_size):
+            return pool.render(pipeline, frame, timings,
+                               detect_size=detect_size, output_size=output_size)
+    else:
+        def render(pipeline, frame, timings, detect_size, output_size):
+            return pipeline.render(frame, timings, detect_size=detect_size,
+                                   output_size=output_size)
+
+    paths = expand_inputs(inputs)
+    extension = FORMATS[output.format][0]
+    names = [output_names(paths, pipeline.name, extension)
+             for pipeline in pipelines]
+
+    stats = BatchStats()
+    sink = open_output(out)
+    jobs = []
+    for i, path in enumerate(paths):
+        renders = [(pipeline, item_names[i])
+                   for pipeline, item_names in zip(pipelines, names)
+                   if not sink.exists(item_names[i])]
+        stats.skipped += len(pipelines) - len(renders)
+        if renders:
+            jobs.append(Job(path, renders))
+    log(f"{len(paths)} inputs x {len(pipelines)} items: {len(jobs)} images to "
+        f"render, {stats.skipped} outputs already exist")
+
+    futures = {}
+
+    def collect(done):
+        for future in done:
+            name = futures.pop(future)
+            try:
+                data, fallback = future.result()
+            except Exception as e:
+                log(f"Failed {name}: {e}")
+                stats.count(failed=1)
+                continue
+            timings = {}
+            with timed(timings, 'write'):
+                sink.write(name, data)
+            stats.add_timings(timings)
+            stats.count(rendered=1, fallbacks=int(fallback))
+
+    # Decoding at a reduced scale is only worth it when shrinking anyway
+    prefetcher = Prefetcher(jobs, prefetch, output_size or None, stats)
+    try:
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='batch-render') as executor:
+            for decoded in prefetcher:
+                if decoded.error is not None:
+                    log(f"Failed {decoded.job.path}: {decoded.error}")
+                    stats.count(images=1, failed=len(decoded.job.renders))
+                    continue
+                stats.count(images=1)
+                for pipeline, name in decoded.job.renders:
+                    # Keep a bounded number of renders in flight
+                    while len(futures) >= workers * 2:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    futures[executor.submit(render_one, render, pipeline,
+                                            decoded.frame, output, detect_size,
+                                            output_size, stats)] = name
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+    finally:
+        prefetcher.close()
+        sink.close()
+        if pool is not None:
+            pool.shutdown()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="+",
+                        help="Image files, directories or glob patterns")
+    parser.add_argument("--items", nargs="+", required=True,
+                        help="Item types; tshirt,earrings renders an outfit")
+    parser.add_argument("--out", required=True,
+                        help="Output directory, or a .zip/.tar archive")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Render workers (default: CPU count)")
+    parser.add_argument("--mode", choices=("thread", "process"),
+                        default=os.environ.get("WEARX_EXECUTION_MODE", "thread").lower(),
+                        help="Render in threads or in worker processes")
+    parser.add_argument("--prefetch", type=int, default=8,
+                        help="Decoded images buffered ahead of the workers")
+    parser.add_argument("--detect-size", default=None)
+    parser.add_argument("--output-size", default=None)
+    parser.add_argument("--format", default=None, help="jpeg, webp or png")
+    parser.add_argument("--quality", default=None)
+    parser.add_argument("--subsampling", default=None)
+    args = parser.parse_args()
+
+    try:
+        output = OutputFormat.parse(args.format, args.quality, args.subsampling)
+        stats = run_batch(
+            args.inputs, args.items, args.out, workers=args.workers,
+            output=output,
+            detect_size=parse_size(args.detect_size, 'detect_size'),
+            output_size=parse_size(args.output_size, 'output_size'),
+            prefetch=args.prefetch, mode=args.mode,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print()
+    for line in stats.report():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
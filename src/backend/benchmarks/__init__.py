@@ -0,0 +1 @@
+# Benchmarks for the try-on backend
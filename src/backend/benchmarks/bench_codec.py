@@ -0,0 +1,90 @@
+"""
+Decode/encode benchmark of the codec layer against the original request path
+(PIL.Image.open + np.array + cvtColor in, default cv2.imencode out).
+
+Input frames are the test photo scaled to typical webcam sizes and encoded
+the way canvas.toDataURL('image/jpeg') does (quality 0.92).
+
+Run from src/backend:
+    python -m benchmarks.bench_codec
+"""
+import argparse
+from io import BytesIO
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_compositing import FRAME_SIZES, time_call
+from codec import OutputFormat, decode_image
+
+# Encoder settings compared in the encode table
+ENCODERS = [
+    ("jpeg q95 (current)", OutputFormat('jpeg', None, None, False, False)),
+    ("jpeg q85 420", OutputFormat('jpeg', 85, '420', False, False)),
+    ("jpeg q85 420 opt", OutputFormat('jpeg', 85, '420', True, False)),
+    ("jpeg q85 opt+prog", OutputFormat('jpeg', 85, '420', True, True)),
+    ("jpeg q85 444", OutputFormat('jpeg', 85, '444', False, False)),
+    ("jpeg q75 420", OutputFormat('jpeg', 75, '420', False, False)),
+    ("webp q80", OutputFormat('webp', 80, None, False, False)),
+    ("png 1", OutputFormat('png', 1, None, False, False)),
+]
+
+
+def make_webcam_frame(image_path, width, height):
+    """The test photo letterboxed into a width x height frame"""
+    photo = cv2.imread(image_path)
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    scale = height / float(photo.shape[0])
+    photo = cv2.resize(photo, (int(photo.shape[1] * scale), height),
+                       interpolation=cv2.INTER_CUBIC)
+    x = (width - photo.shape[1]) // 2
+    frame[:, x:x + photo.shape[1]] = photo
+    return frame
+
+
+def legacy_decode(data):
+    from PIL import Image
+    image = Image.open(BytesIO(data))
+    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image", default="test_girl.png")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'frame':<7}{'decode':<22}{'ms':>8}{'size':>11}")
+    frames = {}
+    for name, fw, fh in FRAME_SIZES:
+        frame = make_webcam_frame(args.image, fw, fh)
+        frames[name] = frame
+        data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+        cases = [("PIL + np.array (old)", lambda: legacy_decode(data)),
+                 ("cv2.imdecode", lambda: decode_image(data))]
+        for max_side in (fw // 2, fw // 4):
+            cases.append((f"reduced, max_side {max_side}",
+                          lambda m=max_side: decode_image(data, max_side=m)))
+        for label, fn in cases:
+            shape = fn().shape
+            ms = time_call(fn, args.repeat)
+            print(f"{name:<7}{label:<22}{ms:>8.2f}{f'{shape[1]}x{shape[0]}':>11}")
+    print()
+
+    print(f"{'frame':<7}{'encode':<20}{'ms':>8}{'KB':>8}{'PSNR dB':>9}")
+    for name, frame in frames.items():
+        for label, output in ENCODERS:
+            buffer = output.encode(frame)
+            decoded = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            ms = time_call(lambda: output.encode(frame), args.repeat)
+            print(f"{name:<7}{label:<20}{ms:>8.2f}{buffer.nbytes / 1024:>8.0f}"
+                  f"{psnr(frame, decoded):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark comparing the shared vectorized compositor against the old
+per-pixel overlay loop from tshirt_tryon.
+
+Run from src/backend:
+    python -m benchmarks.bench_compositing
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from ml_models import compositing
+
+# Typical webcam / upload frame sizes as (name, width, height)
+FRAME_SIZES = [
+    ("480p", 640, 480),
+    ("720p", 1280, 720),
+    ("1080p", 1920, 1080),
+]
+
+
+def legacy_overlay_image(background, overlay, x, y, width, height):
+    """The original nested-loop overlay from tshirt_tryon, kept for reference"""
+    overlay = cv2.resize(overlay, (width, height))
+    for i in range(height):
+        for j in range(width):
+            if y + i >= background.shape[0] or x + j >= background.shape[1]:
+                continue
+            alpha = overlay[i, j, 3] / 255.0
+            if alpha > 0:
+                background[y + i, x + j] = ((1 - alpha) * background[y + i, x + j] +
+                                          alpha * overlay[i, j, :3])
+    return background
+
+
+def make_garment(width=500, height=600, seed=0):
+    """Create a synthetic BGRA garment with a soft-edged alpha channel"""
+    rng = np.random.default_rng(seed)
+    garment = np.zeros((height, width, 4), dtype=np.uint8)
+    garment[:, :, :3] = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    cv2.rectangle(garment, (width // 5, height // 4), (4 * width // 5, height - 10),
+                  (0, 0, 0, 255), -1)
+    garment[:, :, 3] = cv2.GaussianBlur(garment[:, :, 3], (15, 15), 0)
+    return garment
+
+
+def make_frame(width, height, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def time_call(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+def run(repeat=5, legacy_repeat=1, skip_legacy=False):
+    garment = make_garment()
+    rows = []
+    for name, fw, fh in FRAME_SIZES:
+        frame = make_frame(fw, fh)
+        # Shirt box proportional to the frame, as produced by fallback_detection
+        width = fw // 2
+        height = int(width * 1.4)
+        x, y = fw // 4, fh // 8
+
+        timings = {
+            "float32": time_call(
+                lambda: compositing.overlay_image(frame.copy(), garment, x, y, width, height,
+                                                  fixed_point=False), repeat),
+            "fixed": time_call(
+                lambda: compositing.overlay_image(frame.copy(), garment, x, y, width, height),
+                repeat),
+        }
+        if not skip_legacy:
+            timings["legacy"] = time_call(
+                lambda: legacy_overlay_image(frame.copy(), garment, x, y, width, height),
+                legacy_repeat)
+        rows.append((name, width, height, timings))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--legacy-repeat", type=int, default=1)
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="Skip the (slow) per-pixel reference loop")
+    args = parser.parse_args()
+
+    rows = run(args.repeat, args.legacy_repeat, args.skip_legacy)
+    print(f"{'frame':<7}{'overlay':>11}{'legacy ms':>12}{'float32 ms':>12}"
+          f"{'fixed ms':>10}{'speedup':>9}")
+    for name, width, height, t in rows:
+        legacy = t.get("legacy")
+        speedup = f"{legacy / t['fixed']:.0f}x" if legacy else "-"
+        legacy_str = f"{legacy:.1f}" if legacy else "-"
+        print(f"{name:<7}{f'{width}x{height}':>11}{legacy_str:>12}"
+              f"{t['float32']:>12.2f}{t['fixed']:>10.2f}{speedup:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Quality/latency trade-off of the detection resolution (`detect_size`) and
+the output resolution (`output_size`).
+
+The detection table times the raw MediaPipe detector on the image
+downscaled to each size (resize included) and reports the mean landmark
+offset, in full-resolution pixels, from detection at native resolution.
+The output table times a whole try-on render plus JPEG encode.
+
+Run from src/backend (MediaPipe needed for the detection table):
+    python -m benchmarks.bench_detect_size --image test_girl.png
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_compositing import time_call
+from landmarks import landmarks_to_array
+from pipeline import downscale
+
+DETECT_SIZES = [0, 1280, 960, 640, 480, 320, 256]
+OUTPUT_SIZES = [0, 1280, 960, 720, 480]
+
+
+def load_frame(path, long_side):
+    """Load the test image and scale it so its long side is long_side"""
+    frame = cv2.imread(path)
+    if frame is None:
+        raise SystemExit(f"Could not read {path}")
+    h, w = frame.shape[:2]
+    scale = long_side / float(max(h, w))
+    return cv2.resize(frame, (int(round(w * scale)), int(round(h * scale))),
+                      interpolation=cv2.INTER_CUBIC)
+
+
+def detect_at(detector, frame, size):
+    detect_frame = downscale(frame, size)[0] if size else frame
+    return detector(detect_frame)
+
+
+def landmark_error(landmarks, reference, frame_shape):
+    """Mean landmark distance in pixels of the full-size frame"""
+    if landmarks is None or reference is None:
+        return None
+    h, w = frame_shape[:2]
+    offset = (landmarks_to_array(landmarks) - reference)[:, :2] * (w, h)
+    return float(np.linalg.norm(offset, axis=1).mean())
+
+
+def run_detection(frame, detectors, repeat):
+    rows = []
+    for name, detector in detectors:
+        reference = detect_at(detector, frame, 0)
+        if reference is not None:
+            reference = landmarks_to_array(reference)
+        for size in DETECT_SIZES:
+            landmarks = detect_at(detector, frame, size)
+            ms = time_call(lambda: detect_at(detector, frame, size), repeat)
+            rows.append((name, size, ms, landmarks is not None,
+                         landmark_error(landmarks, reference, frame.shape)))
+    return rows
+
+
+def run_output(frame, pipeline, repeat):
+    rows = []
+    for size in OUTPUT_SIZES:
+        def render():
+            return pipeline.encoder(pipeline.render(frame, output_size=size))
+        nbytes = render().nbytes
+        rows.append((size, time_call(render, repeat), nbytes))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--image", default="test_girl.png")
+    parser.add_argument("--long-side", type=int, default=1920,
+                        help="Scale the image to this long side first (1080p)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import tryon
+
+    frame = load_frame(args.image, args.long_side)
+    print(f"input {frame.shape[1]}x{frame.shape[0]}\n")
+
+    if tryon.MEDIAPIPE_AVAILABLE:
+        detectors = [("pose", tryon.detect_pose), ("face", tryon.detect_face)]
+        print(f"{'detector':<9}{'size':>7}{'ms':>9}{'found':>7}{'error px':>10}")
+        for name, size, ms, found, error in run_detection(frame, detectors,
+                                                          args.repeat):
+            size_str = size or "native"
+            error_str = f"{error:.1f}" if error is not None else "-"
+            print(f"{name:<9}{size_str:>7}{ms:>9.1f}{'yes' if found else 'no':>7}"
+                  f"{error_str:>10}")
+        print()
+    else:
+        print("MediaPipe not available. Skipping the detection table.\n")
+
+    print(f"{'output':>7}{'render+encode ms':>18}{'jpeg KB':>9}")
+    for size, ms, nbytes in run_output(frame, tryon.tshirt_pipeline, args.repeat):
+        print(f"{size or 'native':>7}{ms:>18.1f}{nbytes / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Per-request memory of the try-on pipelines.
+
+Reports the peak of Python/NumPy allocations (tracemalloc) during one
+request, rendering into a fresh copy ("copy") and in place into the decoded
+frame ("in place", what TryOnPipeline.process does), plus the process peak
+RSS after all runs.
+
+Run from src/backend:
+    python -m benchmarks.bench_memory
+"""
+import argparse
+import resource
+import sys
+import tracemalloc
+
+import cv2
+
+from benchmarks.bench_compositing import FRAME_SIZES, make_frame
+
+
+def peak_bytes(fn, repeat):
+    """Largest tracemalloc peak over repeat calls"""
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        try:
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return peak
+
+
+def peak_rss_mib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def run(items, repeat=3):
+    import tryon
+
+    rows = []
+    for name, fw, fh in FRAME_SIZES:
+        # Smooth the noise so the JPEG resembles a camera frame
+        frame = cv2.GaussianBlur(make_frame(fw, fh), (9, 9), 0)
+        data = cv2.imencode('.jpg', frame)[1].tobytes()
+        for item in items:
+            pipeline = tryon.get_pipeline(item)
+            # Warm up assets and scratch buffers
+            pipeline.process(data)
+
+            def copy():
+                decoded = pipeline.decoder(data)
+                return pipeline.encoder(pipeline.render(decoded))
+
+            rows.append((name, item, frame.nbytes,
+                         peak_bytes(copy, repeat),
+                         peak_bytes(lambda: pipeline.process(data), repeat)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", nargs="+",
+                        default=["tshirt", "earrings", "tshirt,earrings"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = run(args.items, args.repeat)
+    print(f"{'frame':<7}{'item':<17}{'frame MiB':>10}{'copy MiB':>10}"
+          f"{'in place MiB':>14}")
+    for name, item, frame_bytes, copy_peak, inplace_peak in rows:
+        print(f"{name:<7}{item:<17}{frame_bytes / 2 ** 20:>10.1f}"
+              f"{copy_peak / 2 ** 20:>10.1f}{inplace_peak / 2 ** 20:>14.1f}")
+    print(f"\npeak RSS {peak_rss_mib():.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
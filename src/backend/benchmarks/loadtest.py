@@ -0,0 +1,569 @@
+"""
+Load generator for the try-on HTTP API.
+
+Virtual users replay a webcam trace against /api/try-on or one of its
+siblings, each as its own session (X-Session-Id) sending the trace's frames
+in order, so the detection cache and region tracking behave as they do for
+real clients. The trace is a recorded video file, a directory or glob of
+frames, or a synthetic sequence of the test photo swaying in a webcam frame.
+
+Load is either closed (--users clients each sending the next frame when the
+previous answer arrives, optionally capped at --fps) or open (--rate
+requests per second arriving on schedule, whatever the latency). Open-loop
+latency is measured from the scheduled send time, so a server that falls
+behind is not flattered by the generator waiting for it.
+
+The report has p50/p95/p99 latency, throughput, error rate by status, the
+mean Server-Timing stages, and the server's CPU use and peak RSS (read
+from /proc; Linux only) when the server is started with --serve or its pid
+is given with --server-pid.
+
+Run from src/backend:
+    python -m benchmarks.loadtest --serve --stub-mediapipe --users 8 --duration 30
+    python -m benchmarks.loadtest --url http://127.0.0.1:5000 --rate 20 --trace webcam.mp4
+    python -m benchmarks.loadtest --serve --endpoint image --type tshirt,earrings --json report.json
+"""
+import argparse
+import base64
+import glob
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_codec import make_webcam_frame
+
+# Endpoints by name: (path, body kind). JSON bodies carry a data URL, image
+# bodies the raw JPEG.
+ENDPOINTS = {
+    'json': ('/api/try-on', 'json'),
+    'image': ('/api/try-on/image', 'image'),
+    'tshirt': ('/api/try-on/tshirt', 'json'),
+    'tshirt-image': ('/api/try-on/tshirt/image', 'image'),
+    'earrings': ('/api/try-on/earrings', 'json'),
+    'earrings-image': ('/api/try-on/earrings/image', 'image'),
+}
+
+
+def synthetic_trace(image_path, width, height, frames, seed=0):
+    """
+    Webcam-like sequence: the test photo swaying slowly from side to side
+    with a little sensor noise, so consecutive frames are near duplicates
+    """
+    base = make_webcam_frame(image_path, width, height)
+    rng = np.random.default_rng(seed)
+    trace = []
+    for i in range(frames):
+        dx = 0.04 * width * np.sin(2 * np.pi * i / 48)
+        dy = 0.01 * height * np.sin(2 * np.pi * i / 31)
+        shift = np.float32([[1, 0, dx], [0, 1, dy]])
+        frame = cv2.warpAffine(base, shift, (width, height),
+                               borderMode=cv2.BORDER_REPLICATE)
+        noise = rng.integers(-3, 4, frame.shape, dtype=np.int16)
+        trace.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return trace
+
+
+def recorded_trace(path, max_frames):
+    """Frames of a video file, or of a directory/glob of images"""
+    if os.path.isdir(path):
+        files = sorted(f for f in glob.glob(os.path.join(path, '*'))
+                       if os.path.isfile(f))
+    elif any(c in path for c in '*?['):
+        files = sorted(glob.glob(path))
+    else:
+        files = None
+
+    frames = []
+    if files is None:
+        capture = cv2.VideoCapture(path)
+        while len(frames) < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+        capture.release()
+    else:
+        for f in files[:max_frames]:
+            frame = cv2.imread(f)
+            if frame is not None:
+                frames.append(frame)
+    if not frames:
+        raise SystemExit(f"No frames could be read from {path}")
+    return frames
+
+
+def encode_trace(frames, quality=92):
+    """JPEG-encode the frames once, as canvas.toDataURL would"""
+    return [cv2.imencode('.jpg', f, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            for f in frames]
+
+
+class ProcessSampler:
+    """
+    Sample a process's CPU time and RSS from /proc in the background
+
+    Args:
+        pid: Process to watch
+        interval: Seconds between samples
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._ticks = os.sysconf('SC_CLK_TCK')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            # Fields after the parenthesised command name; utime and stime
+            # are fields 14 and 15 of the whole line
+            fields = f.read().rpartition(')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def rss_bytes(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            except OSError:
+                return
+
+    def __enter__(self):
+        self._start_cpu = self.cpu_seconds()
+        self._start = time.perf_counter()
+        self.peak_rss = self.rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        wall = time.perf_counter() - self._start
+        self.cpu = self.cpu_seconds() - self._start_cpu
+        # Percent of one core, like top
+        self.cpu_percent = 100.0 * self.cpu / wall if wall else 0.0
+
+
+class Recorder:
+    """Thread-safe collection of request outcomes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.stages = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, status, latency, sent, received, server_timing):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(latency)
+            self.bytes_sent += sent
+            self.bytes_received += received
+            for stage, ms in server_timing.items():
+                total, n = self.stages.get(stage, (0.0, 0))
+                self.stages[stage] = (total + ms, n + 1)
+
+
+def parse_server_timing(header):
+    """{stage: ms} from a Server-Timing header"""
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'dur' and name:
+                try:
+                    stages[name] = float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+class VirtualUser:
+    """
+    One client session replaying the trace over a keep-alive connection
+
+    Args:
+        target: urlsplit() result of the server URL
+        endpoint: Key of ENDPOINTS
+        params: Query parameters (type, detect_size, ...)
+        trace: JPEG-encoded frames
+        offset: Index of the first frame, so users are not in lockstep
+        timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, target, endpoint, params, trace, offset=0, timeout=30):
+        self.target = target
+        self.path, self.kind = ENDPOINTS[endpoint]
+        self.params = dict(params)
+        self.session_id = uuid.uuid4().hex
+        self.trace = trace
+        self.index = offset
+        self.timeout = timeout
+        self._connection = None
+        if self.kind == 'json':
+            self._bodies = [
+                json.dumps(dict(self.params, image='data:image/jpeg;base64,'
+                                + base64.b64encode(f).decode('ascii'))).encode()
+                for f in trace
+            ]
+            self._url = self.path
+            self._content_type = 'application/json'
+        else:
+            self._bodies = trace
+            query = urlencode(self.params)
+            self._url = self.path + ('?' + query if query else '')
+            self._content_type = 'image/jpeg'
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(
+                self.target.hostname, self.target.port or 80, timeout=self.timeout
+            )
+        return self._connection
+
+    def send(self, recorder, start=None):
+        """
+        Send the next frame and record the outcome
+
+        Args:
+            start: perf_counter() time latency is measured from (default:
+                now; open-loop load passes the scheduled time)
+        """
+        body = self._bodies[self.index % len(self._bodies)]
+        self.index += 1
+        if start is None:
+            start = time.perf_counter()
+        headers = {'Content-Type': self._content_type,
+                   'X-Session-Id': self.session_id}
+        try:
+            connection = self._connect()
+            connection.request('POST', self._url, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+            status = response.status
+            timing = parse_server_timing(response.getheader('Server-Timing'))
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            data = b''
+            status = type(e).__name__
+            timing = {}
+        recorder.add(status, time.perf_counter() - start, len(body), len(data),
+                     timing)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def run_closed(users, duration, fps, recorder):
+    """Each user sends its next frame once the previous answer is back"""
+    deadline = time.perf_counter() + duration
+    interval = 1.0 / fps if fps else 0.0
+
+    def loop(user):
+        next_send = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            if next_send > now:
+                time.sleep(min(next_send - now, deadline - now))
+                continue
+            user.send(recorder)
+            next_send += interval
+            # A slow answer does not cause a burst of catch-up frames
+            next_send = max(next_send, time.perf_counter())
+
+    threads = [threading.Thread(target=loop, args=(u,), daemon=True)
+               for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open(users, duration, rate, recorder, poisson=True, seed=0):
+    """
+    Requests arrive at `rate` per second whatever the latency; each is
+    taken by the next free user, and at most len(users) are in flight
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    schedule = []
+    t = 0.0
+    while t < duration:
+        schedule.append(start + t)
+        t += rng.expovariate(rate) if poisson else 1.0 / rate
+    lock = threading.Lock()
+    position = [0]
+
+    def loop(user):
+        while True:
+            with lock:
+                if position[0] >= len(schedule):
+                    return
+                when = schedule[position[0]]
+                position[0] += 1
+            delay = when - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            user.send(recorder, start=when)
+
+    threads = [threading.Thread(target=loop, args=(u,), daemon=True)
+               for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000.0 if values else None
+
+
+def build_report(recorder, elapsed, sampler=None, settings=None):
+    total = sum(recorder.statuses.values())
+    ok = recorder.statuses.get(200, 0)
+    report = {
+        'settings': settings or {},
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'ok': ok,
+        'error_rate': round((total - ok) / total, 4) if total else 0.0,
+        'statuses': {str(k): v for k, v in sorted(recorder.statuses.items(),
+                                                  key=lambda kv: str(kv[0]))},
+        'throughput_rps': round(ok / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': (round(1000.0 * sum(recorder.latencies) / ok, 2)
+                     if ok else None),
+            'p50': percentile(recorder.latencies, 50),
+            'p95': percentile(recorder.latencies, 95),
+            'p99': percentile(recorder.latencies, 99),
+            'max': (round(1000.0 * max(recorder.latencies), 2)
+                    if ok else None),
+        },
+        'server_timing_ms': {stage: round(total / n, 2)
+                             for stage, (total, n) in recorder.stages.items()},
+        'mbit_sent_per_s': round(recorder.bytes_sent * 8 / 1e6 / elapsed, 2),
+        'mbit_received_per_s': round(recorder.bytes_received * 8 / 1e6 / elapsed, 2),
+    }
+    for key in ('p50', 'p95', 'p99'):
+        if report['latency_ms'][key] is not None:
+            report['latency_ms'][key] = round(report['latency_ms'][key], 2)
+    if sampler is not None:
+        report['server'] = {
+            'pid': sampler.pid,
+            'cpu_percent': round(sampler.cpu_percent, 1),
+            'cpu_ms_per_request': (round(1000.0 * sampler.cpu / ok, 2)
+                                   if ok else None),
+            'peak_rss_mib': round(sampler.peak_rss / 2 ** 20, 1),
+        }
+    return report
+
+
+def print_report(report):
+    latency = report['latency_ms']
+
+    def ms(value):
+        return f"{value:.1f}" if value is not None else "-"
+
+    print(f"requests {report['requests']} in {report['elapsed_s']:.1f} s, "
+          f"{report['throughput_rps']:.2f} ok/s, "
+          f"error rate {report['error_rate']:.2%}")
+    print("statuses " + ', '.join(f"{k}: {v}" for k, v in report['statuses'].items()))
+    print(f"latency ms  mean {ms(latency['mean'])}  p50 {ms(latency['p50'])}  "
+          f"p95 {ms(latency['p95'])}  p99 {ms(latency['p99'])}  "
+          f"max {ms(latency['max'])}")
+    if report['server_timing_ms']:
+        print("server stages ms  " + '  '.join(
+            f"{stage} {value:.1f}"
+            for stage, value in report['server_timing_ms'].items()))
+    print(f"network  {report['mbit_sent_per_s']:.1f} Mbit/s up, "
+          f"{report['mbit_received_per_s']:.1f} Mbit/s down")
+    server = report.get('server')
+    if server:
+        print(f"server pid {server['pid']}  CPU {server['cpu_percent']:.0f}% "
+              f"of a core ({ms(server['cpu_ms_per_request'])} ms/request), "
+              f"peak RSS {server['peak_rss_mib']:.0f} MiB")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, stub_mediapipe=False, env=None, timeout=60):
+    """
+    Start app.py's Flask app (threaded, no reloader) on 127.0.0.1:port and
+    wait until it answers
+
+    Returns:
+        subprocess.Popen
+    """
+    # No per-request access log lines on the console
+    code = "import logging; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+    if stub_mediapipe:
+        code += "from benchmarks import mediapipe_stub; mediapipe_stub.install(); "
+    code += (f"from app import app; app.run(host='127.0.0.1', port={port}, "
+             f"threaded=True, use_reloader=False)")
+    process = subprocess.Popen(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        # Traces loop over the same frames; measure rendering, not the result
+        # cache, unless the environment asks for it
+        env=dict({'WEARX_RESULT_CACHE_BYTES': '0', **os.environ}, **(env or {})),
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Server did not come up in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://127.0.0.1:5000",
+                        help="Server to load (default: %(default)s)")
+    target.add_argument("--serve", action="store_true",
+                        help="Start app.py on a free local port and load it")
+    parser.add_argument("--stub-mediapipe", action="store_true",
+                        help="With --serve: fixed landmarks, no models")
+    parser.add_argument("--server-pid", type=int,
+                        help="Sample CPU/RSS of this server process")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default='json')
+    parser.add_argument("--type", default='tshirt',
+                        help="Item type(s) for the json/image endpoints")
+    parser.add_argument("--detect-size")
+    parser.add_argument("--output-size")
+    parser.add_argument("--users", type=int, default=4,
+                        help="Concurrent sessions (open loop: max in flight)")
+    parser.add_argument("--rate", type=float,
+                        help="Open loop: requests per second in total")
+    parser.add_argument("--uniform", action="store_true",
+                        help="Open loop: evenly spaced instead of Poisson arrivals")
+    parser.add_argument("--fps", type=float,
+                        help="Closed loop: cap each user at this frame rate")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="Seconds of load before measuring")
+    parser.add_argument("--trace", help="Video file, frame directory or glob")
+    parser.add_argument("--frames", type=int, default=60,
+                        help="Frames in the trace (synthetic or max recorded)")
+    parser.add_argument("--size", default="640x480",
+                        help="Synthetic frame size WIDTHxHEIGHT")
+    parser.add_argument("--image", default="test_girl.png",
+                        help="Photo used for the synthetic trace")
+    parser.add_argument("--json", help="Also write the report as JSON here")
+    args = parser.parse_args()
+
+    if args.trace:
+        frames = recorded_trace(args.trace, args.frames)
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        frames = synthetic_trace(args.image, width, height, args.frames)
+    trace = encode_trace(frames)
+    print(f"trace: {len(trace)} frames {frames[0].shape[1]}x{frames[0].shape[0]}, "
+          f"{sum(map(len, trace)) / len(trace) / 1024:.0f} KB/frame")
+
+    server = None
+    pid = args.server_pid
+    url = args.url
+    if args.serve:
+        port = free_port()
+        server = start_server(port, args.stub_mediapipe)
+        pid = server.pid
+        url = f"http://127.0.0.1:{port}"
+
+    params = {}
+    if args.endpoint in ('json', 'image'):
+        params['type'] = args.type
+    if args.detect_size:
+        params['detect_size'] = args.detect_size
+    if args.output_size:
+        params['output_size'] = args.output_size
+
+    target = urlsplit(url)
+    users = [VirtualUser(target, args.endpoint, params, trace,
+                         offset=i * len(trace) // max(1, args.users))
+             for i in range(args.users)]
+    settings = {
+        'url': url, 'endpoint': args.endpoint, 'params': params,
+        'users': args.users, 'rate': args.rate, 'fps': args.fps,
+        'duration': args.duration, 'frames': len(trace),
+        'frame_size': f"{frames[0].shape[1]}x{frames[0].shape[0]}",
+    }
+
+    def load(duration, recorder):
+        if args.rate:
+            run_open(users, duration, args.rate, recorder,
+                     poisson=not args.uniform)
+        else:
+            run_closed(users, duration, args.fps, recorder)
+
+    try:
+        if args.warmup > 0:
+            load(args.warmup, Recorder())
+        recorder = Recorder()
+        start = time.perf_counter()
+        if pid:
+            with ProcessSampler(pid) as sampler:
+                load(args.duration, recorder)
+        else:
+            sampler = None
+            load(args.duration, recorder)
+        report = build_report(recorder, time.perf_counter() - start, sampler,
+                              settings)
+    finally:
+        for user in users:
+            user.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Stand-in for the `mediapipe` package so the benchmarks run without model
+downloads and give the same placements on every machine.
+
+Pose and FaceMesh return fixed normalized landmarks (shoulders, face
+outline, ear anchors) whatever the image, at no inference cost, so the
+benchmarks time the backend around the detector rather than the model.
+Call install() before anything imports tryon.
+"""
+import math
+import sys
+import types
+
+from landmarks import LEFT_EAR, LEFT_SHOULDER, RIGHT_EAR, RIGHT_SHOULDER
+
+POSE_LANDMARKS = 33
+FACE_LANDMARKS = 478
+
+
+class _Landmark:
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x, y, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+def pose_landmarks():
+    """Upright subject, shoulders at a third of the frame height"""
+    points = [_Landmark(0.5, 0.2 + 0.6 * i / POSE_LANDMARKS)
+              for i in range(POSE_LANDMARKS)]
+    points[LEFT_SHOULDER] = _Landmark(0.62, 0.32)
+    points[RIGHT_SHOULDER] = _Landmark(0.38, 0.32)
+    return points
+
+
+def face_landmarks():
+    """Face outline on an ellipse around (0.5, 0.22), ears on its sides"""
+    points = []
+    for i in range(FACE_LANDMARKS):
+        angle = 2 * math.pi * i / FACE_LANDMARKS
+        points.append(_Landmark(0.5 + 0.08 * math.cos(angle),
+                                0.22 + 0.11 * math.sin(angle)))
+    points[LEFT_EAR] = _Landmark(0.42, 0.23)
+    points[RIGHT_EAR] = _Landmark(0.58, 0.23)
+    return points
+
+
+class Pose:
+    def __init__(self, **kwargs):
+        self._result = types.SimpleNamespace(
+            pose_landmarks=types.SimpleNamespace(landmark=pose_landmarks())
+        )
+
+    def process(self, image):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FaceMesh:
+    def __init__(self, **kwargs):
+        self._result = types.SimpleNamespace(
+            multi_face_landmarks=[types.SimpleNamespace(landmark=face_landmarks())]
+        )
+
+    def process(self, image):
+        return self._result
+
+    def close(self):
+        pass
+
+
+def install():
+    """Register the stub as `mediapipe` (fails if tryon is already loaded)"""
+    if 'tryon' in sys.modules:
+        raise RuntimeError("install() must run before tryon is imported")
+    module = types.ModuleType('mediapipe')
+    module.solutions = types.SimpleNamespace(
+        pose=types.SimpleNamespace(Pose=Pose),
+        face_mesh=types.SimpleNamespace(FaceMesh=FaceMesh),
+    )
+    sys.modules['mediapipe'] = module
+    return module
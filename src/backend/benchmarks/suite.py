@@ -0,0 +1,281 @@
+"""
+Benchmark suite of the try-on backend with a stored baseline.
+
+Times the garment preprocessing (both remove_white_background variants),
+both overlay_image wrappers, simple_tshirt_tryon and simple_earring_tryon on
+synthetic 480p/720p/1080p frames and synthetic garments, and the Flask
+routes end to end through the test client. MediaPipe is replaced by
+benchmarks.mediapipe_stub, so no models are downloaded and detection costs
+nothing.
+
+Each case reports the best and the median of --repeat runs. Results are
+written as JSON and compared with the baseline by best time: a case fails
+when it is more than --threshold slower and the difference exceeds
+--min-delta milliseconds. The exit status is 1 on any regression.
+
+The stored baseline is machine specific; after a deliberate change, or on
+another machine, refresh it with --update-baseline.
+
+Run from src/backend:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --output results.json --threshold 0.25
+    python -m benchmarks.suite --update-baseline
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks import mediapipe_stub
+from benchmarks.bench_compositing import FRAME_SIZES, make_frame, make_garment
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'baseline.json')
+
+# Bumped when cases change in a way that makes old results incomparable
+SCHEMA_VERSION = 1
+
+
+def measure(fn, repeat):
+    """Best and median milliseconds of repeat calls, after one warm-up call"""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return {'best_ms': round(min(samples), 3),
+            'median_ms': round(statistics.median(samples), 3), 'repeat': repeat}
+
+
+def make_white_garment(width=500, height=600):
+    """Synthetic BGR garment photo on a white background"""
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    cv2.rectangle(image, (width // 5, height // 4), (4 * width // 5, height - 10),
+                  (40, 90, 200), -1)
+    cv2.circle(image, (width // 2, height // 4), width // 8, (255, 255, 255), -1)
+    return image
+
+
+def make_camera_frame(width, height):
+    """Noise frame smoothed so its JPEG resembles a camera frame"""
+    return cv2.GaussianBlur(make_frame(width, height), (9, 9), 0)
+
+
+def garment_cases():
+    """Cases that do not depend on the frame size"""
+    from ml_models import earring_tryon, tshirt_tryon
+
+    photo = make_white_garment()
+    return [
+        ('remove_white_background/tshirt',
+         lambda: tshirt_tryon.remove_white_background(photo.copy())),
+        ('remove_white_background/earring',
+         lambda: earring_tryon.remove_white_background(photo.copy())),
+    ]
+
+
+def frame_cases(name, width, height):
+    """Compositing cases on one frame size"""
+    from ml_models import earring_tryon, tshirt_tryon
+    from ml_models.assets import GarmentAsset, premultiply
+
+    frame = make_camera_frame(width, height)
+    garment = make_garment()
+    shirt = GarmentAsset(('synthetic-shirt', None), premultiply(garment))
+    earring = GarmentAsset(('synthetic-earring', None),
+                           premultiply(make_garment(100, 150, seed=2)))
+    # Boxes as produced by fallback_detection
+    body_box = [width // 4, height // 8, width // 2, height // 2]
+    face_box = [width // 3, height // 6, width // 3, height // 3]
+    shirt_w = width // 2
+    shirt_h = int(shirt_w * 1.4)
+    return [
+        (f'overlay_image/tshirt/{name}',
+         lambda: tshirt_tryon.overlay_image(frame.copy(), garment, width // 4,
+                                            height // 8, shirt_w, shirt_h)),
+        (f'overlay_image/earring/{name}',
+         lambda: earring_tryon.overlay_image(frame.copy(), garment, width // 4,
+                                             height // 8, shirt_w, shirt_h)),
+        (f'simple_tshirt_tryon/{name}',
+         lambda: tshirt_tryon.simple_tshirt_tryon(frame, body_box, tshirt=shirt)),
+        (f'simple_earring_tryon/{name}',
+         lambda: earring_tryon.simple_earring_tryon(frame, face_box,
+                                                    left_earring=earring,
+                                                    right_earring=earring)),
+    ]
+
+
+def route_cases(client, name, width, height):
+    """Flask routes through the test client, on one frame size"""
+    frame = make_camera_frame(width, height)
+    jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+
+    def post_json(path, body):
+        def call():
+            response = client.post(path, json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+        return call
+
+    def post_image(path):
+        def call():
+            response = client.post(path, data=jpeg, content_type='image/jpeg')
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+        return call
+
+    return [
+        (f'route/try-on tshirt/{name}',
+         post_json('/api/try-on', {'type': 'tshirt', 'image': data_url})),
+        (f'route/try-on earrings/{name}',
+         post_json('/api/try-on', {'type': 'earrings', 'image': data_url})),
+        (f'route/try-on tshirt,earrings/{name}',
+         post_json('/api/try-on', {'type': 'tshirt,earrings', 'image': data_url})),
+        (f'route/try-on/tshirt/{name}',
+         post_json('/api/try-on/tshirt', {'image': data_url})),
+        (f'route/try-on/image tshirt/{name}',
+         post_image('/api/try-on/image?type=tshirt')),
+        (f'route/try-on/earrings/image/{name}',
+         post_image('/api/try-on/earrings/image')),
+    ]
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(repeat=7, sizes=None, match=None, log=print):
+    """
+    Run the suite
+
+    Args:
+        repeat: Timed calls per case
+        sizes: Frame size names to include (default: all)
+        match: Only run cases whose name contains this string
+
+    Returns:
+        Result dict (schema, environment, cases: name -> timings)
+    """
+    # Quiet, deterministic server: the stub, no process pool, and no result
+    # cache (the routes resubmit the same frame)
+    os.environ['WEARX_EXECUTION_MODE'] = 'thread'
+    os.environ['WEARX_RESULT_CACHE_BYTES'] = '0'
+    if 'tryon' not in sys.modules:
+        mediapipe_stub.install()
+    from app import app
+
+    client = app.test_client()
+    cases = garment_cases()
+    for name, width, height in FRAME_SIZES:
+        if sizes and name not in sizes:
+            continue
+        cases += frame_cases(name, width, height)
+        cases += route_cases(client, name, width, height)
+
+    results = {}
+    for case, fn in cases:
+        if match and match not in case:
+            continue
+        results[case] = measure(fn, repeat)
+        log(f"{case:<42}{results[case]['best_ms']:>10.2f} ms")
+    return {'schema': SCHEMA_VERSION, 'environment': environment(),
+            'cases': results}
+
+
+def compare(results, baseline, threshold=0.5, min_delta=0.2):
+    """
+    Compare results with a baseline by best time
+
+    Returns:
+        (rows, regressions): rows of (case, baseline ms or None, ms, ratio
+        or None, status) and the number of regressed cases
+    """
+    rows = []
+    regressions = 0
+    base_cases = baseline.get('cases', {})
+    for case, timing in results['cases'].items():
+        base = base_cases.get(case)
+        if base is None:
+            rows.append((case, None, timing['best_ms'], None, 'new'))
+            continue
+        ratio = timing['best_ms'] / base['best_ms'] if base['best_ms'] else 1.0
+        regressed = (ratio > 1.0 + threshold
+                     and timing['best_ms'] - base['best_ms'] > min_delta)
+        regressions += regressed
+        rows.append((case, base['best_ms'], timing['best_ms'], ratio,
+                     'REGRESSION' if regressed else 'ok'))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--sizes", nargs="+", choices=[s[0] for s in FRAME_SIZES])
+    parser.add_argument("--match", help="Only cases whose name contains this")
+    parser.add_argument("--output", help="Write the results as JSON here")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    # Generous by default: best-of-N timings on a shared machine still
+    # wander by 30%; use a tighter threshold on a quiet one
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Allowed slowdown as a fraction (0.5 = 50%%)")
+    parser.add_argument("--min-delta", type=float, default=0.2,
+                        help="Ignore slowdowns smaller than this many ms")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.sizes, args.match)
+    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline updated: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; create it with --update-baseline")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('schema') != SCHEMA_VERSION:
+        print("Baseline schema differs; refresh it with --update-baseline")
+        sys.exit(1)
+    if baseline.get('environment') != results['environment']:
+        print(f"Note: baseline recorded on {baseline.get('environment')}")
+
+    rows, regressions = compare(results, baseline, args.threshold, args.min_delta)
+    print(f"{'case':<42}{'base ms':>10}{'ms':>10}{'ratio':>8}  status")
+    for case, base_ms, ms, ratio, status in rows:
+        base_str = f"{base_ms:.2f}" if base_ms is not None else "-"
+        ratio_str = f"{ratio:.2f}" if ratio is not None else "-"
+        print(f"{case:<42}{base_str:>10}{ms:>10.2f}{ratio_str:>8}  {status}")
+    if regressions:
+        print(f"\n{regressions} case(s) regressed by more than "
+              f"{args.threshold:.0%}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Image encode/decode helpers shared by the JSON and binary try-on endpoints.
+
+Decoding goes straight to BGR with cv2.imdecode. When the frame is only
+needed at a smaller size, JPEGs are decoded at 1/2, 1/4 or 1/8 scale by
+libjpeg's DCT scaling, which skips most of the inverse-DCT and colour
+conversion work. Encoding settings (format, quality, chroma subsampling,
+optimize/progressive) come from OutputFormat, with defaults from the
+environment.
+"""
+import base64
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Start-of-frame markers, which carry the image size (DHT, JPG and DAC
+# share the 0xC0-0xCF range but are not SOF segments)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# imread flags for DCT-scaled decoding, by reduction factor
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Output formats: name -> (imencode extension, MIME type)
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    'png': ('.png', 'image/png'),
+}
+
+# Chroma subsampling (JPEG), where this OpenCV build supports choosing it
+SUBSAMPLING = {
+    name: getattr(cv2, f'IMWRITE_JPEG_SAMPLING_FACTOR_{name}')
+    for name in ('444', '422', '420')
+    if hasattr(cv2, f'IMWRITE_JPEG_SAMPLING_FACTOR_{name}')
+}
+
+
+class ImageDecodeError(ValueError):
+    """Raised when request bytes cannot be decoded into an image"""
+
+
+class OutputFormatError(ValueError):
+    """Raised when requested encoder settings are invalid"""
+
+
+def jpeg_size(data):
+    """
+    Read (width, height) from a JPEG's start-of-frame header
+
+    Args:
+        data: bytes, bytearray or memoryview holding the encoded image
+
+    Returns:
+        (width, height), or None if data is not a (parsable) JPEG
+    """
+    buf = memoryview(data)
+    n = len(buf)
+    if n < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < n:
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers without a length
+            i += 2
+            continue
+        if marker in _SOF_MARKERS:
+            height = buf[i + 5] << 8 | buf[i + 6]
+            width = buf[i + 7] << 8 | buf[i + 8]
+            return width, height
+        i += 2 + (buf[i + 2] << 8 | buf[i + 3])
+    return None
+
+
+def reduction_factor(data, max_side):
+    """
+    Largest DCT scaling factor (1, 2, 4 or 8) that keeps the decoded long
+    side at least max_side; 1 for non-JPEG input
+    """
+    size = jpeg_size(data)
+    if size is None or not max_side:
+        return 1
+    long_side = max(size)
+    for factor, _ in _REDUCED_FLAGS:
+        if long_side / factor >= max_side:
+            return factor
+    return 1
+
+
+def decode_image(data, max_side=None):
+    """
+    Decode encoded image bytes (JPEG, PNG, ...) straight to a BGR frame
+
+    Args:
+        data: bytes, bytearray or memoryview holding the encoded image
+        max_side: Long side the frame will be shrunk to anyway; JPEGs are
+            then decoded at the smallest 1/2, 1/4 or 1/8 scale that is
+            still at least this large
+
+    Returns:
+        BGR uint8 frame
+    """
+    buf = np.frombuffer(memoryview(data), dtype=np.uint8)
+    if buf.size == 0:
+        raise ImageDecodeError("Empty image data")
+    factor = reduction_factor(buf, max_side) if max_side else 1
+    flags = dict(_REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    frame = cv2.imdecode(buf, flags)
+    if frame is None:
+        raise ImageDecodeError("Could not decode image data")
+    return frame
+
+
+def decode_data_url(data_url, max_side=None):
+    """
+    Decode a `data:image/...;base64,` URL (or bare base64 string) to BGR
+
+    Args:
+        data_url: Data URL string as produced by canvas.toDataURL
+        max_side: See decode_image
+
+    Returns:
+        BGR uint8 frame
+    """
+    _, _, payload = data_url.rpartition(',')
+    try:
+        image_bytes = base64.b64decode(payload)
+    except ValueError as e:
+        raise ImageDecodeError(f"Invalid base64 image data: {e}")
+    return decode_image(image_bytes, max_side)
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+class OutputFormat(namedtuple('OutputFormat',
+                              'format quality subsampling optimize progressive')):
+    """
+    Encoder settings
+
+    Fields:
+        format: 'jpeg', 'webp' or 'png'
+        quality: JPEG/WebP quality 1-100 (PNG: zlib level 0-9)
+        subsampling: JPEG chroma subsampling '444', '422' or '420'
+        optimize: JPEG optimized Huffman tables (smaller, slower)
+        progressive: Progressive JPEG
+    """
+
+    @classmethod
+    def parse(cls, format=None, quality=None, subsampling=None, optimize=None,
+              progressive=None, defaults=None):
+        """
+        Build settings from (string) request parameters, falling back to
+        defaults for the ones that are None or empty
+        """
+        base = defaults or DEFAULT_OUTPUT
+        fmt = (format or base.format).lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if fmt not in FORMATS:
+            raise OutputFormatError(
+                f"Unsupported format {format!r}, expected one of {sorted(FORMATS)}"
+            )
+        if quality in (None, ''):
+            quality = base.quality if fmt == base.format else None
+        if quality is not None:
+            try:
+                quality = int(quality)
+            except (TypeError, ValueError):
+                raise OutputFormatError(f"Invalid quality {quality!r}")
+            limit = 9 if fmt == 'png' else 100
+            if not 0 <= quality <= limit:
+                raise OutputFormatError(f"quality must be between 0 and {limit}")
+        subsampling = subsampling or base.subsampling
+        if subsampling:
+            subsampling = str(subsampling).replace(':', '')
+            if subsampling not in ('444', '422', '420'):
+                raise OutputFormatError(
+                    f"Invalid subsampling {subsampling!r}, expected 444, 422 or 420"
+                )
+        optimize = base.optimize if optimize in (None, '') else _flag(optimize)
+        progressive = (base.progressive if progressive in (None, '')
+                       else _flag(progressive))
+        return cls(fmt, quality, subsampling, optimize, progressive)
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.format][1]
+
+    def params(self):
+        """imencode parameter list"""
+        params = []
+        if self.format == 'jpeg':
+            if self.quality is not None:
+                params += [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+            if self.subsampling in SUBSAMPLING:
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR,
+                           SUBSAMPLING[self.subsampling]]
+            if self.optimize:
+                params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            if self.progressive:
+                params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        elif self.format == 'webp':
+            if self.quality is not None:
+                params += [cv2.IMWRITE_WEBP_QUALITY, max(1, self.quality)]
+        elif self.quality is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, self.quality]
+        return params
+
+    def encode(self, frame):
+        """
+        Encode a BGR frame
+
+        Returns:
+            1-D uint8 array holding the encoded bytes
+        """
+        ok, buffer = cv2.imencode(FORMATS[self.format][0], frame, self.params())
+        if not ok:
+            raise ValueError(f"Could not encode frame as {self.format}")
+        return buffer
+
+    def encode_data_url(self, frame):
+        """Encode a BGR frame as a base64 data URL"""
+        result_image = base64.b64encode(self.encode(frame)).decode('utf-8')
+        return f'data:{self.mimetype};base64,{result_image}'
+
+
+# Server-wide JPEG defaults: quality 95 with 4:2:0 chroma, as cv2 does
+DEFAULT_OUTPUT = OutputFormat.parse(
+    'jpeg',
+    os.environ.get("WEARX_JPEG_QUALITY", "95"),
+    os.environ.get("WEARX_JPEG_SUBSAMPLING", "420"),
+    os.environ.get("WEARX_JPEG_OPTIMIZE", "0"),
+    os.environ.get("WEARX_JPEG_PROGRESSIVE", "0"),
+    defaults=OutputFormat('jpeg', None, None, False, False),
+)
+
+
+def encode_jpeg(frame):
+    """
+    Encode a BGR frame as JPEG with the default settings
+
+    Returns:
+        1-D uint8 array holding the encoded bytes
+    """
+    return DEFAULT_OUTPUT.encode(frame)
+
+
+def encode_data_url(frame):
+    """Encode a BGR frame as a base64 JPEG data URL"""
+    return DEFAULT_OUTPUT.encode_data_url(frame)
@@ -0,0 +1,224 @@
+"""
+Deadline-aware scheduling: a request may carry a latency budget, and the
+pipeline picks the path that can still meet it.
+
+The scheduler keeps exponentially weighted estimates of each stage's cost
+and counts the detections in flight per detector. Before detection, a
+pipeline rendering under a deadline asks for a plan:
+    detect: the detector's queueing plus inference plus the remaining
+        stages fit in the budget
+    degrade: they do not; the session's last detection is placed again,
+        or without one the frame is placed from the heuristic box of
+        fallback_detection (the pipeline's fallback stage)
+    shed: not even the fallback fits; DeadlineExceeded is raised and the
+        request is answered with a fast 503
+
+Estimates start at zero, so the first requests always detect; the first
+sample of each stage (cold caches, model and asset loading) is not used.
+An estimate is only refreshed when its stage runs, so while requests
+degrade, the pipeline probes the detector off the request path every
+probe_interval seconds (claim_probe): a background detection on a copy of
+a degraded request's frame, whose time replaces the estimate, so one slow
+call does not disable detection for good. Deadlines are
+time.monotonic() values, which inference worker processes share.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Budget applied to requests that do not set one; 0 means no deadline
+DEFAULT_BUDGET_MS = float(os.environ.get("WEARX_DEADLINE_MS", "0"))
+
+# Stages whose cost the plan needs besides detection
+PLAN_STAGES = ('place', 'composite', 'cached', 'fallback', 'encode')
+
+deadline_plans = metrics.registry.counter(
+    'tryon_deadline_plans_total', 'Plans made for requests with a deadline',
+    ('item', 'plan')
+)
+stage_cost_estimate = metrics.registry.gauge(
+    'tryon_stage_cost_estimate_seconds',
+    'Scheduler estimate of a stage cost (detect: per detector)', ('scope', 'stage')
+)
+detections_in_flight = metrics.registry.gauge(
+    'tryon_detections_in_flight', 'Detector calls running or queued', ('detector',)
+)
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a request's budget cannot be met, not even by the fallback"""
+
+
+class Deadline:
+    """
+    Time by which a request must be answered
+
+    Args:
+        budget: Seconds the request may take
+        start: time.monotonic() when the request arrived (default: now)
+    """
+    __slots__ = ('budget', 'expires_at')
+
+    def __init__(self, budget, start=None):
+        self.budget = budget
+        self.expires_at = (time.monotonic() if start is None else start) + budget
+
+    def remaining(self):
+        """Seconds left (negative once expired)"""
+        return self.expires_at - time.monotonic()
+
+    def __repr__(self):
+        return f"Deadline({self.budget:.3f}s, {self.remaining():.3f}s left)"
+
+
+class Scheduler:
+    """
+    Stage cost estimates and detector queue depths for deadline planning
+
+    Args:
+        alpha: Weight of a new sample in the moving averages
+        probe_interval: Seconds after a detector's last call when a request
+            that degrades starts a background probe to refresh its estimate
+    """
+
+    def __init__(self, alpha=0.2, probe_interval=1.0):
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self._costs = {}
+        self._warm = set()
+        self._in_flight = {}
+        self._capacity = {}
+        self._last_detect = {}
+        self._lock = threading.Lock()
+
+    def set_capacity(self, detector, capacity):
+        """Number of calls a detector runs at once (its pool size)"""
+        with self._lock:
+            self._capacity[detector] = max(1, int(capacity))
+
+    def _update(self, key, seconds):
+        if key not in self._warm:
+            # Cold start: the first call loads models and assets
+            self._warm.add(key)
+            return
+        cost = self._costs.get(key)
+        self._costs[key] = (seconds if cost is None
+                            else cost + self.alpha * (seconds - cost))
+
+    def cost(self, scope, stage):
+        """Estimated seconds of a stage (0.0 until observed)"""
+        return self._costs.get((scope, stage), 0.0)
+
+    def observe(self, item, timings):
+        """Update the estimates from a render's or codec's stage timings"""
+        with self._lock:
+            for stage in PLAN_STAGES:
+                if stage in timings:
+                    self._update((item, stage), timings[stage])
+
+    def observe_detect(self, detectors, seconds, queued, probe=False):
+        """
+        Update a detector's inference estimate. Calls that queued behind
+        others, or ran several detectors, do not measure one inference. A
+        probe's time replaces the estimate instead of being averaged in.
+        """
+        if queued or len(detectors) != 1:
+            return
+        key = (detectors[0], 'detect')
+        with self._lock:
+            if probe:
+                self._warm.add(key)
+                self._costs[key] = seconds
+            else:
+                self._update(key, seconds)
+
+    @contextmanager
+    def detecting(self, detectors):
+        """
+        Count a detection in flight for the block
+
+        Yields:
+            True if a detector was already running at capacity (the call
+            queues for an instance)
+        """
+        with self._lock:
+            queued = False
+            now = time.monotonic()
+            for name in detectors:
+                running = self._in_flight.get(name, 0)
+                queued |= running >= self._capacity.get(name, 1)
+                self._in_flight[name] = running + 1
+                self._last_detect[name] = now
+        for name in detectors:
+            detections_in_flight.inc(detector=name)
+        try:
+            yield queued
+        finally:
+            with self._lock:
+                for name in detectors:
+                    self._in_flight[name] -= 1
+            for name in detectors:
+                detections_in_flight.dec(detector=name)
+
+    def detect_estimate(self, detectors):
+        """
+        Seconds a new detection would take: one inference per wave of the
+        calls already in flight, detectors in sequence
+        """
+        total = 0.0
+        with self._lock:
+            for name in detectors:
+                waves = math.ceil((self._in_flight.get(name, 0) + 1)
+                                  / float(self._capacity.get(name, 1)))
+                total += self._costs.get((name, 'detect'), 0.0) * waves
+        return total
+
+    def claim_probe(self, detectors):
+        """
+        True if the detectors are idle and none ran for probe_interval; the
+        caller then probes them, off the request path (concurrent callers
+        get False)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not all(not self._in_flight.get(name, 0)
+                       and now - self._last_detect.get(name, 0.0) >= self.probe_interval
+                       for name in detectors):
+                return False
+            for name in detectors:
+                self._last_detect[name] = now
+            return True
+
+    def plan(self, item, detectors, deadline):
+        """'detect', 'degrade' or 'shed' for a render under a deadline"""
+        remaining = deadline.remaining()
+        rest = sum(self.cost(item, stage)
+                   for stage in ('place', 'composite', 'encode'))
+        degraded = max(self.cost(item, 'cached') + rest,
+                       self.cost(item, 'fallback') + self.cost(item, 'encode'))
+        if remaining > self.detect_estimate(detectors) + rest:
+            plan = 'detect'
+        elif remaining > degraded:
+            plan = 'degrade'
+        else:
+            plan = 'shed'
+        deadline_plans.inc(item=item, plan=plan)
+        return plan
+
+    def collect(self):
+        """Metrics collector publishing the cost estimates"""
+        with self._lock:
+            costs = dict(self._costs)
+        for (scope, stage), seconds in costs.items():
+            stage_cost_estimate.set(seconds, scope=scope, stage=stage)
+
+
+# Shared scheduler for the try-on pipelines
+scheduler = Scheduler(
+    alpha=float(os.environ.get("WEARX_SCHEDULER_ALPHA", "0.2")),
+    probe_interval=float(os.environ.get("WEARX_SCHEDULER_PROBE_INTERVAL", "1.0")),
+)
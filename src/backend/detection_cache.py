@@ -0,0 +1,166 @@
+"""
+Cache of detector results for near-duplicate webcam frames.
+
+Frames are keyed by a 64-bit difference hash (dHash) of a 9x8 grayscale
+thumbnail. A lookup hits when the same session sent a frame of the same size
+whose hash is within a small Hamming distance, so a subject standing still
+reuses the previous landmarks and skips MediaPipe inference.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import metrics
+from ml_models.compositing import scratch
+
+# Bit weights for packing the 64 dHash comparisons into an int
+_BIT_WEIGHTS = (1 << np.arange(64, dtype=np.uint64)).astype(np.uint64)
+
+cache_lookups = metrics.registry.counter(
+    'tryon_detection_cache_lookups_total', 'Detection cache lookups by result',
+    ('detector', 'result')
+)
+
+
+def frame_hash(frame):
+    """
+    Perceptual difference hash of a BGR (or grayscale) frame
+
+    Returns:
+        64-bit int; similar frames differ in few bits
+    """
+    if frame.ndim == 2:
+        gray = frame
+    else:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                            dst=scratch('gray', frame.shape[:2], np.uint8))
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int(_BIT_WEIGHTS[bits].sum())
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DetectionCache:
+    """
+    Per-session LRU of recent (frame hash, detection) pairs with a TTL
+
+    Args:
+        max_sessions: Sessions kept before the least recently used is dropped
+        per_session: Recent frames remembered per (session, detector)
+        ttl: Seconds an entry stays valid
+        max_distance: Largest Hamming distance between hashes that still hits
+    """
+
+    def __init__(self, max_sessions=1024, per_session=4, ttl=2.0, max_distance=4):
+        self.max_sessions = max_sessions
+        self.per_session = per_session
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, session_id, detector_name, frame, frame_key=None):
+        """
+        Find a cached detection for a near-duplicate frame
+
+        Args:
+            session_id: Client session the frame belongs to
+            detector_name: Which detector produced the cached result
+            frame: BGR frame
+            frame_key: Precomputed frame_hash(frame) (optional)
+
+        Returns:
+            (hit, detection, frame_key); detection may legitimately be None
+            (nothing found in the earlier frame)
+        """
+        if frame_key is None:
+            frame_key = frame_hash(frame)
+        key = (session_id, detector_name)
+        now = time.monotonic()
+        shape = frame.shape[:2]
+
+        with self._lock:
+            entries = self._sessions.get(key)
+            if entries:
+                self._sessions.move_to_end(key)
+                entries[:] = [e for e in entries if now - e[2] <= self.ttl]
+                for cached_key, cached_shape, _, detection in reversed(entries):
+                    if (cached_shape == shape
+                            and hamming(cached_key, frame_key) <= self.max_distance):
+                        self.hits += 1
+                        cache_lookups.inc(detector=detector_name, result='hit')
+                        return True, detection, frame_key
+            self.misses += 1
+        cache_lookups.inc(detector=detector_name, result='miss')
+        return False, None, frame_key
+
+    def store(self, session_id, detector_name, frame, detection, frame_key=None):
+        """Remember a detection result for a session's frame"""
+        if frame_key is None:
+            frame_key = frame_hash(frame)
+        key = (session_id, detector_name)
+        entry = (frame_key, frame.shape[:2], time.monotonic(), detection)
+
+        with self._lock:
+            entries = self._sessions.get(key)
+            if entries is None:
+                entries = self._sessions[key] = []
+            else:
+                self._sessions.move_to_end(key)
+            entries.append(entry)
+            del entries[:-self.per_session]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+def cached_detector(detector, cache):
+    """
+    Wrap a detector stage so it consults the cache when given a session id
+
+    The wrapped detector takes (frame, session_id=None); without a session id
+    it always runs the detector.
+    """
+    name = detector.__name__
+
+    def detect(frame, session_id=None):
+        if session_id is None:
+            return detector(frame)
+        hit, detection, frame_key = cache.lookup(session_id, name, frame)
+        if hit:
+            return detection
+        detection = detector(frame)
+        cache.store(session_id, name, frame, detection, frame_key)
+        return detection
+
+    detect.__name__ = name
+    return detect
+
+
+# Shared cache for the try-on pipelines
+detection_cache = DetectionCache(
+    ttl=float(os.environ.get("WEARX_DETECTION_CACHE_TTL", "2.0")),
+    max_distance=int(os.environ.get("WEARX_DETECTION_CACHE_DISTANCE", "4")),
+)
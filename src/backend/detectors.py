@@ -0,0 +1,202 @@
+"""
+Bounded pools of MediaPipe detector instances.
+
+MediaPipe graph objects (Pose, FaceMesh) are not safe for concurrent
+process() calls, so each request thread checks out its own instance.
+Instances are created on first checkout, or up front by warm_up(), which
+can run in a background thread (start_warm_up()) while the server starts.
+"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+
+# Seconds a request waits for a free detector before giving up
+DEFAULT_CHECKOUT_TIMEOUT = float(os.environ.get("WEARX_DETECTOR_TIMEOUT", "10"))
+
+detector_wait_seconds = metrics.registry.histogram(
+    'tryon_detector_wait_seconds', 'Time spent waiting for a free detector instance',
+    ('detector',)
+)
+detector_in_use = metrics.registry.gauge(
+    'tryon_detectors_in_use', 'Detector instances currently checked out',
+    ('detector',)
+)
+detector_pool_size = metrics.registry.gauge(
+    'tryon_detector_pool_size', 'Detector instances per pool', ('detector',)
+)
+detector_timeouts = metrics.registry.counter(
+    'tryon_detector_timeouts_total', 'Checkouts that timed out waiting for a detector',
+    ('detector',)
+)
+
+
+class DetectorPoolTimeout(RuntimeError):
+    """Raised when no detector instance became free in time"""
+
+
+def default_pool_size():
+    """Pool size from WEARX_DETECTOR_POOL_SIZE, else the CPU count (max 8)"""
+    size = os.environ.get("WEARX_DETECTOR_POOL_SIZE")
+    if size:
+        return max(1, int(size))
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+class DetectorPool:
+    """
+    Fixed-size pool of detector instances with checkout/return semantics
+
+    Args:
+        name: Pool name used in metrics and log messages
+        factory: Zero-argument callable creating one detector instance
+        size: Number of instances (default: default_pool_size())
+        timeout: Seconds to wait in checkout before DetectorPoolTimeout
+    """
+
+    def __init__(self, name, factory, size=None, timeout=DEFAULT_CHECKOUT_TIMEOUT):
+        self.name = name
+        self.factory = factory
+        self.size = size or default_pool_size()
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._warming = False
+        self.warm_seconds = None
+        self.error = None
+        detector_pool_size.set(self.size, detector=name)
+
+    @property
+    def state(self):
+        """
+        'idle' (nothing created yet), 'loading' (warm-up running), 'ready'
+        (instances can be checked out) or 'failed' (the factory raised and
+        no instance exists)
+        """
+        if self._warming:
+            return 'loading'
+        if self._created:
+            return 'ready'
+        return 'failed' if self.error else 'idle'
+
+    def status(self):
+        """State, instance counts and warm-up time, for the readiness endpoint"""
+        return {
+            'state': self.state,
+            'instances': self._created,
+            'size': self.size,
+            'warm_seconds': (round(self.warm_seconds, 4)
+                             if self.warm_seconds is not None else None),
+            'error': self.error,
+        }
+
+    def _create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.factory()
+        except Exception as e:
+            with self._lock:
+                self._created -= 1
+            self.error = f"{type(e).__name__}: {e}"
+            raise
+
+    def fill(self):
+        """Create all remaining instances up front"""
+        while True:
+            detector = self._create()
+            if detector is None:
+                break
+            self._idle.put(detector)
+
+    def _get(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        detector = self._create()
+        if detector is not None:
+            return detector
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            detector_timeouts.inc(detector=self.name)
+            raise DetectorPoolTimeout(
+                f"No {self.name} detector free after {timeout:.1f}s"
+            )
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Borrow a detector instance for the duration of the block
+
+        Args:
+            timeout: Seconds to wait for a free instance (default: pool timeout)
+        """
+        start = time.perf_counter()
+        detector = self._get(self.timeout if timeout is None else timeout)
+        detector_wait_seconds.observe(time.perf_counter() - start, detector=self.name)
+        detector_in_use.inc(detector=self.name)
+        try:
+            yield detector
+        finally:
+            detector_in_use.dec(detector=self.name)
+            self._idle.put(detector)
+
+    def warm_up(self, width=256, height=256):
+        """
+        Create every instance and run one inference on a blank frame, so the
+        first real requests do not pay for graph and model initialization.
+        Instances checked out meanwhile are served as soon as they exist.
+        """
+        start = time.perf_counter()
+        self._warming = True
+        try:
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            while True:
+                detector = self._create()
+                if detector is None:
+                    break
+                try:
+                    detector.process(frame)
+                finally:
+                    self._idle.put(detector)
+            self.error = None
+        finally:
+            self._warming = False
+        self.warm_seconds = time.perf_counter() - start
+        print(f"{self.name} detectors ready: {self._created} instance(s) in "
+              f"{self.warm_seconds * 1000:.0f} ms")
+
+    def start_warm_up(self):
+        """Run warm_up() in a daemon thread and return the thread"""
+        def run():
+            try:
+                self.warm_up()
+            except Exception as e:
+                print(f"Warming up {self.name} detectors failed: {e}")
+
+        thread = threading.Thread(target=run, name=f'warm-{self.name}', daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Close idle instances that support it (MediaPipe solutions do)"""
+        while True:
+            try:
+                detector = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            close = getattr(detector, 'close', None)
+            if close is not None:
+                close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,261 @@
+"""
+Optional process-pool execution of the CPU-bound try-on stages.
+
+Enabled with WEARX_EXECUTION_MODE=process. Each worker process imports
+tryon on its own, so it owns its MediaPipe detectors and garment asset
+cache. Frames travel through multiprocessing shared memory instead of being
+pickled: the parent copies the decoded frame into a segment, the worker
+renders and writes the result back into the same segment.
+
+Metrics recorded in a worker (stage timings, fallbacks, detection and asset
+cache lookups, detector waits) go back with each result as the changes to
+the worker's registry, and are merged into the server's registry.
+"""
+import importlib
+import os
+import multiprocessing
+import threading
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+from pipeline import resize_for_output, timed
+
+pool_in_flight = metrics.registry.gauge(
+    'tryon_inference_in_flight', 'Try-on jobs queued or running in the process pool'
+)
+pool_rejected = metrics.registry.counter(
+    'tryon_inference_rejected_total', 'Try-on jobs rejected because the pool queue was full'
+)
+pool_recycles = metrics.registry.counter(
+    'tryon_inference_recycles_total', 'Process pool replacements', ('reason',)
+)
+
+
+class InferencePoolBusy(RuntimeError):
+    """Raised when the pool already has its maximum number of pending jobs"""
+
+
+def execution_mode():
+    """'process' to render in the worker pool, 'thread' (default) otherwise"""
+    return os.environ.get("WEARX_EXECUTION_MODE", "thread").lower()
+
+
+def inference_worker():
+    """True in an inference worker process"""
+    return os.environ.get("WEARX_INFERENCE_WORKER") == "1"
+
+
+def _init_worker():
+    # One detector of each kind per worker; parallelism comes from processes
+    os.environ.setdefault("WEARX_DETECTOR_POOL_SIZE", "1")
+    os.environ["WEARX_INFERENCE_WORKER"] = "1"
+    # Load detectors and pipelines up front
+    importlib.import_module("tryon")
+
+
+# Worker's registry as last reported to the server
+_reported_metrics = None
+
+
+def _metric_changes():
+    """Changes to the worker's metrics since the previous call"""
+    global _reported_metrics
+    changes, _reported_metrics = metrics.registry.changes(_reported_metrics)
+    return changes
+
+
+def _render_in_worker(key, shm_name, shape, dtype, session_id=None, roi=None,
+                      detect_size=None, deadline=None):
+    """
+    Worker entry point: render the frame in shared memory in place
+
+    Returns:
+        (stage timings, metric changes, worker pid)
+    """
+    import tryon
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        timings = {}
+        # Render straight into the shared segment
+        result = tryon.pipeline_by_key(key).render(frame, timings, session_id,
+                                                   roi, detect_size, out=frame,
+                                                   deadline=deadline)
+        if result is not frame:
+            raise ValueError(f"Pipeline {key} did not render in place")
+        del frame
+        return timings, _metric_changes(), os.getpid()
+    finally:
+        shm.close()
+
+
+class InferencePool:
+    """
+    Bounded process pool that renders try-on frames
+
+    Args:
+        workers: Worker process count (default: CPU count)
+        max_queue: Jobs allowed to wait beyond one per worker before
+            submissions are rejected with InferencePoolBusy
+        max_tasks_per_worker: Replace the pool after this many jobs per
+            worker (0 disables recycling); running jobs finish on the old pool
+        timeout: Seconds to wait for a rendered frame
+    """
+
+    def __init__(self, workers=None, max_queue=None, max_tasks_per_worker=None,
+                 timeout=None):
+        env = os.environ.get
+        self.workers = workers or int(env("WEARX_INFERENCE_WORKERS", 0)) or os.cpu_count() or 1
+        self.max_queue = (max_queue if max_queue is not None
+                          else int(env("WEARX_INFERENCE_QUEUE", self.workers * 2)))
+        self.max_tasks_per_worker = (
+            max_tasks_per_worker if max_tasks_per_worker is not None
+            else int(env("WEARX_WORKER_MAX_TASKS", 1000))
+        )
+        self.timeout = timeout or float(env("WEARX_INFERENCE_TIMEOUT", 30))
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        self._tasks = 0
+
+    @property
+    def max_pending(self):
+        return self.workers + self.max_queue
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=self._context,
+                                   initializer=_init_worker)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            elif (self.max_tasks_per_worker
+                  and self._tasks >= self.max_tasks_per_worker * self.workers):
+                self._replace_executor('recycle')
+            self._tasks += 1
+            return self._executor
+
+    def _replace_executor(self, reason):
+        # Caller holds the lock. The old pool finishes its running jobs and
+        # its workers exit in the background.
+        old, self._executor = self._executor, self._new_executor()
+        self._tasks = 0
+        # Gauges of the old workers; their jobs still merge their counts
+        metrics.registry.forget_sources()
+        pool_recycles.inc(reason=reason)
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                pool_rejected.inc()
+                raise InferencePoolBusy(
+                    f"Inference queue full ({self._pending} pending)"
+                )
+            self._pending += 1
+        pool_in_flight.inc()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        pool_in_flight.dec()
+
+    def render(self, pipeline, frame, timings=None, session_id=None, roi=None,
+               detect_size=None, output_size=None, deadline=None):
+        """
+        Render a frame with a pipeline in a worker process
+
+        Args:
+            pipeline: TryOnPipeline (looked up by key in the worker)
+            frame: BGR uint8 input frame
+            timings: Optional dict that receives per-stage seconds
+            session_id: Client session for the worker's detection cache
+            roi, detect_size: Passed on to the pipeline
+            deadline: Passed on to the pipeline, which plans in the worker
+                with the time left after queueing here
+            output_size: The frame is downscaled here, before it is copied
+                into shared memory
+
+        Returns:
+            Rendered frame
+        """
+        resize_timings = {}
+        frame, roi = resize_for_output(frame, roi, output_size, resize_timings)
+        metrics.observe_stages(pipeline.name, resize_timings)
+        if timings is not None:
+            timings.update(resize_timings)
+        self._acquire()
+        future = None
+        shm = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+        try:
+            shared = np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)
+            shared[...] = frame
+            executor = self._get_executor()
+            future = executor.submit(_render_in_worker, pipeline.key, shm.name,
+                                     frame.shape, frame.dtype.str, session_id,
+                                     roi, detect_size, deadline)
+            # The job holds its slot until the worker is done with it, even
+            # if this request stops waiting
+            future.add_done_callback(lambda _: self._release())
+            try:
+                stage_timings, changes, pid = future.result(timeout=self.timeout)
+            except futures.TimeoutError:
+                # Drop the job if it has not started yet
+                future.cancel()
+                raise
+            except BrokenProcessPool:
+                with self._lock:
+                    if self._executor is executor:
+                        self._replace_executor('broken')
+                raise
+            # The worker observed the stage timings into these changes
+            with self._lock:
+                current = self._executor is executor
+            metrics.registry.merge(changes, pid if current else None)
+            if timings is not None:
+                timings.update(stage_timings)
+            result = shared.copy()
+            del shared
+            return result
+        finally:
+            shm.close()
+            shm.unlink()
+            if future is None:
+                self._release()
+
+    def process(self, pipeline, data, timings=None, decoder=None, encoder=None,
+                session_id=None, roi=None, detect_size=None, output_size=None,
+                deadline=None):
+        """Same as TryOnPipeline.process, rendering in the worker pool"""
+        codec_timings = {}
+        try:
+            with timed(codec_timings, 'decode'):
+                if output_size and roi is None:
+                    frame = (decoder or pipeline.decoder)(data,
+                                                          max_side=output_size)
+                else:
+                    frame = (decoder or pipeline.decoder)(data)
+            frame = self.render(pipeline, frame, timings, session_id, roi,
+                                detect_size, output_size, deadline)
+            with timed(codec_timings, 'encode'):
+                return (encoder or pipeline.encoder)(frame)
+        finally:
+            metrics.observe_stages(pipeline.name, codec_timings)
+            if timings is not None:
+                timings.update(codec_timings)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
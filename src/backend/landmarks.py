@@ -0,0 +1,125 @@
+"""
+Landmark geometry shared by the detectors, the placement stages, the ROI
+crop and the stream tracker.
+
+Detectors convert MediaPipe results once into a Landmarks adapter holding an
+(N, 3) float32 array of normalized x, y, z (normalized coordinates survive
+resizing the frame). Boxes, anchors and distances are then computed with
+NumPy instead of Python loops over hundreds of landmark objects, while
+indexing and iteration still yield objects with .x/.y/.z like MediaPipe's.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+Landmark = namedtuple('Landmark', 'x y z')
+
+# Pose landmark indices
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+
+# FaceMesh landmark indices used as earring anchors
+LEFT_EAR = 234
+RIGHT_EAR = 454
+
+
+class Landmarks:
+    """
+    Read-only (N, 3) array of normalized landmarks with vectorized geometry
+
+    Pixel results truncate like int(lm.x * width) did.
+
+    Args:
+        points: (N, 3) array of normalized x, y, z
+    """
+
+    __slots__ = ('points',)
+
+    def __init__(self, points):
+        self.points = np.array(points, dtype=np.float32).reshape(-1, 3)
+        self.points.flags.writeable = False
+
+    @classmethod
+    def from_mediapipe(cls, landmarks):
+        """Convert a MediaPipe landmark list (anything with .x/.y/.z) once"""
+        landmarks = list(landmarks)
+        points = np.fromiter((v for lm in landmarks for v in (lm.x, lm.y, lm.z)),
+                             dtype=np.float32, count=3 * len(landmarks))
+        return cls(points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, index):
+        x, y, z = self.points[index]
+        return Landmark(float(x), float(y), float(z))
+
+    def __iter__(self):
+        for x, y, z in self.points.tolist():
+            yield Landmark(x, y, z)
+
+    def _scale(self, shape, indices=None, clip=False):
+        # float64 like the float products of the original per-landmark code
+        h, w = shape[:2]
+        xy = self.points[:, :2] if indices is None else self.points[indices, :2]
+        if clip:
+            xy = np.clip(xy, 0.0, 1.0)
+        return xy.astype(np.float64) * (w, h)
+
+    def pixels(self, shape, indices=None):
+        """
+        Pixel coordinates for a frame shape
+
+        Args:
+            shape: Frame shape (h, w, ...)
+            indices: Landmark index or indices (default: all)
+
+        Returns:
+            (2,) int array for a single index, else (k, 2)
+        """
+        return self._scale(shape, indices).astype(np.int64)
+
+    def point(self, shape, index):
+        """(x, y) pixel tuple of one landmark"""
+        x, y = self.pixels(shape, index)
+        return int(x), int(y)
+
+    def box(self, shape, indices=None, clip=False):
+        """
+        Pixel bounding box [x, y, width, height] of the landmarks
+
+        Args:
+            shape: Frame shape
+            indices: Restrict to these landmarks (default: all)
+            clip: Clamp landmarks outside the frame to its edges first
+        """
+        px = self._scale(shape, indices, clip).astype(np.int64)
+        x0, y0 = px.min(axis=0)
+        x1, y1 = px.max(axis=0)
+        return [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]
+
+    def distance(self, shape, a, b):
+        """
+        Pixel distance between landmarks a and b (indices or arrays of
+        indices, giving an array of distances)
+        """
+        return np.linalg.norm(self.pixels(shape, a) - self.pixels(shape, b),
+                              axis=-1)
+
+
+def as_landmarks(landmarks):
+    """Landmarks adapter for MediaPipe landmarks, an array or an adapter"""
+    if landmarks is None or isinstance(landmarks, Landmarks):
+        return landmarks
+    if isinstance(landmarks, np.ndarray):
+        return Landmarks(landmarks)
+    return Landmarks.from_mediapipe(landmarks)
+
+
+def landmarks_to_array(landmarks):
+    """(N, 3) float32 array of normalized x, y, z (read-only)"""
+    return as_landmarks(landmarks).points
+
+
+def array_to_landmarks(points):
+    return Landmarks(points)
@@ -0,0 +1,347 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Observations are a bisect plus a few integer adds under a lock, so the
+instrumentation is cheap enough to leave on in production.
+
+Inference worker processes record into their own registry and ship what
+changed with each result (Registry.changes); the server merges it into its
+registry (Registry.merge), so /metrics covers the workers too.
+"""
+import threading
+from bisect import bisect_left
+
+# Latency buckets in seconds, from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.kind}']
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def dump(self):
+        """Copy of the raw values by label key"""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(Metric):
+    """Monotonic counter, optionally split by labels"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self, **labels):
+        """Sum over the label sets that have the given label values"""
+        match = [(self.labelnames.index(n), str(v)) for n, v in labels.items()]
+        with self._lock:
+            return sum(value for key, value in self._values.items()
+                       if all(key[i] == v for i, v in match))
+
+    @staticmethod
+    def difference(value, old):
+        """Increment from an old raw value to value (None if unchanged)"""
+        return (value - (old or 0)) or None
+
+    def merge(self, increments):
+        """Add increments by label key, e.g. from another process"""
+        with self._lock:
+            for key, amount in increments.items():
+                self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self.header()
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self, remote=()):
+        """
+        Args:
+            remote: Raw values of this gauge in other processes, added to
+                the local ones
+        """
+        with self._lock:
+            values = dict(self._values)
+        for other in remote:
+            for key, value in other.items():
+                values[key] = values.get(key, 0) + value
+        items = sorted(values.items())
+        lines = self.header()
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}{labels} {_format_value(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    """Fixed-bucket histogram, e.g. of stage latencies in seconds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def dump(self):
+        with self._lock:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self._values.items()}
+
+    @staticmethod
+    def difference(value, old):
+        """Observations between an old raw value and value (None if none)"""
+        if old is None:
+            return value if value[2] else None
+        if value[2] == old[2]:
+            return None
+        return [[a - b for a, b in zip(value[0], old[0])], value[1] - old[1],
+                value[2] - old[2]]
+
+    def merge(self, increments):
+        """Add observations by label key, e.g. from another process"""
+        with self._lock:
+            for key, (counts, total, count) in increments.items():
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    def snapshot(self, **labels):
+        """Return (cumulative bucket counts, sum, count) for one label set"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None:
+                return [0] * (len(self.buckets) + 1), 0.0, 0
+            counts, total, count = list(entry[0]), entry[1], entry[2]
+        cumulative, running = [], 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = self.header()
+        bounds = [_format_value(b) for b in self.buckets] + ['+Inf']
+        for key, (counts, total, count) in items:
+            running = 0
+            for bound, c in zip(bounds, counts):
+                running += c
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {running}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together for the /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        # Gauge values of other processes: source -> {metric name: values}
+        self._remote = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """Register a callable run before rendering, e.g. to refresh gauges"""
+        self._collectors.append(collect)
+
+    def collect(self):
+        """Run the collectors"""
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Error in metrics collector: {e}")
+
+    def changes(self, since=None):
+        """
+        What changed since an earlier snapshot, for another process to
+        merge: counter and histogram increments, and current gauge values
+
+        Returns:
+            (changes, snapshot to pass as `since` next time)
+        """
+        self.collect()
+        changes = {}
+        snapshot = {}
+        for metric in self._metrics:
+            values = snapshot[metric.name] = metric.dump()
+            if metric.kind == 'gauge':
+                if values:
+                    changes[metric.name] = values
+                continue
+            old = (since or {}).get(metric.name, {})
+            diff = {}
+            for key, value in values.items():
+                delta = metric.difference(value, old.get(key))
+                if delta is not None:
+                    diff[key] = delta
+            if diff:
+                changes[metric.name] = diff
+        return changes, snapshot
+
+    def merge(self, changes, source=None):
+        """
+        Merge another process's changes: counters and histograms are added,
+        and its gauges replace the ones last merged from the same source
+        (they are added to the local gauges when rendering). A source of
+        None keeps no gauges.
+        """
+        by_name = {metric.name: metric for metric in self._metrics}
+        gauges = {}
+        for name, values in changes.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            if metric.kind == 'gauge':
+                gauges[name] = values
+            else:
+                metric.merge(values)
+        if source is not None:
+            with self._lock:
+                self._remote[source] = gauges
+
+    def forget_sources(self):
+        """Drop the gauges merged from other processes (e.g. ended workers)"""
+        with self._lock:
+            self._remote.clear()
+
+    def render(self):
+        self.collect()
+        with self._lock:
+            remote = list(self._remote.values())
+        lines = []
+        for metric in self._metrics:
+            if metric.kind == 'gauge':
+                lines.extend(metric.render([r[metric.name] for r in remote
+                                            if metric.name in r]))
+            else:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Try-on metrics shared by the pipeline and the Flask routes
+stage_seconds = registry.histogram(
+    'tryon_stage_seconds', 'Time spent in each try-on pipeline stage',
+    ('item', 'stage')
+)
+request_seconds = registry.histogram(
+    'tryon_request_seconds', 'End-to-end try-on request latency',
+    ('item', 'endpoint')
+)
+requests = registry.counter(
+    'tryon_requests_total', 'Try-on requests by outcome',
+    ('item', 'endpoint', 'status')
+)
+fallbacks = registry.counter(
+    'tryon_fallbacks_total', 'Try-ons served by a fallback path instead of landmarks',
+    ('item', 'path', 'reason')
+)
+
+
+def observe_stages(item, timings):
+    """Record a pipeline's per-stage timings (seconds) for an item type"""
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, item=item, stage=stage)
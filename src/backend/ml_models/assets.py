@@ -0,0 +1,428 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from . import baked
+
+# Default memory budget for decoded garments (bytes)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Default entry limit, which also bounds mapped assets (their pixels are not
+# charged to the byte budget)
+DEFAULT_MAX_ENTRIES = 256
+
+# Pyramid levels shrink by 1/sqrt(2) until the short side drops below this
+MIN_LEVEL_SIZE = 16
+LEVEL_SCALE = 1 / np.sqrt(2)
+
+# Requested overlay sizes are rounded to this many pixels for the resize cache
+RESIZE_QUANTUM = 4
+# Resized overlays kept per asset
+RESIZE_CACHE_SIZE = 8
+
+# Map baked .wxa files instead of decoding garment images when available
+USE_BAKED = os.environ.get("WEARX_BAKED_ASSETS", "1").lower() not in ("0", "false", "no")
+
+_resize_lock = threading.Lock()
+_resize_counters = {"hits": 0, "misses": 0}
+
+
+def premultiply(image):
+    """
+    Premultiply the colour channels of a BGRA uint8 image by its alpha
+
+    Args:
+        image: BGRA uint8 image
+
+    Returns:
+        New BGRA uint8 image with premultiplied colour
+    """
+    out = image.copy()
+    alpha = image[:, :, 3].astype(np.uint16)[:, :, None]
+    acc = image[:, :, :3].astype(np.uint16) * alpha
+    acc += 128
+    acc += acc >> 8
+    acc >>= 8
+    out[:, :, :3] = acc
+    return out
+
+
+def as_bgra(image):
+    """BGRA view/copy of a grayscale, BGR or BGRA image"""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    if image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+
+def quantize_size(width, height, quantum=RESIZE_QUANTUM):
+    """Round an overlay size to the resize-cache grid (never below 1 pixel)"""
+    qw = max(1, int(round(width / quantum)) * quantum)
+    qh = max(1, int(round(height / quantum)) * quantum)
+    return qw, qh
+
+
+def scale_box(box, from_size, to_size):
+    """
+    An opaque box of an image of from_size (width, height) in the same
+    image resized to to_size, grown by a pixel for the resize filter's
+    spread and clipped to the image (None stays None)
+    """
+    if box is None:
+        return None
+    x, y, w, h = box
+    sx = to_size[0] / float(from_size[0])
+    sy = to_size[1] / float(from_size[1])
+    x0 = max(0, int(np.floor(x * sx)) - 1)
+    y0 = max(0, int(np.floor(y * sy)) - 1)
+    x1 = min(to_size[0], int(np.ceil((x + w) * sx)) + 1)
+    y1 = min(to_size[1], int(np.ceil((y + h) * sy)) + 1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def build_levels(image, min_size=MIN_LEVEL_SIZE):
+    """
+    Build a mip-style pyramid of the image in power-of-sqrt(2) steps
+
+    Returns:
+        List of images, level 0 being the full-resolution input
+    """
+    levels = [image]
+    h, w = image.shape[:2]
+    k = 1
+    while True:
+        scale = LEVEL_SCALE ** k
+        lw, lh = int(round(w * scale)), int(round(h * scale))
+        if min(lw, lh) < min_size:
+            break
+        level = cv2.resize(image, (lw, lh), interpolation=cv2.INTER_AREA)
+        level.setflags(write=False)
+        levels.append(level)
+        k += 1
+    return levels
+
+
+def resize_stats():
+    with _resize_lock:
+        return dict(_resize_counters)
+
+
+class GarmentAsset:
+    """
+    Handle to a decoded, background-removed, premultiplied BGRA garment
+
+    Handles are immutable and shared between requests; never write into
+    `image` or the arrays returned by `resized`.
+
+    Args:
+        key: Asset store key
+        image: Premultiplied BGRA image
+        levels: Prebuilt pyramid (level 0 being image), e.g. from a baked
+            file; built from image when None
+        bbox: Opaque box of image (see ml_models.baked.opaque_box), e.g.
+            from a baked file; found from the alpha channel when None
+        anchors: Attach points in normalized image coordinates (see
+            ml_models.baked.attach_points), e.g. from a baked file; found
+            from the alpha channel when None
+        mapped: The pixels are a read-only mapping of a baked file, shared
+            with other processes through the page cache
+        on_resize: Called with (asset, change in resize_bytes) when resized
+            overlays are cached or dropped
+    """
+
+    premultiplied = True
+
+    def __init__(self, key, image, levels=None, bbox=None, anchors=None,
+                 mapped=False, on_resize=None):
+        self.key = key
+        self.image = image
+        self.image.setflags(write=False)
+        self.levels = levels if levels is not None else build_levels(image)
+        self.bbox = bbox if bbox is not None else baked.opaque_box(image)
+        self.anchors = (anchors if anchors is not None
+                        else baked.attach_points(image, box=self.bbox))
+        self.mapped = mapped
+        self.on_resize = on_resize
+        self._resized = OrderedDict()
+        self._resize_bytes = 0
+        self._lock = threading.Lock()
+
+    def level_for(self, width, height):
+        """Smallest pyramid level at least (width, height), else level 0"""
+        for level in reversed(self.levels):
+            lh, lw = level.shape[:2]
+            if lw >= width and lh >= height:
+                return level
+        return self.levels[0]
+
+    def resized(self, width, height):
+        """
+        Get the garment resized to (width, height), quantized to the cache grid
+
+        The nearest larger pyramid level is resized to the quantized size and
+        the result is cached, so a subject standing still reuses the same
+        overlay between frames.
+
+        Returns:
+            Read-only premultiplied BGRA image of the quantized size
+        """
+        return self.resized_region(width, height)[0]
+
+    def resized_region(self, width, height):
+        """
+        Same as resized, with the box [x, y, width, height] of the overlay's
+        non-transparent pixels (None if there are none). Blending only that
+        box gives the same frame, since fully transparent premultiplied
+        pixels leave it unchanged.
+        """
+        size = quantize_size(width, height)
+        with self._lock:
+            entry = self._resized.get(size)
+            if entry is not None:
+                self._resized.move_to_end(size)
+        if entry is not None:
+            with _resize_lock:
+                _resize_counters["hits"] += 1
+            return entry
+
+        with _resize_lock:
+            _resize_counters["misses"] += 1
+        level = self.level_for(*size)
+        if level.shape[1] == size[0] and level.shape[0] == size[1]:
+            overlay = level
+        else:
+            shrinking = level.shape[1] > size[0]
+            overlay = cv2.resize(
+                level, size,
+                interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+            )
+            overlay.setflags(write=False)
+        # The image's opaque box, scaled: no pass over the overlay's pixels
+        h, w = self.image.shape[:2]
+        entry = (overlay, scale_box(self.bbox, (w, h), size))
+
+        with self._lock:
+            old = self._resized.pop(size, None)
+            self._resized[size] = entry
+            change = self._overlay_bytes(overlay)
+            if old is not None:
+                change -= self._overlay_bytes(old[0])
+            while len(self._resized) > RESIZE_CACHE_SIZE:
+                _, (dropped, _) = self._resized.popitem(last=False)
+                change -= self._overlay_bytes(dropped)
+            self._resize_bytes += change
+        if change and self.on_resize is not None:
+            self.on_resize(self, change)
+        return entry
+
+    def _overlay_bytes(self, overlay):
+        # A pyramid level used as it is costs nothing extra
+        if any(overlay is level for level in self.levels):
+            return 0
+        return overlay.nbytes
+
+    @property
+    def resize_bytes(self):
+        """Bytes of the cached resized overlays"""
+        return self._resize_bytes
+
+    @property
+    def path(self):
+        return self.key[0]
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def nbytes(self):
+        """Bytes of the pyramid levels and the cached resized overlays"""
+        return sum(level.nbytes for level in self.levels) + self._resize_bytes
+
+    def __repr__(self):
+        h, w = self.image.shape[:2]
+        return f"GarmentAsset({self.path!r}, {w}x{h})"
+
+
+def _preprocess_name(preprocess):
+    if preprocess is None:
+        return None
+    return f"{preprocess.__module__}.{preprocess.__qualname__}"
+
+
+class AssetStore:
+    """
+    Process-wide LRU cache of garment assets bounded by a byte budget and
+    an entry count
+
+    Entries are keyed by (absolute path, mtime, preprocess function), so an
+    asset edited on disk is reloaded on its next lookup.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._costs = {}  # key -> bytes charged to the budget
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, preprocess=None):
+        """
+        Get the asset for an image path, loading it on a miss
+
+        Args:
+            path: Path to the garment image
+            preprocess: Optional function applied to the decoded image before
+                premultiplying (e.g. remove_white_background)
+
+        Returns:
+            GarmentAsset, or None if the image cannot be read
+        """
+        abspath = os.path.abspath(path)
+        try:
+            mtime = os.stat(abspath).st_mtime_ns
+        except OSError:
+            return None
+        key = (abspath, mtime, _preprocess_name(preprocess))
+
+        with self._lock:
+            asset = self._entries.get(key)
+            if asset is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return asset
+            self.misses += 1
+
+        if USE_BAKED:
+            asset = self._load_baked(key, preprocess)
+            if asset is not None:
+                return self._store(key, asset)
+
+        image = cv2.imread(abspath, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            return None
+        return self.put(key, image, preprocess)
+
+    @staticmethod
+    def version(paths):
+        """
+        Version tag of garment images from their modification times, which
+        changes when one is edited (as the keys of the stored assets do)
+        """
+        parts = []
+        for path in paths:
+            try:
+                parts.append(format(os.stat(os.path.abspath(path)).st_mtime_ns, 'x'))
+            except OSError:
+                parts.append('-')
+        return '.'.join(parts)
+
+    def _load_baked(self, key, preprocess):
+        """GarmentAsset mapped from the image's baked file, if it is current"""
+        path = key[0]
+        if not os.path.exists(baked.baked_path(path)):
+            return None
+        try:
+            digest = baked.source_digest(path)
+        except OSError:
+            return None
+        result = baked.read_baked(baked.baked_path(path), key[2], digest)
+        if result is None:
+            print(f"Baked asset for {path} does not match the image; decoding it")
+            return None
+        levels, header = result
+        return GarmentAsset(key, levels[0], levels=levels,
+                            bbox=header.get('bbox'),
+                            anchors=header.get('anchors'), mapped=True,
+                            on_resize=self._resized)
+
+    def put(self, key, image, preprocess=None):
+        """
+        Preprocess and store an already-decoded image under key
+
+        Returns:
+            The stored GarmentAsset, or None if preprocessing failed
+        """
+        if preprocess is not None:
+            image = preprocess(image)
+            if image is None:
+                return None
+        return self._store(key, GarmentAsset(key, premultiply(as_bgra(image)),
+                                             on_resize=self._resized))
+
+    @staticmethod
+    def _cost(asset):
+        # Mapped pixels live in the shared page cache, not in this process;
+        # their resized overlays do
+        return asset.resize_bytes if asset.mapped else asset.nbytes
+
+    def _store(self, key, asset):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._bytes -= self._costs.pop(key)
+            self._entries[key] = asset
+            self._costs[key] = self._cost(asset)
+            self._bytes += self._costs[key]
+            self._evict()
+        return asset
+
+    def _resized(self, asset, change):
+        # An evicted asset still in use by a request is no longer charged
+        with self._lock:
+            if self._entries.get(asset.key) is not asset:
+                return
+            self._costs[asset.key] += change
+            self._bytes += change
+            self._evict()
+
+    def _evict(self):
+        # Always keep the most recent entry, even if it alone exceeds the budget
+        while ((self._bytes > self.max_bytes
+                or len(self._entries) > self.max_entries)
+               and len(self._entries) > 1):
+            key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._costs.pop(key)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._costs.clear()
+            self._bytes = 0
+
+    def stats(self):
+        resize = resize_stats()
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "mapped": sum(asset.mapped for asset in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resize_hits": resize["hits"],
+                "resize_misses": resize["misses"],
+            }
+
+
+# Shared store used by the try-on models
+asset_store = AssetStore(
+    int(os.environ.get("WEARX_ASSET_CACHE_BYTES", DEFAULT_MAX_BYTES)),
+    int(os.environ.get("WEARX_ASSET_CACHE_ENTRIES", DEFAULT_MAX_ENTRIES)),
+)
+
+
+def load_asset(path, preprocess=None):
+    """Look up a garment in the shared asset store"""
+    return asset_store.get(path, preprocess)
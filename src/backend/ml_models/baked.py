@@ -0,0 +1,187 @@
+"""
+Precompiled garment assets (.wxa files) loaded with mmap.
+
+Baking does the work the asset store otherwise repeats in every process on
+first use: decode the image, remove its background with the garment's
+preprocess function, premultiply, and build the resize pyramid. The result
+is written next to the source as <image>.wxa with the opaque bounding box
+and attach points. The asset store maps a baked file read-only instead of
+decoding the image, so loading costs no pixel work and all worker processes
+share one page-cache copy of the levels.
+
+A baked file records the preprocess function and a digest of the source
+image; if either no longer matches, it is ignored and the image is decoded
+as before.
+
+Layout:
+    MAGIC (8 bytes), little-endian uint32 header length, UTF-8 JSON header,
+    then each level's BGRA uint8 pixels (row-major), starting on ALIGN-byte
+    boundaries at the offsets listed in the header
+
+Files are built with bake_assets.py.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'WXASSET\x01'
+FORMAT_VERSION = 1
+EXTENSION = '.wxa'
+ALIGN = 64
+
+_HEADER_LEN = struct.Struct('<I')
+
+
+def baked_path(path):
+    """Baked file for a garment image"""
+    return path + EXTENSION
+
+
+def source_digest(path):
+    """Digest of a source image file, to detect stale baked files"""
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def opaque_box(image):
+    """
+    [x, y, width, height] of the pixels with any non-zero channel (for a
+    premultiplied image, the ones that change the frame), or None if all
+    are transparent
+    """
+    mask = image.max(axis=2) if image.ndim == 3 else image
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1),
+            int(rows[-1] - rows[0] + 1)]
+
+
+def attach_points(image, shoulder_row=0.2, box=None):
+    """
+    Attach points in normalized image coordinates, from the alpha channel
+
+    hook: centre of the top opaque row (where an earring or necklace hangs)
+    left_shoulder, right_shoulder: outermost opaque pixels of the row a
+        fifth of the way down the opaque box (image left and right)
+
+    Args:
+        box: The image's opaque_box, if already known
+    """
+    h, w = image.shape[:2]
+    alpha = image[:, :, 3]
+    if box is None:
+        box = opaque_box(alpha)
+    if box is None:
+        return {}
+    x, y, bw, bh = box
+    top = np.flatnonzero(alpha[y])
+    row = min(h - 1, y + int(bh * shoulder_row))
+    cols = np.flatnonzero(alpha[row])
+    anchors = {'hook': [(top[0] + top[-1]) / 2.0 / w, y / float(h)]}
+    if cols.size:
+        anchors['left_shoulder'] = [cols[0] / float(w), row / float(h)]
+        anchors['right_shoulder'] = [cols[-1] / float(w), row / float(h)]
+    return {name: [round(float(v), 5) for v in point]
+            for name, point in anchors.items()}
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_baked(path, levels, preprocess_name, digest, anchors=None):
+    """
+    Write premultiplied BGRA pyramid levels (level 0 first) as a baked file
+
+    Written to a temporary file and renamed, so a server mapping the old
+    file never sees a partial one.
+    """
+    header = {
+        'version': FORMAT_VERSION,
+        'preprocess': preprocess_name,
+        'source_digest': digest,
+        'bbox': opaque_box(levels[0]),
+        'anchors': anchors or {},
+        'levels': [],
+    }
+    relative = []
+    offset = 0
+    for level in levels:
+        header['levels'].append({'width': int(level.shape[1]),
+                                 'height': int(level.shape[0]), 'offset': 0})
+        relative.append(offset)
+        offset = _aligned(offset + level.nbytes)
+    # The offsets are part of the header, whose length decides where the
+    # pixel data starts: grow the data start until the header fits
+    data_start = 0
+    while True:
+        for entry, rel in zip(header['levels'], relative):
+            entry['offset'] = data_start + rel
+        encoded = json.dumps(header).encode('utf-8')
+        needed = _aligned(len(MAGIC) + _HEADER_LEN.size + len(encoded))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    tmp = path + '.part'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(encoded)))
+        f.write(encoded)
+        for entry, level in zip(header['levels'], levels):
+            f.write(b'\0' * (entry['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(level, dtype=np.uint8).tobytes())
+    os.replace(tmp, path)
+    return header
+
+
+def read_baked(path, preprocess_name, digest=None):
+    """
+    Map a baked file
+
+    Args:
+        path: Baked file
+        preprocess_name: Preprocess function the caller would apply; a file
+            baked with another one is not used
+        digest: source_digest of the image; a file baked from other
+            content is not used (None skips the check)
+
+    Returns:
+        (levels, header) with levels read-only arrays backed by the
+        mapping, or None if the file is missing, stale or invalid
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        start = len(MAGIC) + _HEADER_LEN.size
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a baked asset")
+        (length,) = _HEADER_LEN.unpack(mapped[len(MAGIC):start])
+        header = json.loads(mapped[start:start + length].decode('utf-8'))
+        if header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"format version {header.get('version')}")
+    except (ValueError, struct.error) as e:
+        print(f"Ignoring baked asset {path}: {e}")
+        mapped.close()
+        return None
+    if header['preprocess'] != preprocess_name or (
+            digest is not None and header['source_digest'] != digest):
+        mapped.close()
+        return None
+
+    levels = []
+    for entry in header['levels']:
+        h, w = entry['height'], entry['width']
+        # The arrays keep the mapping alive; it is unmapped with the last one
+        levels.append(np.frombuffer(mapped, dtype=np.uint8, count=h * w * 4,
+                                    offset=entry['offset']).reshape(h, w, 4))
+    return levels, header
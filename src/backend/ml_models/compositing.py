@@ -0,0 +1,232 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Per-thread scratch memory for the fixed-point blends, so blending an
+# overlay allocates nothing once the buffers have grown to the largest
+# overlay seen by the thread
+_scratch = threading.local()
+
+
+def scratch(name, shape, dtype):
+    """
+    Per-thread scratch array, reused across calls
+
+    The returned array is only valid until the next scratch() call with the
+    same name on this thread, and its contents are undefined.
+
+    Args:
+        name: Buffer name; different names never alias each other
+        shape: Required shape
+        dtype: Required dtype
+    """
+    buffers = getattr(_scratch, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    buf = buffers.get(name)
+    if buf is None or buf.size < size:
+        buf = buffers[name] = np.empty(size, dtype=np.uint8)
+    return buf[:size].view(dtype).reshape(shape)
+
+
+def scratch_bytes():
+    """Bytes held by this thread's scratch buffers"""
+    buffers = getattr(_scratch, 'buffers', None) or {}
+    return sum(buf.nbytes for buf in buffers.values())
+
+
+def output_buffer(frame, out=None):
+    """
+    Destination for drawing onto frame
+
+    Args:
+        frame: Source frame
+        out: None for a new copy of frame, frame itself to draw in place, or
+            an array of the same shape and dtype that frame is copied into
+
+    Returns:
+        The array to draw into
+    """
+    if out is None:
+        return frame.copy()
+    if out is not frame:
+        np.copyto(out, frame)
+    return out
+
+
+def clip_region(frame_shape, x, y, width, height):
+    """
+    Clip an overlay rectangle against the frame bounds
+
+    Args:
+        frame_shape: Shape of the destination frame (h, w, ...)
+        x, y: Top-left corner of the overlay in frame coordinates (may be negative)
+        width, height: Size of the overlay
+
+    Returns:
+        (frame_slices, overlay_slices) tuple of (rows, cols) slices, or None
+        if the overlay lies completely outside the frame
+    """
+    frame_h, frame_w = frame_shape[:2]
+    x1, x2 = max(0, x), min(frame_w, x + width)
+    y1, y2 = max(0, y), min(frame_h, y + height)
+
+    if x1 >= x2 or y1 >= y2:
+        return None
+
+    frame_slices = (slice(y1, y2), slice(x1, x2))
+    overlay_slices = (slice(y1 - y, y2 - y), slice(x1 - x, x2 - x))
+    return frame_slices, overlay_slices
+
+
+def _round_div255(acc, tmp):
+    # acc = acc / 255 in uint16, rounded with the usual
+    # (v + 128 + ((v + 128) >> 8)) >> 8 trick instead of a division
+    acc += 128
+    np.right_shift(acc, 8, out=tmp)
+    acc += tmp
+    acc >>= 8
+
+
+def _blend_fixed_point(dst, color, alpha):
+    # dst = (color * a + dst * (255 - a)) / 255, all in scratch buffers
+    h, w = alpha.shape
+    a = scratch('alpha', (h, w, 1), np.uint16)
+    inv = scratch('inv_alpha', (h, w, 1), np.uint16)
+    acc = scratch('acc', (h, w, 3), np.uint16)
+    tmp = scratch('tmp', (h, w, 3), np.uint16)
+    np.copyto(a[:, :, 0], alpha)
+    np.subtract(255, a, out=inv)
+    np.multiply(color, a, out=acc)
+    np.multiply(dst, inv, out=tmp)
+    acc += tmp
+    _round_div255(acc, tmp)
+    np.copyto(dst, acc, casting='unsafe')
+
+
+def _blend_float(dst, color, alpha):
+    a = (alpha.astype(np.float32) * (1.0 / 255.0))[:, :, None]
+    dst[...] = (color * a + dst * (1.0 - a)).astype(np.uint8)
+
+
+def _blend_premultiplied_fixed_point(dst, color, alpha):
+    # dst = color + dst * (255 - a) / 255; color is already scaled by alpha
+    h, w = alpha.shape
+    inv = scratch('inv_alpha', (h, w, 1), np.uint16)
+    acc = scratch('acc', (h, w, 3), np.uint16)
+    tmp = scratch('tmp', (h, w, 3), np.uint16)
+    np.subtract(255, alpha[:, :, None], out=inv, dtype=np.uint16)
+    np.multiply(dst, inv, out=acc)
+    _round_div255(acc, tmp)
+    acc += color
+    np.copyto(dst, acc, casting='unsafe')
+
+
+def _blend_premultiplied_float(dst, color, alpha):
+    inv = 1.0 - (alpha.astype(np.float32) * (1.0 / 255.0))[:, :, None]
+    dst[...] = np.minimum(color + dst * inv, 255.0).astype(np.uint8)
+
+
+def alpha_blend(background, overlay, x, y, fixed_point=True, premultiplied=False):
+    """
+    Blend an already-sized overlay onto background in place
+
+    The fixed-point path works in per-thread scratch buffers and allocates
+    no temporaries of its own.
+
+    Args:
+        background: BGR (or BGRA) uint8 frame, modified in place
+        overlay: BGRA or BGR uint8 image; BGR overlays are treated as opaque
+        x, y: Top-left position of the overlay (may be negative)
+        fixed_point: Use the integer uint8/uint16 path instead of float32
+        premultiplied: Overlay colour is already multiplied by its alpha
+
+    Returns:
+        The background frame
+    """
+    oh, ow = overlay.shape[:2]
+    region = clip_region(background.shape, x, y, ow, oh)
+    if region is None:
+        return background
+
+    frame_slices, overlay_slices = region
+    dst = background[frame_slices][:, :, :3]
+    src = overlay[overlay_slices]
+
+    if src.ndim == 2 or src.shape[2] < 4:
+        dst[...] = src[:, :, :3] if src.ndim == 3 else src[:, :, None]
+        return background
+
+    color = src[:, :, :3]
+    alpha = src[:, :, 3]
+
+    if premultiplied:
+        if fixed_point:
+            _blend_premultiplied_fixed_point(dst, color, alpha)
+        else:
+            _blend_premultiplied_float(dst, color, alpha)
+    elif fixed_point:
+        _blend_fixed_point(dst, color, alpha)
+    else:
+        _blend_float(dst, color, alpha)
+    return background
+
+
+def overlay_image(background, overlay, x, y, width, height, fixed_point=True,
+                  premultiplied=False):
+    """
+    Resize overlay to (width, height) and alpha-blend it onto background
+
+    Args:
+        background: BGR uint8 frame, modified in place
+        overlay: BGRA uint8 image
+        x, y: Top-left position of the overlay (may be negative)
+        width, height: Target size of the overlay
+        fixed_point: Use the integer blending path
+        premultiplied: Overlay colour is already multiplied by its alpha
+
+    Returns:
+        The background frame
+    """
+    if overlay is None or background is None:
+        return background
+    if width <= 0 or height <= 0:
+        return background
+
+    if overlay.shape[1] != width or overlay.shape[0] != height:
+        overlay = cv2.resize(overlay, (width, height))
+    return alpha_blend(background, overlay, x, y, fixed_point=fixed_point,
+                       premultiplied=premultiplied)
+
+
+def overlay_asset(background, asset, x, y, width, height, fixed_point=True):
+    """
+    Blend a GarmentAsset handle (premultiplied BGRA) onto background
+
+    The overlay comes from the asset's pyramid/resize cache, so its size is
+    (width, height) rounded to the asset resize grid. Only its
+    non-transparent box is blended.
+
+    Args:
+        background: BGR uint8 frame, modified in place
+        asset: GarmentAsset from ml_models.assets, or None
+        x, y, width, height: Target placement of the garment
+
+    Returns:
+        The background frame
+    """
+    if asset is None or background is None:
+        return background
+    if width <= 0 or height <= 0:
+        return background
+    overlay, box = asset.resized_region(width, height)
+    if box is None:
+        return background
+    # Only the non-transparent part of the overlay changes the frame
+    bx, by, bw, bh = box
+    return alpha_blend(background, overlay[by:by + bh, bx:bx + bw],
+                       x + bx, y + by, fixed_point=fixed_point,
+                       premultiplied=asset.premultiplied)
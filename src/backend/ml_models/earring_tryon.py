@@ -1,5 +1,7 @@
 import cv2
-import numpy as np
+
+from . import compositing
+from .assets import GarmentAsset, load_asset
 
 # Function to remove white background from images
 def remove_white_background(image):
@@ -20,90 +22,124 @@ def remove_white_background(image):
 
 # Function to overlay images with alpha blending
 def overlay_image(background, overlay, x, y, width, height):
-    if overlay is None or background is None:
-        return background
-
-    overlay = cv2.resize(overlay, (width, height))
-    alpha_mask = overlay[:, :, 3] / 255.0
-    alpha_inv = 1.0 - alpha_mask
-
-    h, w, _ = background.shape
-    x1, x2 = max(0, x), min(w, x + width)
-    y1, y2 = max(0, y), min(h, y + height)
+    if isinstance(overlay, GarmentAsset):
+        return compositing.overlay_asset(background, overlay, x, y, width, height)
+    return compositing.overlay_image(background, overlay, x, y, width, height)
 
-    if x1 >= x2 or y1 >= y2:
-        return background
-
-    overlay = overlay[: y2 - y1, : x2 - x1]
-    alpha_mask = alpha_mask[: y2 - y1, : x2 - x1]
-    alpha_inv = alpha_inv[: y2 - y1, : x2 - x1]
-
-    alpha_mask = np.stack([alpha_mask] * 3, axis=-1)
-    alpha_inv = np.stack([alpha_inv] * 3, axis=-1)
+# Function to get a preprocessed earring from the shared asset store
+def load_earring(earring_path):
+    earring = load_asset(earring_path, remove_white_background)
+    if earring is None:
+        print("Error: Earring image not found!")
+    return earring
 
-    background[y1:y2, x1:x2, :3] = (
-        alpha_inv * background[y1:y2, x1:x2, :3] + alpha_mask * overlay[:, :, :3]
-    ).astype(np.uint8)
+def earring_box(earring, ear_x, ear_y, width, height):
+    """
+    Earring rectangle [x, y, width, height] that hangs the earring's hook
+    attach point (GarmentAsset.anchors; top centre without one) from the
+    ear point
+    """
+    anchors = getattr(earring, 'anchors', None) or {}
+    hook_x, hook_y = anchors.get('hook', (0.5, 0.0))
+    return [ear_x - int(hook_x * width), ear_y - int(hook_y * height),
+            width, height]
 
-    return background
+def earring_placements(face_box, frame_width, left_earring=None,
+                       right_earring=None):
+    """
+    Estimate where to draw both earrings from a face bounding box
+    
+    Args:
+        face_box: Bounding box of face [x, y, width, height]
+        frame_width: Width of the frame, used to clamp the right ear
+        left_earring, right_earring: GarmentAsset handles, whose hook attach
+            points are placed at the ears (optional)
+    
+    Returns:
+        (left, right) earring rectangles, each [x, y, width, height]
+    """
+    # Extract values from face_box
+    x, y, w, h = face_box
+    
+    # Estimate ear positions based on face box
+    # Left ear is typically at the left side of the face
+    left_ear_x = max(0, x)
+    left_ear_y = y + h // 3  # Approximately at eye level
+    
+    # Right ear is typically at the right side of the face
+    right_ear_x = min(frame_width, x + w)
+    right_ear_y = y + h // 3
+    
+    # Size earrings based on face dimensions
+    earring_width = w // 5
+    earring_height = h // 3
+    
+    # Hang the earrings from the ears
+    left_box = earring_box(left_earring, left_ear_x, left_ear_y,
+                           earring_width, earring_height)
+    right_box = earring_box(right_earring, right_ear_x, right_ear_y,
+                            earring_width, earring_height)
+    return left_box, right_box
 
-def simple_earring_tryon(frame, face_box, left_earring_path="left_ear.png", right_earring_path="right_ear.png"):
+def simple_earring_tryon(frame, face_box, left_earring_path="left_ear.png", right_earring_path="right_ear.png",
+                         left_earring=None, right_earring=None, out=None):
     """
     Apply a simple earring try-on effect using a face bounding box
     
     Args:
         frame: Input image frame
         face_box: Bounding box of face [x, y, width, height]
-        left_earring_path: Path to left earring image
-        right_earring_path: Path to right earring image
+        left_earring_path: Path to left earring image, used when no handle is given
+        right_earring_path: Path to right earring image, used when no handle is given
+        left_earring: GarmentAsset handle from load_earring (optional)
+        right_earring: GarmentAsset handle from load_earring (optional)
+        out: Buffer to draw into; frame itself to draw in place (default: a
+            copy of frame)
     
     Returns:
         Frame with earrings overlaid
     """
     try:
-        # Load earring images
-        left_earring = cv2.imread(left_earring_path, cv2.IMREAD_UNCHANGED)
-        right_earring = cv2.imread(right_earring_path, cv2.IMREAD_UNCHANGED)
-        
-        # Process earring images
-        left_earring = remove_white_background(left_earring)
-        right_earring = remove_white_background(right_earring)
-        
-        # Extract values from face_box
-        x, y, w, h = face_box
+        # Get preprocessed earrings from the asset store
+        if left_earring is None:
+            left_earring = load_earring(left_earring_path)
+        if right_earring is None:
+            right_earring = load_earring(right_earring_path)
         
-        # Estimate ear positions based on face box
-        # Left ear is typically at the left side of the face
-        left_ear_x = max(0, x)
-        left_ear_y = y + h // 3  # Approximately at eye level
-        
-        # Right ear is typically at the right side of the face
-        right_ear_x = min(frame.shape[1], x + w)
-        right_ear_y = y + h // 3
-        
-        # Size earrings based on face dimensions
-        earring_width = w // 5
-        earring_height = h // 3
+        left_box, right_box = earring_placements(face_box, frame.shape[1],
+                                                 left_earring, right_earring)
         
         # Overlay earrings onto the frame
-        result_frame = frame.copy()
-        
-        # Position earrings just below the ears
-        left_pos_x = left_ear_x - earring_width // 2
-        left_pos_y = left_ear_y
-        
-        right_pos_x = right_ear_x - earring_width // 2
-        right_pos_y = right_ear_y
+        result_frame = compositing.output_buffer(frame, out)
         
         # Apply earrings
-        result_frame = overlay_image(result_frame, left_earring, left_pos_x, left_pos_y, earring_width, earring_height)
-        result_frame = overlay_image(result_frame, right_earring, right_pos_x, right_pos_y, earring_width, earring_height)
+        result_frame = overlay_image(result_frame, left_earring, *left_box)
+        result_frame = overlay_image(result_frame, right_earring, *right_box)
         
         return result_frame
         
     except Exception as e:
         print(f"Error in simple_earring_tryon: {e}")
-        return frame  # Return original frame if error occurs
+        # Return original frame if error occurs
+        return frame if out is None else compositing.output_buffer(frame, out)
+
+def process_earring_frame(frame, out=None):
+    """
+    Process an in-memory frame for earring try-on
+    
+    Args:
+        frame: Input BGR frame
+        out: Buffer to draw into (see simple_earring_tryon)
+    
+    Returns:
+        Processed frame with earrings overlay
+    """
+    # Use simple positioning instead of detection
+    height, width = frame.shape[:2]
+    face_box = [width//3, height//6, width//3, height//3]
+    
+    # Apply earring try-on
+    return simple_earring_tryon(frame, face_box, out=out)
 
 def process_earring_tryon(image_path, output_path=None):
     """
@@ -121,12 +157,7 @@ def process_earring_tryon(image_path, output_path=None):
     if frame is None:
         raise FileNotFoundError(f"Image not found at {image_path}")
     
-    # Use simple positioning instead of detection
-    height, width = frame.shape[:2]
-    face_box = [width//3, height//6, width//3, height//3]
-    
-    # Apply earring try-on
-    result = simple_earring_tryon(frame, face_box)
+    result = process_earring_frame(frame)
     
     # Optionally save the result
     if output_path:
@@ -144,12 +175,8 @@ def run_earring_tryon_interactive():
         cap = cv2.VideoCapture(0)
         
         # Load earring images
-        left_earring = cv2.imread("left_ear.png", cv2.IMREAD_UNCHANGED)
-        right_earring = cv2.imread("right_ear.png", cv2.IMREAD_UNCHANGED)
-        
-        # Process earring images
-        left_earring = remove_white_background(left_earring)
-        right_earring = remove_white_background(right_earring)
+        left_earring = load_earring("left_ear.png")
+        right_earring = load_earring("right_ear.png")
         
         while True:
             ret, frame = cap.read()
@@ -161,7 +188,9 @@ def run_earring_tryon_interactive():
             face_box = [w//3, h//6, w//3, h//3]
             
             # Apply earrings
-            frame = simple_earring_tryon(frame, face_box)
+            frame = simple_earring_tryon(frame, face_box,
+                                         left_earring=left_earring,
+                                         right_earring=right_earring)
             
             # Show result
             cv2.imshow("Earring Try-On", frame)
@@ -1,6 +1,9 @@
 import cv2
 import numpy as np
 
+from . import compositing
+from .assets import GarmentAsset, load_asset, premultiply
+
 # T-shirt size chart (in cm)
 tshirt_sizes = {
     "S": {"shoulder": 38, "chest": 90, "length": 65},
@@ -11,7 +14,8 @@ tshirt_sizes = {
 
 
 def remove_white_background(image):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    if image.shape[-1] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
     lower_white = np.array([200, 200, 200, 0], dtype=np.uint8)
     upper_white = np.array([255, 255, 255, 255], dtype=np.uint8)
     mask = cv2.inRange(image, lower_white, upper_white)
@@ -20,24 +24,72 @@ def remove_white_background(image):
 
 
 def overlay_image(background, overlay, x, y, width, height):
-    overlay = cv2.resize(overlay, (width, height))
-    for i in range(height):
-        for j in range(width):
-            if y + i >= background.shape[0] or x + j >= background.shape[1]:
-                continue
-            alpha = overlay[i, j, 3] / 255.0
-            if alpha > 0:
-                background[y + i, x + j] = ((1 - alpha) * background[y + i, x + j] + 
-                                          alpha * overlay[i, j, :3])
-    return background
+    if isinstance(overlay, GarmentAsset):
+        return compositing.overlay_asset(background, overlay, x, y, width, height)
+    return compositing.overlay_image(background, overlay, x, y, width, height)
+
+
+_placeholder_tshirt = None
+
+
+def placeholder_tshirt():
+    """Asset handle for a simple coloured T-shirt shape, used when the image is missing"""
+    global _placeholder_tshirt
+    if _placeholder_tshirt is None:
+        tshirt = np.zeros((600, 500, 4), dtype=np.uint8)
+        cv2.rectangle(tshirt, (100, 150), (400, 550), 
+                     (30, 100, 255, 200), -1)
+        cv2.rectangle(tshirt, (50, 150), (100, 300), 
+                     (30, 100, 255, 200), -1)
+        cv2.rectangle(tshirt, (400, 150), (450, 300), 
+                     (30, 100, 255, 200), -1)
+        _placeholder_tshirt = GarmentAsset(("<placeholder:tshirt>", 0, None),
+                                           premultiply(tshirt))
+    return _placeholder_tshirt
+
+
+def load_tshirt(tshirt_image_path="503.png"):
+    """
+    Get the preprocessed T-shirt asset from the shared asset store
+    
+    Args:
+        tshirt_image_path: Path to t-shirt image
+    
+    Returns:
+        GarmentAsset handle (a placeholder shape if the image is missing)
+    """
+    tshirt = load_asset(tshirt_image_path, remove_white_background)
+    if tshirt is None:
+        print(f"T-shirt image not found at: {tshirt_image_path}")
+        tshirt = placeholder_tshirt()
+    return tshirt
 
 
 def calculate_distance(p1, p2):
-    return np.linalg.norm(np.array(p1) - np.array(p2))
+    """
+    Euclidean distance between two points, or row-wise between two arrays
+    of points (e.g. the (k, 2) result of get_coords)
+    """
+    return np.linalg.norm(np.asarray(p1) - np.asarray(p2), axis=-1)
 
 
 def get_coords(landmarks, shape, index):
+    """
+    Pixel coordinates of a landmark, or a (k, 2) int array for a list of
+    indices
+
+    Args:
+        landmarks: MediaPipe landmark list, or a Landmarks adapter (then
+            computed in one vectorized step)
+        shape: Frame shape (h, w, ...)
+        index: Landmark index or list of indices
+    """
+    if hasattr(landmarks, 'pixels'):
+        coords = landmarks.pixels(shape, index)
+        return (int(coords[0]), int(coords[1])) if coords.ndim == 1 else coords
     h, w = shape[:2]
+    if not np.isscalar(index):
+        return np.array([get_coords(landmarks, shape, i) for i in index])
     lm = landmarks[index]
     return int(lm.x * w), int(lm.y * h)
 
@@ -52,49 +104,68 @@ def fit_color(value, expected, tolerance=5):
         return (0, 0, 255)  # red
 
 
-def simple_tshirt_tryon(frame, body_box, tshirt_image_path="503.png"):
+def tshirt_placement(body_box, anchors=None):
+    """
+    Calculate where to draw the shirt for a body bounding box
+    
+    Args:
+        body_box: Bounding box of body [x, y, width, height]
+        anchors: Attach points of the shirt image (GarmentAsset.anchors);
+            with shoulder points, the shirt's shoulders are centred on the
+            box and put on its shoulder line
+    
+    Returns:
+        Shirt rectangle [x, y, width, height]
+    """
+    # Extract values from body_box
+    x, y, w, h = body_box
+    
+    # Use the bounding box to determine the size and position of the shirt
+    tshirt_width = max(w, 100)  # Minimum width to avoid too small shirts
+    tshirt_height = int(tshirt_width * 1.4)
+    
+    if anchors and 'left_shoulder' in anchors and 'right_shoulder' in anchors:
+        (left_x, left_y), (right_x, right_y) = (anchors['left_shoulder'],
+                                                anchors['right_shoulder'])
+        # Body boxes have the shoulder line a tenth of their width below
+        # the top (see tryon.garment_placement)
+        shirt_x = int(x + w / 2 - (left_x + right_x) / 2 * tshirt_width)
+        shirt_y = int(y + w * 0.1 - (left_y + right_y) / 2 * tshirt_height)
+        return [shirt_x, shirt_y, tshirt_width, tshirt_height]
+    
+    # Position the shirt on the upper body
+    shirt_x = max(0, x - tshirt_width//4)
+    shirt_y = max(0, y - int(tshirt_height * 0.1))
+    
+    return [shirt_x, shirt_y, tshirt_width, tshirt_height]
+
+
+def simple_tshirt_tryon(frame, body_box, tshirt_image_path="503.png",
+                        tshirt=None, out=None):
     """
     Apply a simple t-shirt try-on effect using a body bounding box
     
     Args:
         frame: Input image frame
         body_box: Bounding box of body [x, y, width, height]
-        tshirt_image_path: Path to t-shirt image
+        tshirt_image_path: Path to t-shirt image, used when no handle is given
+        tshirt: GarmentAsset handle from load_tshirt (optional)
+        out: Buffer to draw into; frame itself to draw in place (default: a
+            copy of frame)
     
     Returns:
         Frame with t-shirt overlaid
     """
     try:
-        # Load the T-shirt image
-        tshirt = cv2.imread(tshirt_image_path, cv2.IMREAD_UNCHANGED)
+        # Get the preprocessed T-shirt from the asset store
         if tshirt is None:
-            print(f"T-shirt image not found at: {tshirt_image_path}")
-            # Create a simple colored rectangle as placeholder
-            tshirt = np.zeros((600, 500, 4), dtype=np.uint8)
-            cv2.rectangle(tshirt, (100, 150), (400, 550), 
-                         (30, 100, 255, 200), -1)
-            cv2.rectangle(tshirt, (50, 150), (100, 300), 
-                         (30, 100, 255, 200), -1)
-            cv2.rectangle(tshirt, (400, 150), (450, 300), 
-                         (30, 100, 255, 200), -1)
-        
-        # Remove white background
-        tshirt = remove_white_background(tshirt)
+            tshirt = load_tshirt(tshirt_image_path)
         
-        # Extract values from body_box
-        x, y, w, h = body_box
-        
-        # Calculate shirt placement
-        # Use the bounding box to determine the size and position of the shirt
-        tshirt_width = max(w, 100)  # Minimum width to avoid too small shirts
-        tshirt_height = int(tshirt_width * 1.4)
-        
-        # Position the shirt on the upper body
-        shirt_x = max(0, x - tshirt_width//4)
-        shirt_y = max(0, y - int(tshirt_height * 0.1))
+        shirt_x, shirt_y, tshirt_width, tshirt_height = tshirt_placement(
+            body_box, getattr(tshirt, 'anchors', None))
         
         # Overlay the shirt onto the frame
-        result_frame = frame.copy()
+        result_frame = compositing.output_buffer(frame, out)
         result_frame = overlay_image(result_frame, tshirt, shirt_x, shirt_y, 
                                     tshirt_width, tshirt_height)
         
@@ -102,7 +173,28 @@ def simple_tshirt_tryon(frame, body_box, tshirt_image_path="503.png"):
         
     except Exception as e:
         print(f"Error in simple_tshirt_tryon: {e}")
-        return frame  # Return original frame if error occurs
+        # Return original frame if error occurs
+        return frame if out is None else compositing.output_buffer(frame, out)
+
+
+def process_tshirt_frame(frame, size="M", out=None):
+    """
+    Process an in-memory frame for T-shirt try-on
+    
+    Args:
+        frame: Input BGR frame
+        size: T-shirt size to use (S, M, L, XL)
+        out: Buffer to draw into (see simple_tshirt_tryon)
+    
+    Returns:
+        Processed frame with T-shirt overlay
+    """
+    # Use simple positioning instead of detection
+    height, width = frame.shape[:2]
+    body_box = [width//4, height//8, width//2, height//2]
+    
+    # Apply T-shirt try-on
+    return simple_tshirt_tryon(frame, body_box, out=out)
 
 
 def process_tshirt_tryon(image_path, output_path=None, size="M"):
@@ -122,12 +214,7 @@ def process_tshirt_tryon(image_path, output_path=None, size="M"):
     if frame is None:
         raise FileNotFoundError(f"Image not found at {image_path}")
     
-    # Use simple positioning instead of detection
-    height, width = frame.shape[:2]
-    body_box = [width//4, height//8, width//2, height//2]
-    
-    # Apply T-shirt try-on
-    result = simple_tshirt_tryon(frame, body_box)
+    result = process_tshirt_frame(frame, size)
     
     # Optionally save the result
     if output_path:
@@ -144,10 +231,9 @@ def run_tshirt_tryon_webcam():
     cap = cv2.VideoCapture(0)
     
     # Load the T-shirt image
-    tshirt = cv2.imread("503.png")
+    tshirt = load_asset("503.png", remove_white_background)
     if tshirt is None:
         raise FileNotFoundError("T-shirt image not found!")
-    tshirt = remove_white_background(tshirt)
     
     # Main Loop
     while cap.isOpened():
@@ -158,7 +244,7 @@ def run_tshirt_tryon_webcam():
         # Simple approach - no external detection models
         h, w = frame.shape[:2]
         body_box = [w//4, h//8, w//2, h//2]
-        frame = simple_tshirt_tryon(frame, body_box)
+        frame = simple_tshirt_tryon(frame, body_box, tshirt=tshirt)
     
         cv2.imshow("E-Trial Room", frame)
         if cv2.waitKey(1) & 0xFF in [ord('q'), 27]:
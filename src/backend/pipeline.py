@@ -0,0 +1,595 @@
+"""
+Try-on pipeline: decode -> detect -> place -> composite -> encode, with
+pluggable stages and per-stage timing.
+"""
+import copy
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import metrics
+from codec import decode_image, encode_jpeg, reduction_factor
+from deadline import Deadline, DeadlineExceeded, scheduler
+from ml_models.assets import asset_store, quantize_size
+from ml_models.compositing import output_buffer, overlay_asset, scratch
+
+# Long side (px) frames are downscaled to before detection; 0 keeps the
+# native resolution. Requests can override it with `detect_size`.
+DEFAULT_DETECT_SIZE = int(os.environ.get("WEARX_DETECT_SIZE", "0"))
+
+
+class ParameterError(ValueError):
+    """Raised when a client-supplied rendering parameter is invalid"""
+
+
+def parse_size(value, name, minimum=32, maximum=8192):
+    """
+    Parse a long-side size parameter in pixels (0 means native size)
+
+    Returns:
+        int, or None if value is empty
+    """
+    if value is None or value == '':
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ParameterError(f"Invalid {name} {value!r}, expected pixels")
+    if size != 0 and not minimum <= size <= maximum:
+        raise ParameterError(f"{name} must be between {minimum} and {maximum}")
+    return size
+
+
+def parse_deadline(value, name='deadline_ms', maximum=60000):
+    """
+    Parse a latency budget in milliseconds (0 means no deadline)
+
+    Returns:
+        Budget in seconds, 0.0, or None if value is empty
+    """
+    if value is None or value == '':
+        return None
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        raise ParameterError(f"Invalid {name} {value!r}, expected milliseconds")
+    if not 0 <= budget <= maximum:
+        raise ParameterError(f"{name} must be between 0 and {maximum}")
+    return budget / 1000.0
+
+
+def request_deadline(budget, start=None):
+    """Deadline for a request's budget in seconds (None for no deadline)"""
+    return Deadline(budget, start) if budget else None
+
+
+def downscale(frame, max_side):
+    """
+    Shrink a frame so its long side is at most max_side (never enlarges)
+
+    Returns:
+        (frame, scale) where scale is the factor applied to coordinates
+    """
+    h, w = frame.shape[:2]
+    scale = max_side / float(max(h, w))
+    if scale >= 1.0:
+        return frame, 1.0
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA), scale
+
+
+# A separate detection decode is a second pass over the JPEG: at 1/2 scale
+# it plus the remaining downscale costs about as much as downscaling the
+# full frame (1080p to 640: ~5 ms + ~4 ms vs ~4-6 ms), from 1/4 on it is
+# cheaper (~4 ms, with little left to downscale)
+MIN_DETECT_REDUCTION = 4
+
+
+def detect_reduction(data, detect_size, output_size=None):
+    """
+    How much further than the output decode a JPEG can be reduced for
+    detection at detect_size (1: a separate detection decode saves nothing,
+    or data is not JPEG bytes)
+    """
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return 1
+    factor = reduction_factor(data, detect_size)
+    if output_size:
+        factor //= reduction_factor(data, output_size)
+    return factor
+
+
+def scale_box(box, scale):
+    """Scale an [x, y, width, height] pixel box (None passes through)"""
+    if box is None or scale == 1.0:
+        return box
+    return [int(round(v * scale)) for v in box]
+
+
+def resize_for_output(frame, roi, output_size, timings=None):
+    """Downscale the input to the requested output size, keeping roi in step"""
+    if not output_size:
+        return frame, roi
+    with timed(timings, 'resize'):
+        frame, scale = downscale(frame, output_size)
+    return frame, scale_box(roi, scale)
+
+
+class Overlay(namedtuple('Overlay', 'asset x y width height')):
+    """Garment layer: draw a GarmentAsset at (x, y) sized (width, height)"""
+
+    def draw(self, frame):
+        return overlay_asset(frame, self.asset, self.x, self.y,
+                             self.width, self.height)
+
+    def bounds(self):
+        """[x0, y0, x1, y1] of the pixels draw may change (unclipped)"""
+        if self.asset is None or self.width <= 0 or self.height <= 0:
+            return [0, 0, 0, 0]
+        # Overlays are drawn at their size on the resize-cache grid
+        width, height = quantize_size(self.width, self.height)
+        return [self.x, self.y, self.x + width, self.y + height]
+
+
+class Label(namedtuple('Label', 'text org color')):
+    """Text layer drawn with cv2.putText"""
+
+    def draw(self, frame):
+        cv2.putText(frame, self.text, self.org, cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, self.color, 2)
+        return frame
+
+    def bounds(self):
+        (width, height), baseline = cv2.getTextSize(
+            self.text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+        x, y = self.org
+        # Stroke thickness plus antialiasing on every side
+        pad = 4
+        return [x - pad, y - height - pad, x + width + pad, y + baseline + pad]
+
+
+def layer_bounds(layers, shape):
+    """
+    [x0, y0, x1, y1] boxes, clipped to a frame of shape, that drawing the
+    layers may change, or None if a layer has no bounds
+    """
+    frame_height, frame_width = shape[:2]
+    boxes = []
+    for layer in layers:
+        bounds = getattr(layer, 'bounds', None)
+        if bounds is None:
+            return None
+        x0, y0, x1, y1 = bounds()
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(frame_width, x1), min(frame_height, y1)
+        if x1 > x0 and y1 > y0:
+            boxes.append((x0, y0, x1, y1))
+    return boxes
+
+
+def composite_layers(frame, layers, out=None):
+    """
+    Default compositor: draw layers in order onto a copy of the frame, or
+    into a caller-provided buffer
+
+    Args:
+        frame: BGR input frame (left untouched unless it is out)
+        layers: Iterable of Overlay/Label layers
+        out: Array to draw into: frame itself to draw in place, another
+            array of the same shape and dtype, or None for a new copy
+
+    Returns:
+        Frame with all layers drawn (out, if given)
+    """
+    out = output_buffer(frame, out)
+    for layer in layers:
+        out = layer.draw(out)
+    return out
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the wall time of the block to timings[stage] (in seconds)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def server_timing(timings):
+    """Format stage timings as a Server-Timing header value"""
+    return ', '.join(
+        f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in timings.items()
+    )
+
+
+def served_path(timings):
+    """
+    How a render placed the item, from its stage timings: 'detect' (the
+    detector ran), 'cached' (the session's last detection was reused) or
+    'fallback' (heuristic box)
+    """
+    if 'fallback' in timings:
+        return 'fallback'
+    if 'cached' in timings:
+        return 'cached'
+    return 'detect' if 'detect' in timings else 'fallback'
+
+
+class TryOnPipeline:
+    """
+    A try-on as a chain of swappable stages
+
+    Stages:
+        decoder(data, max_side=None) -> BGR frame; may decode at a reduced
+            scale whose long side is still at least max_side
+        detector(frame) -> detection, or None when nothing was found; called
+            as detector(frame, session_id=..., roi=...) with whichever of
+            the session id and region hint are given
+        placement(frame, detection) -> list of layers; called with
+            detection=None to place from a heuristic box instead
+        compositor(frame, layers, out=None) -> BGR frame; draws into out
+            when given (out may be frame itself)
+        encoder(frame) -> encoded output
+        fallback(frame, out=None) -> BGR frame, used instead of
+            placement(frame, None) when the detector is unavailable,
+            detection/compositing fails, or a deadline leaves no time to
+            detect and there is no cached detection
+
+    A detector of None means detection is unavailable (e.g. MediaPipe is
+    not installed). `name` is the item type used in metrics; `key`
+    (default: name) identifies the pipeline uniquely. `z_order` stacks the
+    item's layers when it is combined with others in an OutfitPipeline
+    (higher is drawn later, on top). `assets` lists the garment images the
+    stages draw, whose version is part of cached results' keys. `scheduler`
+    plans renders that have a deadline (default: the shared
+    deadline.scheduler).
+    """
+
+    def __init__(self, name, detector, placement, compositor=composite_layers,
+                 decoder=decode_image, encoder=encode_jpeg, fallback=None,
+                 key=None, z_order=0, assets=(), scheduler=scheduler):
+        self.name = name
+        self.key = key or name
+        self.z_order = z_order
+        self.detector = detector
+        self.placement = placement
+        self.compositor = compositor
+        self.decoder = decoder
+        self.encoder = encoder
+        self.fallback = fallback
+        self.assets = tuple(assets)
+        self.scheduler = scheduler
+
+    def with_detector(self, detector):
+        """Copy of this pipeline with a different detector stage"""
+        pipeline = copy.copy(self)
+        pipeline.detector = detector
+        return pipeline
+
+    def asset_version(self):
+        """Version tag of the pipeline's garment images"""
+        return asset_store.version(self.assets)
+
+    @property
+    def detector_names(self):
+        """Names the scheduler tracks the detector stage's queue under"""
+        if self.detector is None:
+            return []
+        return [getattr(self.detector, '__name__', 'detector')]
+
+    def cached_detection(self, frame, session_id):
+        """
+        The session's last detection on frames shaped like frame, from the
+        detector's `latest(session_id, frame_shape)` (None if there is none)
+        """
+        latest = getattr(self.detector, 'latest', None)
+        if session_id is None or latest is None:
+            return None
+        return latest(session_id, frame.shape)
+
+    @property
+    def fallback_name(self):
+        if self.fallback is None:
+            return 'fallback_detection'
+        return getattr(self.fallback, '__name__', 'fallback')
+
+    def _fallback(self, frame, timings, reason, out):
+        metrics.fallbacks.inc(item=self.name, path=self.fallback_name,
+                              reason=reason)
+        with timed(timings, 'fallback'):
+            if self.fallback is None:
+                layers = self.placement(frame, None)
+                return self.compositor(frame, layers, out=out)
+            return self.fallback(frame, out=out)
+
+    def probe_detectors(self):
+        """Detectors by scheduler name, for probes that time each one"""
+        if self.detector is None:
+            return {}
+        return {self.detector_names[0]: self.detector}
+
+    def _probe(self, frame):
+        # Full inference on each detector alone: no session cache or region
+        for name, detector in self.probe_detectors().items():
+            try:
+                with self.scheduler.detecting([name]) as queued:
+                    start = time.perf_counter()
+                    detector(frame)
+                    seconds = time.perf_counter() - start
+                self.scheduler.observe_detect([name], seconds, queued, probe=True)
+            except Exception as e:
+                print(f"Error probing {name} for {self.name}: {e}")
+
+    def start_probe(self, frame):
+        """Refresh the detector estimates from a copy of frame, in the background"""
+        thread = threading.Thread(target=self._probe, args=(frame.copy(),),
+                                  name=f"probe-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _composite(self, frame, layers, out):
+        if out is not frame:
+            return self.compositor(frame, layers, out=out)
+        # Drawing in place: keep the pixels the layers cover so that, if
+        # compositing fails partway, the fallback draws on the clean frame.
+        # A custom compositor may draw anywhere: keep the whole frame.
+        layers = list(layers)
+        boxes = (layer_bounds(layers, frame.shape)
+                 if self.compositor is composite_layers else None)
+        if boxes is None:
+            boxes = [(0, 0, frame.shape[1], frame.shape[0])]
+        saved = []
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            region = frame[y0:y1, x0:x1]
+            backup = scratch(f'composite_backup{i}', region.shape, region.dtype)
+            np.copyto(backup, region)
+            saved.append((region, backup))
+        try:
+            return self.compositor(frame, layers, out=out)
+        except Exception:
+            for region, backup in saved:
+                np.copyto(region, backup)
+            raise
+
+    def _run_detector(self, frame, timings, hints):
+        names = self.detector_names
+        with self.scheduler.detecting(names) as queued:
+            with timed(timings, 'detect'):
+                detection = self.detector(frame, **hints)
+        self.scheduler.observe_detect(names, timings['detect'], queued)
+        return detection
+
+    def _render(self, frame, timings, session_id, roi, detect_size, out,
+                deadline=None, detect_frame=None):
+        if self.detector is None:
+            return self._fallback(frame, timings, 'unavailable', out)
+
+        plan = 'detect'
+        if deadline is not None:
+            plan = self.scheduler.plan(self.name, self.detector_names, deadline)
+            if plan == 'shed':
+                raise DeadlineExceeded(
+                    f"{self.name} try-on cannot finish within "
+                    f"{deadline.budget * 1000:.0f} ms"
+                )
+
+        try:
+            if detect_frame is None:
+                detect_frame = frame
+            if detect_size:
+                with timed(timings, 'resize'):
+                    detect_frame, scale = downscale(detect_frame, detect_size)
+                roi = scale_box(roi, scale)
+            hints = {}
+            if session_id is not None:
+                hints['session_id'] = session_id
+            if roi is not None:
+                hints['roi'] = roi
+            if plan == 'degrade':
+                # No time to detect: place the session's last detection on
+                # this frame, or fall back to the heuristic box. The detector
+                # estimate only recovers if the detector runs, so now and
+                # then it runs in the background.
+                if self.scheduler.claim_probe(self.detector_names):
+                    self.start_probe(detect_frame)
+                with timed(timings, 'cached'):
+                    detection = self.cached_detection(detect_frame, session_id)
+                if detection is None:
+                    return self._fallback(frame, timings, 'deadline', out)
+                metrics.fallbacks.inc(item=self.name, path='cached',
+                                      reason='deadline')
+            else:
+                # Landmarks are normalized to the frame, so detections on the
+                # downscaled copy apply to the full-size frame as they are
+                detection = self._run_detector(detect_frame, timings, hints)
+            if detection is None:
+                # The placement stage falls back to a heuristic box
+                metrics.fallbacks.inc(item=self.name, path='fallback_detection',
+                                      reason='no_detection')
+            with timed(timings, 'place'):
+                layers = self.placement(frame, detection)
+            with timed(timings, 'composite'):
+                return self._composite(frame, layers, out)
+        except Exception as e:
+            print(f"Error in {self.name} try-on: {e}")
+            return self._fallback(frame, timings, 'error', out)
+
+    def render(self, frame, timings=None, session_id=None, roi=None,
+               detect_size=None, output_size=None, out=None, deadline=None,
+               detect_frame=None):
+        """
+        Run detect, place and composite on a decoded frame
+
+        Args:
+            frame: BGR input frame
+            timings: Optional dict that receives per-stage seconds
+            session_id: Client session, lets the detector reuse results for
+                near-duplicate frames and crop to the previous detection
+            roi: [x, y, width, height] pixel box where the subject is
+                expected, so the detector can run on a crop
+            detect_size: Long side the frame is downscaled to for detection
+                (default: DEFAULT_DETECT_SIZE; 0 for native resolution)
+            output_size: Long side the frame is downscaled to before
+                compositing, i.e. the size of the result
+            out: Buffer the result is drawn into; pass frame itself to
+                render in place (then a downscaled frame, being a new
+                array, is drawn on directly). Default: a new array
+            deadline: Deadline the render must meet; when detection would
+                miss it, the item is placed from a cached detection or the
+                fallback (see deadline.Scheduler.plan)
+            detect_frame: Smaller decode of the same image (e.g. a reduced
+                JPEG decode) to detect on instead of frame; downscaled to
+                detect_size when larger. Not with roi, which is in frame
+                pixels.
+
+        Returns:
+            Frame with the item(s) overlaid
+
+        Raises:
+            DeadlineExceeded: The deadline cannot be met even by the fallback
+        """
+        if detect_size is None:
+            detect_size = DEFAULT_DETECT_SIZE
+        in_place = out is frame
+        stage_timings = {}
+        try:
+            frame, roi = resize_for_output(frame, roi, output_size,
+                                           stage_timings)
+            if in_place:
+                out = frame
+            return self._render(frame, stage_timings, session_id, roi,
+                                detect_size, out, deadline, detect_frame)
+        finally:
+            self.scheduler.observe(self.name, stage_timings)
+            metrics.observe_stages(self.name, stage_timings)
+            if timings is not None:
+                timings.update(stage_timings)
+
+    def process(self, data, timings=None, decoder=None, encoder=None,
+                session_id=None, roi=None, detect_size=None, output_size=None,
+                deadline=None):
+        """
+        Run the whole pipeline from encoded input to encoded output
+
+        Args:
+            data: Encoded input accepted by the decoder
+            timings: Optional dict that receives per-stage seconds
+            decoder, encoder: Override the pipeline's codec stages
+            session_id, roi, detect_size, output_size, deadline: Passed on
+                to render
+
+        Returns:
+            Encoder output for the rendered frame
+        """
+        if detect_size is None:
+            detect_size = DEFAULT_DETECT_SIZE
+        codec_timings = {}
+        try:
+            decode = decoder or self.decoder
+            detect_frame = None
+            with timed(codec_timings, 'decode'):
+                if output_size and roi is None:
+                    # Let JPEGs decode at a reduced scale. Not with a region,
+                    # which is in full-size input pixels.
+                    frame = decode(data, max_side=output_size)
+                else:
+                    frame = decode(data)
+                if (detect_size and roi is None and self.detector is not None
+                        and detect_reduction(data, detect_size, output_size)
+                        >= MIN_DETECT_REDUCTION):
+                    # A reduced JPEG decode for detection costs less than
+                    # downscaling the full frame
+                    detect_frame = decode(data, max_side=detect_size)
+            # The decoded frame is ours, so render into it in place
+            frame = self.render(frame, timings, session_id, roi, detect_size,
+                                output_size, out=frame, deadline=deadline,
+                                detect_frame=detect_frame)
+            with timed(codec_timings, 'encode'):
+                return (encoder or self.encoder)(frame)
+        finally:
+            self.scheduler.observe(self.name, codec_timings)
+            metrics.observe_stages(self.name, codec_timings)
+            if timings is not None:
+                timings.update(codec_timings)
+
+
+class OutfitPipeline(TryOnPipeline):
+    """
+    Several items rendered in one pass
+
+    Each distinct detector of the items runs once per frame, and the items'
+    layers are drawn in z-order onto a single copy of the frame, which is
+    encoded once. An item whose detector found nothing (or is unavailable)
+    is placed from its heuristic box. Per-item fallbacks are not used: the
+    outfit falls back to placing every item heuristically.
+
+    Args:
+        items: Item pipelines; their placement and detector stages are used
+        key: Unique key (default: "outfit:" + the item keys)
+    """
+
+    def __init__(self, items, key=None):
+        self.items = sorted(items, key=lambda item: item.z_order)
+        self.detectors = {}
+        for item in self.items:
+            if item.detector is not None:
+                self.detectors.setdefault(self._detector_name(item),
+                                          item.detector)
+        super().__init__(
+            '+'.join(item.name for item in self.items),
+            self._detect if self.detectors else None,
+            self._place,
+            key=key or 'outfit:' + ','.join(item.key for item in self.items),
+            assets=[path for item in self.items for path in item.assets],
+        )
+
+    @staticmethod
+    def _detector_name(item):
+        return getattr(item.detector, '__name__', id(item.detector))
+
+    @property
+    def detector_names(self):
+        return list(self.detectors)
+
+    def probe_detectors(self):
+        return dict(self.detectors)
+
+    def cached_detection(self, frame, session_id):
+        if session_id is None:
+            return None
+        detection = {}
+        for name, detector in self.detectors.items():
+            latest = getattr(detector, 'latest', None)
+            detection[name] = (latest(session_id, frame.shape)
+                               if latest is not None else None)
+        if all(result is None for result in detection.values()):
+            return None
+        return detection
+
+    def _detect(self, frame, **hints):
+        if len(self.detectors) > 1:
+            # A region hint describes one subject box (face or body), so it
+            # is only meaningful with a single detector
+            hints.pop('roi', None)
+        detection = {name: detector(frame, **hints)
+                     for name, detector in self.detectors.items()}
+        if all(result is None for result in detection.values()):
+            return None
+        return detection
+
+    def _place(self, frame, detection):
+        layers = []
+        for item in self.items:
+            item_detection = None
+            if detection is not None and item.detector is not None:
+                item_detection = detection.get(self._detector_name(item))
+            layers.extend(item.placement(frame, item_detection))
+        return layers
@@ -0,0 +1,239 @@
+"""
+Cache of rendered try-on results for resubmitted photos.
+
+Kiosk and catalog clients send the same photo with the same item again
+(e.g. toggling between the shirt and the dress), which would otherwise
+redo decode, detection, compositing and encode. Results are keyed by a
+digest of the input bytes, the pipeline key, the version of its garment
+images and the output parameters, and kept in an LRU bounded by bytes.
+Entries evicted from memory can spill to a directory on disk (also bounded
+by bytes) instead of being dropped.
+
+The key doubles as the response's ETag, so a client that sends it back in
+If-None-Match gets a 304 without the result even being read.
+
+Spilled files are only valid for the process that wrote them (the index is
+in memory), so each process spills into its own subdirectory and removes
+the ones of processes that are gone.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Memory budget for cached results (bytes); 0 disables the cache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Disk budget for spilled results (bytes)
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+
+SPILL_SUFFIX = '.wxr'
+
+result_cache_lookups = metrics.registry.counter(
+    'tryon_result_cache_lookups_total',
+    'Rendered-result cache lookups: memory hit, disk hit, miss or not modified (304)',
+    ('result',)
+)
+
+
+def content_digest(data):
+    """Digest of a request's input (bytes, or a data URL string)"""
+    if isinstance(data, str):
+        data = data.encode('ascii', 'replace')
+    return hashlib.blake2b(memoryview(data), digest_size=16).hexdigest()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def remove_stale_spills(spill_dir):
+    """Remove the spill subdirectories of processes that no longer run"""
+    for name in os.listdir(spill_dir):
+        if name.isdigit() and not _process_alive(int(name)):
+            shutil.rmtree(os.path.join(spill_dir, name), ignore_errors=True)
+
+
+def result_key(*parts):
+    """Cache key (and ETag) from the parts a rendered result depends on"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU of encoded results bounded by bytes, with optional disk spill
+
+    Args:
+        max_bytes: Memory budget; 0 disables the cache
+        spill_dir: Directory evicted entries are written to, in a
+            subdirectory per process (None: they are dropped)
+        disk_bytes: Budget of the spill directory
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_dir=None,
+                 disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = None
+        self.disk_bytes = disk_bytes
+        self._entries = OrderedDict()  # key -> (value, meta)
+        self._bytes = 0
+        self._spilled = OrderedDict()  # key -> (size, meta)
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if spill_dir and self.enabled:
+            os.makedirs(spill_dir, exist_ok=True)
+            remove_stale_spills(spill_dir)
+            self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key + SPILL_SUFFIX)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._spilled
+
+    def get(self, key):
+        """
+        Cached result for a key
+
+        Returns:
+            (value, meta), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result_cache_lookups.inc(result='hit')
+                return entry
+            spilled = self._spilled.pop(key, None)
+            if spilled is not None:
+                self._disk_used -= spilled[0]
+        if spilled is None:
+            with self._lock:
+                self.misses += 1
+            result_cache_lookups.inc(result='miss')
+            return None
+
+        path = self._spill_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except OSError:
+            value = None
+        self._unlink(path)
+        if value is None or len(value) != spilled[0]:
+            with self._lock:
+                self.misses += 1
+            result_cache_lookups.inc(result='miss')
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        result_cache_lookups.inc(result='disk_hit')
+        # Back into memory as the most recently used entry
+        self.put(key, value, spilled[1])
+        return value, spilled[1]
+
+    def put(self, key, value, meta=None):
+        """Cache an encoded result (bytes) with small metadata"""
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = (value, meta)
+            self._bytes += len(value)
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, (old_value, old_meta) = self._entries.popitem(last=False)
+                self._bytes -= len(old_value)
+                self.evictions += 1
+                evicted.append((old_key, old_value, old_meta))
+        if self.spill_dir:
+            for old_key, old_value, old_meta in evicted:
+                self._spill(old_key, old_value, old_meta)
+
+    def _spill(self, key, value, meta):
+        if len(value) > self.disk_bytes:
+            return
+        path = self._spill_path(key)
+        tmp = path + '.part'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not spill cached result to {path}: {e}")
+            self._unlink(tmp)
+            return
+        removed = []
+        with self._lock:
+            old = self._spilled.pop(key, None)
+            if old is not None:
+                self._disk_used -= old[0]
+            self._spilled[key] = (len(value), meta)
+            self._disk_used += len(value)
+            while self._disk_used > self.disk_bytes and len(self._spilled) > 1:
+                old_key, (size, _) = self._spilled.popitem(last=False)
+                self._disk_used -= size
+                removed.append(old_key)
+        for old_key in removed:
+            self._unlink(self._spill_path(old_key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            spilled = list(self._spilled)
+            self._spilled.clear()
+            self._disk_used = 0
+        for key in spilled:
+            self._unlink(self._spill_path(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "spilled": len(self._spilled),
+                "disk_bytes": self._disk_used,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Shared cache for the try-on endpoints
+result_cache = ResultCache(
+    int(os.environ.get("WEARX_RESULT_CACHE_BYTES", DEFAULT_MAX_BYTES)),
+    spill_dir=os.environ.get("WEARX_RESULT_CACHE_DIR") or None,
+    disk_bytes=int(os.environ.get("WEARX_RESULT_CACHE_DISK_BYTES",
+                                  DEFAULT_DISK_BYTES)),
+)
@@ -0,0 +1,230 @@
+"""
+Region-of-interest detection: run a detector on a padded crop around the
+previous face/body box instead of the whole frame.
+
+The prior box comes from the request (`roi`, in input pixels) or from the
+last detection of the same session. Landmarks found in the crop are mapped
+back to full-frame coordinates; if the crop yields nothing, the detector
+runs once more on the full frame. A face is a few percent of a 1080p frame,
+so earrings inference touches an order of magnitude fewer pixels.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from landmarks import array_to_landmarks, as_landmarks, landmarks_to_array
+from pipeline import ParameterError
+
+roi_detections = metrics.registry.counter(
+    'tryon_roi_detections_total',
+    'Detector runs by region: crop hit, crop miss (then full frame) or full frame',
+    ('detector', 'result')
+)
+roi_pixels = metrics.registry.counter(
+    'tryon_roi_pixels_total',
+    'Pixels in the input frames and pixels actually passed to the detector',
+    ('detector', 'kind')
+)
+
+
+class RegionError(ParameterError):
+    """Raised when a client-supplied region cannot be parsed"""
+
+
+def parse_region(value):
+    """
+    Parse a client region as an [x, y, width, height] pixel box
+
+    Args:
+        value: "x,y,w,h" string or a sequence of four numbers
+
+    Returns:
+        [x, y, width, height] ints, or None if value is empty
+    """
+    if value is None or value == '':
+        return None
+    parts = value.split(',') if isinstance(value, str) else value
+    try:
+        box = [int(round(float(v))) for v in parts]
+    except (TypeError, ValueError):
+        raise RegionError(f"Invalid region {value!r}, expected x,y,w,h")
+    if len(box) != 4 or box[2] <= 0 or box[3] <= 0:
+        raise RegionError(f"Invalid region {value!r}, expected x,y,w,h")
+    return box
+
+
+def landmark_box(landmarks, frame_shape):
+    """
+    Pixel bounding box [x, y, width, height] of normalized landmarks,
+    clipped to the frame
+
+    Args:
+        landmarks: MediaPipe-style landmarks, Landmarks or an (N, 3) array
+        frame_shape: Shape of the frame the landmarks refer to
+    """
+    return as_landmarks(landmarks).box(frame_shape, clip=True)
+
+
+def crop_region(frame_shape, box, padding=0.5, min_size=96, max_area=0.6):
+    """
+    Padded crop around a box, clipped to the frame
+
+    Args:
+        frame_shape: Shape of the full frame
+        box: [x, y, width, height] pixel box
+        padding: Margin added on each side, as a fraction of the box size
+        min_size: Smallest crop side in pixels (the box is grown around its
+            centre to reach it)
+        max_area: Crops covering more than this fraction of the frame are
+            not worth it; None is returned and the full frame is used
+
+    Returns:
+        (x0, y0, x1, y1) pixel bounds, or None
+    """
+    h, w = frame_shape[:2]
+    x, y, bw, bh = box
+    cw = max(bw * (1 + 2 * padding), min_size)
+    ch = max(bh * (1 + 2 * padding), min_size)
+    cx, cy = x + bw / 2.0, y + bh / 2.0
+    x0 = max(0, int(cx - cw / 2))
+    y0 = max(0, int(cy - ch / 2))
+    x1 = min(w, int(np.ceil(cx + cw / 2)))
+    y1 = min(h, int(np.ceil(cy + ch / 2)))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    if (x1 - x0) * (y1 - y0) > max_area * w * h:
+        return None
+    return x0, y0, x1, y1
+
+
+def to_frame_landmarks(landmarks, region, frame_shape):
+    """Map landmarks normalized to a crop back to the full frame"""
+    x0, y0, x1, y1 = region
+    h, w = frame_shape[:2]
+    points = landmarks_to_array(landmarks).copy()
+    points[:, 0] = (x0 + points[:, 0] * (x1 - x0)) / w
+    points[:, 1] = (y0 + points[:, 1] * (y1 - y0)) / h
+    # MediaPipe's z uses the same scale as x
+    points[:, 2] *= (x1 - x0) / float(w)
+    return array_to_landmarks(points)
+
+
+class RegionMemory:
+    """
+    Last detected box (and the detection it came from) per (session,
+    detector), with a TTL
+
+    Args:
+        max_sessions: Sessions kept before the least recently used is dropped
+        ttl: Seconds a box stays usable as the next frame's region
+    """
+
+    def __init__(self, max_sessions=1024, ttl=2.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._boxes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, session_id, detector_name, frame_shape):
+        key = (session_id, detector_name)
+        with self._lock:
+            entry = self._boxes.get(key)
+            if entry is None:
+                return None
+            box, detection, shape, stored_at = entry
+            if shape != frame_shape[:2] or time.monotonic() - stored_at > self.ttl:
+                del self._boxes[key]
+                return None
+            self._boxes.move_to_end(key)
+            return entry
+
+    def get(self, session_id, detector_name, frame_shape):
+        entry = self._entry(session_id, detector_name, frame_shape)
+        return entry[0] if entry is not None else None
+
+    def detection(self, session_id, detector_name, frame_shape):
+        """The detection the session's box came from (None if expired)"""
+        entry = self._entry(session_id, detector_name, frame_shape)
+        return entry[1] if entry is not None else None
+
+    def store(self, session_id, detector_name, frame_shape, box, detection=None):
+        """Remember a box for the session; a box of None forgets it"""
+        key = (session_id, detector_name)
+        with self._lock:
+            if box is None:
+                self._boxes.pop(key, None)
+                return
+            self._boxes[key] = (box, detection, frame_shape[:2], time.monotonic())
+            self._boxes.move_to_end(key)
+            while len(self._boxes) > self.max_sessions:
+                self._boxes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._boxes.clear()
+
+
+def roi_detector(detector, memory, padding=0.5, max_area=0.6):
+    """
+    Wrap a detector stage so it first runs on a crop around a prior box
+
+    The wrapped detector takes (frame, session_id=None, roi=None). `roi` is
+    a pixel box for this frame; without one, the session's last detected
+    box is used. The session id is passed on to the inner detector (e.g. a
+    cached_detector). `detect.latest(session_id, frame_shape)` returns the
+    session's last full-frame detection, for renders with no time to detect.
+    """
+    name = detector.__name__
+
+    def run(frame, session_id):
+        roi_pixels.inc(frame.shape[0] * frame.shape[1], detector=name,
+                       kind='inferred')
+        if session_id is None:
+            return detector(frame)
+        return detector(frame, session_id=session_id)
+
+    def detect(frame, session_id=None, roi=None):
+        roi_pixels.inc(frame.shape[0] * frame.shape[1], detector=name,
+                       kind='frame')
+        box = roi
+        if box is None and session_id is not None:
+            box = memory.get(session_id, name, frame.shape)
+        region = (crop_region(frame.shape, box, padding, max_area=max_area)
+                  if box is not None else None)
+
+        detection = None
+        if region is not None:
+            x0, y0, x1, y1 = region
+            detection = run(frame[y0:y1, x0:x1], session_id)
+            if detection is not None:
+                roi_detections.inc(detector=name, result='crop')
+                detection = to_frame_landmarks(detection, region, frame.shape)
+            else:
+                roi_detections.inc(detector=name, result='crop_miss')
+        if detection is None:
+            if region is None:
+                roi_detections.inc(detector=name, result='full')
+            detection = run(frame, session_id)
+
+        if session_id is not None:
+            memory.store(session_id, name, frame.shape,
+                         landmark_box(detection, frame.shape)
+                         if detection is not None else None, detection)
+        return detection
+
+    def latest(session_id, frame_shape):
+        return memory.detection(session_id, name, frame_shape)
+
+    detect.__name__ = name
+    detect.latest = latest
+    return detect
+
+
+# Shared region memory for the try-on pipelines
+region_memory = RegionMemory(
+    ttl=float(os.environ.get("WEARX_ROI_TTL", "2.0")),
+)
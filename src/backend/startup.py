@@ -0,0 +1,48 @@
+"""
+Startup timings of the server process: how long the imports took, how
+long each detector took to load, and the latency of the first request of
+each item type (which pays for whatever was still loading). Reported on the
+console as they happen and by the /ready endpoint.
+"""
+import threading
+import time
+
+# Close to process start: app.py imports this module first
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_phases = {}
+_first_requests = {}
+
+
+def since_start():
+    """Seconds since this module was imported"""
+    return time.perf_counter() - STARTED
+
+
+def record(phase, seconds):
+    """Record how long a startup phase took, e.g. 'import' or 'mediapipe_import'"""
+    with _lock:
+        _phases[phase] = seconds
+    print(f"Startup: {phase} took {seconds * 1000:.0f} ms")
+
+
+def first_request(name, seconds):
+    """Record the latency of a request if it is the first one for name"""
+    with _lock:
+        if name in _first_requests:
+            return
+        _first_requests[name] = seconds
+    print(f"Startup: first {name} request took {seconds * 1000:.0f} ms "
+          f"({since_start():.1f} s after start)")
+
+
+def report():
+    """Recorded timings in seconds"""
+    with _lock:
+        return {
+            'uptime_seconds': round(since_start(), 3),
+            'phases': {k: round(v, 4) for k, v in _phases.items()},
+            'first_request_seconds': {k: round(v, 4)
+                                      for k, v in _first_requests.items()},
+        }
@@ -0,0 +1,303 @@
+"""
+Streaming try-on sessions: a client pushes webcam frames over a WebSocket
+and receives composited frames back.
+
+Each session keeps a LandmarkTracker per detector that runs full MediaPipe
+only on keyframes and propagates the landmarks in between with sparse
+Lucas-Kanade optical flow. Frames that arrive while the previous one is
+still rendering replace it, so latency stays bounded under load.
+"""
+import copy
+import json
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import metrics
+from codec import ImageDecodeError, decode_image, encode_jpeg
+from deadline import Scheduler
+from landmarks import array_to_landmarks, landmarks_to_array
+from pipeline import OutfitPipeline
+from roi import landmark_box
+
+stream_frames = metrics.registry.counter(
+    'tryon_stream_frames_total', 'Streaming frames by outcome', ('item', 'result')
+)
+stream_sessions = metrics.registry.gauge(
+    'tryon_stream_sessions', 'Open streaming try-on sessions'
+)
+tracker_updates = metrics.registry.counter(
+    'tryon_tracker_updates_total', 'Landmark tracker updates by kind',
+    ('detector', 'kind')
+)
+
+
+class LandmarkTracker:
+    """
+    Detector stage that runs the real detector on keyframes and tracks the
+    landmarks with optical flow in between
+
+    Args:
+        detector: Detector stage returning MediaPipe-style landmarks or None;
+            called with roi= once there are tracked points (see roi_detector)
+        keyframe_interval: Run the real detector at least every N frames
+        min_tracked: Fraction of points that must be tracked, else re-detect
+        smoothing: Weight of the previous position when a keyframe arrives
+            (0 disables smoothing)
+        flow_width: Frames are downscaled to this width for optical flow
+    """
+
+    def __init__(self, detector, keyframe_interval=5, min_tracked=0.7,
+                 smoothing=0.3, flow_width=320):
+        self.detector = detector
+        self.name = getattr(detector, '__name__', 'detector')
+        self.keyframe_interval = keyframe_interval
+        self.min_tracked = min_tracked
+        self.smoothing = smoothing
+        self.flow_width = flow_width
+        self.points = None  # (N, 3) normalized landmarks
+        self.prev_gray = None
+        self.since_keyframe = 0
+
+    def reset(self):
+        self.points = None
+        self.prev_gray = None
+        self.since_keyframe = 0
+
+    def _gray(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.flow_width / float(w))
+        small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _keyframe(self, frame, gray):
+        tracker_updates.inc(detector=self.name, kind='keyframe')
+        if self.points is None:
+            landmarks = self.detector(frame)
+        else:
+            # Let the detector crop to where the subject was tracked to
+            roi = landmark_box(self.points, frame.shape)
+            landmarks = self.detector(frame, roi=roi)
+        self.prev_gray = gray
+        self.since_keyframe = 0
+        if landmarks is None:
+            self.points = None
+            return None
+        points = landmarks_to_array(landmarks)
+        if (self.smoothing and self.points is not None
+                and self.points.shape == points.shape):
+            points = self.smoothing * self.points + (1.0 - self.smoothing) * points
+        self.points = points
+        return array_to_landmarks(points)
+
+    def __call__(self, frame):
+        gray = self._gray(frame)
+        if (self.points is None or self.prev_gray is None
+                or self.prev_gray.shape != gray.shape
+                or self.since_keyframe >= self.keyframe_interval - 1):
+            return self._keyframe(frame, gray)
+
+        gh, gw = gray.shape
+        scale = np.array([gw, gh], dtype=np.float32)
+        prev_px = (self.points[:, :2] * scale).reshape(-1, 1, 2)
+        next_px, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, prev_px, None, winSize=(15, 15), maxLevel=2
+        )
+        tracked = status.ravel() == 1
+        if next_px is None or tracked.mean() < self.min_tracked:
+            return self._keyframe(frame, gray)
+
+        tracker_updates.inc(detector=self.name, kind='flow')
+        points = self.points.copy()
+        points[tracked, :2] = next_px.reshape(-1, 2)[tracked] / scale
+        self.points = points
+        self.prev_gray = gray
+        self.since_keyframe += 1
+        return array_to_landmarks(points)
+
+
+class LatestFrameSlot:
+    """
+    Single-slot mailbox holding only the newest frame; putting a frame
+    while one is waiting drops the older one. Control messages are queued
+    and never dropped, and are taken before the pending frame.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._controls = deque()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+        return self
+
+    def put_control(self, item):
+        with self._cond:
+            self._controls.append(item)
+            self._cond.notify()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def take(self):
+        """Block until a message is available; None once closed"""
+        with self._cond:
+            while self._item is None and not self._controls and not self._closed:
+                self._cond.wait()
+            if self._controls:
+                return self._controls.popleft()
+            item, self._item = self._item, None
+            return item
+
+
+class StreamSession:
+    """
+    Per-connection state: the selected item's pipeline with trackers
+    replacing its detector
+
+    Args:
+        get_pipeline: Function mapping an item type (or a list of them) to a
+            TryOnPipeline
+        item_type: Initially selected item(s)
+        max_age: Frames older than this many seconds are dropped unrendered
+        detect_size, output_size: Passed on to TryOnPipeline.render
+    """
+
+    def __init__(self, get_pipeline, item_type='tshirt', max_age=0.5,
+                 keyframe_interval=5, detect_size=None, output_size=None):
+        self.get_pipeline = get_pipeline
+        self.max_age = max_age
+        self.detect_size = detect_size
+        self.output_size = output_size
+        self.keyframe_interval = keyframe_interval
+        self._trackers = {}
+        # Tracked frames cost a fraction of a detection; keep their timings
+        # out of the shared scheduler the HTTP deadlines are planned with
+        self.scheduler = Scheduler()
+        self.pipeline = None
+        self.select(item_type)
+
+    def _tracker(self, detector):
+        # Shirt and dress share the pose tracker, like the detection cache
+        name = getattr(detector, '__name__', id(detector))
+        tracker = self._trackers.get(name)
+        if tracker is None:
+            tracker = LandmarkTracker(detector, self.keyframe_interval)
+            self._trackers[name] = tracker
+        return tracker
+
+    def _tracked(self, pipeline):
+        if pipeline.detector is None:
+            return pipeline
+        return pipeline.with_detector(self._tracker(pipeline.detector))
+
+    def select(self, item_type):
+        base = self.get_pipeline(item_type)
+        if isinstance(base, OutfitPipeline):
+            # Track each item's detector, then combine the tracked items
+            self.pipeline = OutfitPipeline([self._tracked(item)
+                                            for item in base.items])
+        else:
+            self.pipeline = self._tracked(base)
+        if self.pipeline is base:
+            self.pipeline = copy.copy(base)
+        self.pipeline.scheduler = self.scheduler
+
+    def render(self, data, received_at):
+        """
+        Render one encoded frame
+
+        Returns:
+            JPEG bytes, or None if the frame was too old and dropped
+        """
+        name = self.pipeline.name
+        if time.monotonic() - received_at > self.max_age:
+            stream_frames.inc(item=name, result='stale')
+            return None
+        frame = decode_image(data)
+        frame = self.pipeline.render(frame, detect_size=self.detect_size,
+                                     output_size=self.output_size, out=frame)
+        stream_frames.inc(item=name, result='rendered')
+        return encode_jpeg(frame).tobytes()
+
+
+def run_stream(ws, get_pipeline, item_type='tshirt', max_age=0.5,
+               detect_size=None, output_size=None):
+    """
+    Serve one WebSocket connection
+
+    Protocol: the client sends binary messages holding encoded frames (JPEG
+    or PNG) and may send a text message `{"type": "<item>"}` (or a list of
+    items) to switch items. The server replies to each rendered frame with a binary JPEG
+    message, and with a text `{"error": ...}` message for undecodable input.
+
+    Args:
+        ws: WebSocket with blocking receive()/send() (e.g. flask-sock)
+        get_pipeline: Function mapping an item type to a TryOnPipeline
+        item_type: Initially selected item
+        max_age: Seconds after which a queued frame is considered stale
+        detect_size, output_size: Passed on to TryOnPipeline.render
+    """
+    session = StreamSession(get_pipeline, item_type, max_age,
+                            detect_size=detect_size, output_size=output_size)
+    slot = LatestFrameSlot()
+
+    def receive_loop():
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    slot.put_control((message, None))
+                else:
+                    slot.put((message, time.monotonic()))
+        except Exception as e:
+            print(f"Stream receive ended: {e}")
+        finally:
+            slot.close()
+
+    receiver = threading.Thread(target=receive_loop, daemon=True)
+    receiver.start()
+    stream_sessions.inc()
+    dropped = 0
+    try:
+        while True:
+            item = slot.take()
+            if item is None:
+                break
+            if slot.dropped > dropped:
+                stream_frames.inc(slot.dropped - dropped,
+                                  item=session.pipeline.name, result='dropped')
+                dropped = slot.dropped
+            message, received_at = item
+            if isinstance(message, str):
+                try:
+                    session.select(json.loads(message)['type'])
+                except (ValueError, KeyError, TypeError) as e:
+                    ws.send(json.dumps({'error': f"Invalid control message: {e}"}))
+                continue
+            try:
+                result = session.render(message, received_at)
+            except ImageDecodeError as e:
+                ws.send(json.dumps({'error': str(e)}))
+                continue
+            if result is not None:
+                ws.send(result)
+    finally:
+        stream_sessions.dec()
+        slot.close()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+
+from asgi import SEND_CHUNK, ServerSettings, WSGIBridge, wsgi_environ
+
+
+def settings(**overrides):
+    values = dict(host='127.0.0.1', port=8000, threads=1, queue=1, streams=1,
+                  max_body=1024, keepalive=5, workers=1)
+    values.update(overrides)
+    return ServerSettings(**values)
+
+
+def request(bridge, body=b'', method='POST', path='/api/try-on'):
+    """Serve one HTTP request, returning (status, body, messages sent)"""
+    sent = []
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    async def serve():
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'headers': [(b'content-type', b'application/json')]}
+        await bridge(scope, receive, send)
+    return serve(), sent
+
+
+def response(sent):
+    body = b''.join(m.get('body', b'') for m in sent
+                    if m['type'] == 'http.response.body')
+    return sent[0]['status'], body
+
+
+def test_environ_from_scope():
+    scope = {'method': 'GET', 'path': '/api/health', 'query_string': b'a=1',
+             'headers': [(b'content-type', b'text/plain'),
+                         (b'x-session', b'a'), (b'x-session', b'b')]}
+    environ = wsgi_environ(scope, b'body', received_at=5.0)
+    assert environ['PATH_INFO'] == '/api/health'
+    assert environ['QUERY_STRING'] == 'a=1'
+    assert environ['CONTENT_TYPE'] == 'text/plain'
+    assert environ['CONTENT_LENGTH'] == '4'
+    assert environ['HTTP_X_SESSION'] == 'a,b'
+    assert environ['wsgi.input'].read() == b'body'
+    assert environ['wearx.received_at'] == 5.0
+
+
+def test_routes_run_off_the_event_loop_and_stream_large_bodies():
+    threads = []
+    payload = b'x' * (2 * SEND_CHUNK + 10)
+
+    def app(environ, start_response):
+        threads.append(threading.current_thread())
+        start_response('200 OK', [('Content-Type', 'image/jpeg')])
+        return [payload]
+
+    bridge = WSGIBridge(app, settings())
+    serve, sent = request(bridge)
+    asyncio.run(serve)
+    bridge.shutdown()
+    assert threads[0] is not threading.current_thread()
+    assert threads[0].name.startswith('asgi-request')
+    assert response(sent) == (200, payload)
+    assert max(len(m.get('body', b'')) for m in sent[1:]) == SEND_CHUNK
+
+
+def test_requests_beyond_the_threads_and_queue_are_shed():
+    release = threading.Event()
+
+    def app(environ, start_response):
+        release.wait(5)
+        start_response('200 OK', [])
+        return [b'ok']
+
+    bridge = WSGIBridge(app, settings(threads=1, queue=1))
+
+    async def serve_three():
+        requests = [request(bridge) for _ in range(3)]
+        tasks = [asyncio.ensure_future(serve) for serve, _ in requests]
+        # The third request finds one running and one queued
+        await asyncio.wait([tasks[2]], timeout=5)
+        assert bridge._pending == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        return [response(sent) for _, sent in requests]
+
+    results = asyncio.run(serve_three())
+    bridge.shutdown()
+    assert results[:2] == [(200, b'ok'), (200, b'ok')]
+    status, body = results[2]
+    assert status == 503
+    assert json.loads(body)['success'] is False
+    assert bridge._pending == 0
+
+
+def test_oversized_bodies_are_rejected_before_the_route_runs():
+    calls = []
+    bridge = WSGIBridge(lambda environ, start_response: calls.append(1),
+                        settings(max_body=16))
+    serve, sent = request(bridge, body=b'x' * 17)
+    asyncio.run(serve)
+    bridge.shutdown()
+    assert response(sent)[0] == 413
+    assert not calls
@@ -0,0 +1,65 @@
+import numpy as np
+
+from ml_models.assets import RESIZE_CACHE_SIZE, AssetStore
+
+
+def garment(width=200, height=100):
+    image = np.zeros((height, width, 4), np.uint8)
+    image[10:-10, 20:-20] = (30, 60, 90, 255)
+    return image
+
+
+def store_bytes(store):
+    return store.stats()['bytes']
+
+
+def test_resized_overlays_count_against_the_budget():
+    store = AssetStore()
+    asset = store.put(('shirt', 0, None), garment())
+    levels = store_bytes(store)
+    assert asset.resize_bytes == 0
+
+    overlay = asset.resized(60, 40)
+    assert asset.resize_bytes == overlay.nbytes
+    assert asset.nbytes == levels + overlay.nbytes
+    assert store_bytes(store) == asset.nbytes
+
+    # A hit changes nothing
+    asset.resized(60, 40)
+    assert store_bytes(store) == asset.nbytes
+
+
+def test_dropped_overlays_are_released():
+    store = AssetStore()
+    asset = store.put(('shirt', 0, None), garment())
+    for i in range(RESIZE_CACHE_SIZE + 5):
+        asset.resized(40 + 8 * i, 30)
+    kept = sum(overlay.nbytes for overlay, _ in asset._resized.values())
+    assert len(asset._resized) == RESIZE_CACHE_SIZE
+    assert asset.resize_bytes == kept
+    assert store_bytes(store) == asset.nbytes
+
+
+def test_pyramid_levels_used_as_they_are_cost_nothing():
+    store = AssetStore()
+    asset = store.put(('shirt', 0, None), garment())
+    asset.resized(200, 100)
+    assert asset.resize_bytes == 0
+
+
+def test_resizing_evicts_older_assets():
+    first_levels = AssetStore().put(('probe', 0, None), garment()).nbytes
+    store = AssetStore(max_bytes=2 * first_levels + 1000)
+    old = store.put(('old', 0, None), garment())
+    new = store.put(('new', 0, None), garment())
+    assert store.stats()['entries'] == 2
+
+    new.resized(180, 90)
+    assert store.stats()['entries'] == 1
+    assert store.stats()['evictions'] == 1
+    assert store_bytes(store) == new.nbytes
+
+    # A request still holding the evicted asset does not change the count
+    old.resized(120, 60)
+    assert store_bytes(store) == new.nbytes
+
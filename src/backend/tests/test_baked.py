@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+import pytest
+
+from bake_assets import bake, parse_entry
+from ml_models.assets import AssetStore, scale_box
+from ml_models.earring_tryon import earring_box
+from ml_models.tshirt_tryon import tshirt_placement
+
+
+@pytest.fixture
+def garment_path(tmp_path):
+    image = np.zeros((100, 200, 4), np.uint8)
+    image[10:90, 40:160] = (30, 60, 90, 255)
+    path = str(tmp_path / 'garment.png')
+    cv2.imwrite(path, image)
+    return path
+
+
+def test_baked_assets_keep_their_box_and_anchors(garment_path):
+    _, header = bake(garment_path)
+    asset = AssetStore().get(garment_path)
+    assert asset.mapped
+    assert asset.bbox == header['bbox'] == [40, 10, 120, 80]
+    assert asset.anchors == header['anchors']
+    assert asset.anchors['hook'] == pytest.approx([0.4975, 0.1])
+    # Decoded assets find the same anchors
+    decoded = AssetStore().put(('decoded', 0, None), cv2.imread(
+        garment_path, cv2.IMREAD_UNCHANGED))
+    assert decoded.anchors == asset.anchors
+
+
+def test_mapped_assets_are_charged_their_resized_overlays(garment_path):
+    bake(garment_path)
+    store = AssetStore()
+    asset = store.get(garment_path)
+    assert store.stats()['bytes'] == 0
+    overlay = asset.resized(60, 40)
+    assert store.stats()['bytes'] == overlay.nbytes
+
+
+def test_entry_limit_bounds_the_store():
+    store = AssetStore(max_entries=2)
+    for name in 'abc':
+        store.put((name, 0, None), np.zeros((8, 8, 4), np.uint8))
+    assert store.stats()['entries'] == 2
+    assert store.stats()['evictions'] == 1
+
+
+def test_scaled_box_covers_the_resized_pixels(garment_path):
+    asset = AssetStore().put(('decoded', 0, None), cv2.imread(
+        garment_path, cv2.IMREAD_UNCHANGED))
+    for size in [(40, 20), (124, 60), (200, 100), (420, 212)]:
+        overlay, (x, y, w, h) = asset.resized_region(*size)
+        outside = overlay.copy()
+        outside[y:y + h, x:x + w] = 0
+        assert not outside.any()
+    assert scale_box(None, (10, 10), (5, 5)) is None
+
+
+def test_entries_keep_windows_paths_whole():
+    assert parse_entry(r'C:\garments\shirt.png') == (r'C:\garments\shirt.png', None)
+    assert parse_entry('C:shirt.png') == ('C:shirt.png', None)
+    assert parse_entry(r'C:\g\shirt.png:ml_models.tshirt_tryon.remove_white_background') == (
+        r'C:\g\shirt.png', 'ml_models.tshirt_tryon.remove_white_background')
+    assert parse_entry('shirt.png') == ('shirt.png', None)
+
+
+def test_placement_uses_attach_points():
+    anchors = {'hook': [0.25, 0.1],
+               'left_shoulder': [0.2, 0.3], 'right_shoulder': [0.8, 0.3]}
+    # The hook hangs from the ear point
+    assert earring_box({'anchors': None}, 100, 50, 40, 60) == [80, 50, 40, 60]
+
+    class Earring:
+        pass
+    earring = Earring()
+    earring.anchors = anchors
+    assert earring_box(earring, 100, 50, 40, 60) == [90, 44, 40, 60]
+
+    # The shirt's shoulders are centred on the body box's shoulder line
+    x, y, width, height = tshirt_placement([100, 50, 200, 300], anchors)
+    assert x + 0.5 * width == pytest.approx(200, abs=1)
+    assert y + 0.3 * height == pytest.approx(50 + 20, abs=1)
+    assert tshirt_placement([100, 50, 200, 300]) == [50, 22, 200, 280]
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+import pytest
+
+from codec import ImageDecodeError, decode_image, jpeg_size, reduction_factor
+from pipeline import detect_reduction
+
+
+def encode(width, height, ext='.jpg'):
+    frame = np.full((height, width, 3), 128, np.uint8)
+    return cv2.imencode(ext, frame)[1].tobytes()
+
+
+def test_jpeg_size_reads_the_frame_header():
+    assert jpeg_size(encode(640, 360)) == (640, 360)
+    assert jpeg_size(memoryview(encode(33, 17))) == (33, 17)
+    assert jpeg_size(encode(64, 64, '.png')) is None
+    assert jpeg_size(b'\xff\xd8') is None
+
+
+@pytest.mark.parametrize('max_side, factor', [
+    (None, 1), (1280, 1), (1000, 1), (640, 2), (320, 4), (200, 4), (160, 8), (100, 8),
+])
+def test_reduction_keeps_the_long_side_at_least_max_side(max_side, factor):
+    assert reduction_factor(encode(1280, 720), max_side) == factor
+
+
+def test_reduced_decode():
+    data = encode(1280, 720)
+    assert decode_image(data).shape == (720, 1280, 3)
+    assert decode_image(data, max_side=320).shape == (180, 320, 3)
+    assert decode_image(data, max_side=300).shape == (180, 320, 3)
+    png = encode(1280, 720, '.png')
+    assert decode_image(png, max_side=320).shape == (720, 1280, 3)
+    with pytest.raises(ImageDecodeError):
+        decode_image(b'')
+
+
+def test_detect_reduction_is_relative_to_the_output_decode():
+    data = encode(1280, 720)
+    assert detect_reduction(data, 160) == 8
+    assert detect_reduction(data, 160, output_size=640) == 4
+    assert detect_reduction(data, 640, output_size=640) == 1
+    assert detect_reduction(np.zeros((8, 8, 3), np.uint8), 160) == 1
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from pipeline import Label, TryOnPipeline, composite_layers, layer_bounds
+
+
+class Broken:
+    """Layer that paints its box and then fails"""
+
+    def __init__(self, box):
+        self.box = box
+
+    def draw(self, frame):
+        x0, y0, x1, y1 = self.box
+        frame[y0:y1, x0:x1] = 255
+        raise RuntimeError('draw failed')
+
+    def bounds(self):
+        return list(self.box)
+
+
+def frame():
+    return np.random.default_rng(0).integers(0, 200, (120, 160, 3), np.uint8)
+
+
+def pipeline(compositor=composite_layers):
+    return TryOnPipeline('shirt', None, lambda *args: [],
+                         compositor=compositor)
+
+
+def test_bounds_are_clipped_to_the_frame():
+    layers = [Broken((-10, -10, 20, 30)), Broken((150, 100, 400, 400)),
+              Broken((200, 0, 300, 10))]
+    assert layer_bounds(layers, (120, 160, 3)) == [
+        (0, 0, 20, 30), (150, 100, 160, 120)]
+    assert layer_bounds([object()], (120, 160, 3)) is None
+
+
+def test_label_bounds_cover_the_drawn_text():
+    label = Label('Shirt', (20, 40), (0, 255, 0))
+    drawn = label.draw(np.zeros((120, 160, 3), np.uint8))
+    x0, y0, x1, y1 = label.bounds()
+    drawn[y0:y1, x0:x1] = 0
+    assert not drawn.any()
+
+
+def test_failed_in_place_composite_restores_the_covered_regions():
+    image = frame()
+    clean = image.copy()
+    layers = [Label('Shirt', (20, 40), (0, 255, 0)), Broken((60, 50, 100, 90))]
+    with pytest.raises(RuntimeError):
+        pipeline()._composite(image, layers, image)
+    np.testing.assert_array_equal(image, clean)
+
+
+def test_custom_compositors_get_the_whole_frame_restored():
+    def scribble(frame, layers, out=None):
+        out[:] = 0
+        raise RuntimeError('compositor failed')
+
+    image = frame()
+    clean = image.copy()
+    with pytest.raises(RuntimeError):
+        pipeline(scribble)._composite(image, [], image)
+    np.testing.assert_array_equal(image, clean)
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from deadline import Deadline, Scheduler
+from pipeline import OutfitPipeline, TryOnPipeline
+
+
+def warm(scheduler, scope, stage, seconds):
+    """Set an estimate, past the ignored cold-start sample"""
+    scheduler._update((scope, stage), seconds)
+    scheduler._update((scope, stage), seconds)
+
+
+def test_first_sample_is_not_used():
+    scheduler = Scheduler(alpha=0.5)
+    scheduler.observe('shirt', {'composite': 1.0})
+    assert scheduler.cost('shirt', 'composite') == 0.0
+    scheduler.observe('shirt', {'composite': 0.2})
+    assert scheduler.cost('shirt', 'composite') == pytest.approx(0.2)
+
+
+def test_estimates_are_moving_averages():
+    scheduler = Scheduler(alpha=0.5)
+    for seconds in (9.0, 1.0, 3.0):
+        scheduler.observe_detect(['pose'], seconds, queued=False)
+    assert scheduler.cost('pose', 'detect') == pytest.approx(2.0)
+
+
+def test_queued_and_multi_detector_calls_are_not_samples():
+    scheduler = Scheduler(alpha=0.5)
+    warm(scheduler, 'pose', 'detect', 0.1)
+    scheduler.observe_detect(['pose'], 5.0, queued=True)
+    scheduler.observe_detect(['pose', 'face'], 5.0, queued=False)
+    assert scheduler.cost('pose', 'detect') == pytest.approx(0.1)
+
+
+def test_plan_detects_degrades_or_sheds():
+    scheduler = Scheduler(probe_interval=3600)
+    warm(scheduler, 'pose', 'detect', 0.1)
+    warm(scheduler, 'shirt', 'composite', 0.01)
+    warm(scheduler, 'shirt', 'cached', 0.001)
+    warm(scheduler, 'shirt', 'fallback', 0.02)
+    assert scheduler.plan('shirt', ['pose'], Deadline(0.5)) == 'detect'
+    assert scheduler.plan('shirt', ['pose'], Deadline(0.05)) == 'degrade'
+    assert scheduler.plan('shirt', ['pose'], Deadline(0.005)) == 'shed'
+
+
+def test_detections_in_flight_queue_by_capacity():
+    scheduler = Scheduler()
+    scheduler.set_capacity('pose', 2)
+    warm(scheduler, 'pose', 'detect', 0.1)
+    assert scheduler.detect_estimate(['pose']) == pytest.approx(0.1)
+    with scheduler.detecting(['pose']) as queued:
+        assert not queued
+        with scheduler.detecting(['pose']) as queued:
+            assert not queued
+            # A third call waits for one of the two running ones
+            assert scheduler.detect_estimate(['pose']) == pytest.approx(0.2)
+            with scheduler.detecting(['pose']) as queued:
+                assert queued
+    assert scheduler.detect_estimate(['pose']) == pytest.approx(0.1)
+
+
+def test_one_caller_claims_a_due_probe():
+    scheduler = Scheduler(probe_interval=0.05)
+    assert scheduler.claim_probe(['pose'])
+    assert not scheduler.claim_probe(['pose'])
+    time.sleep(0.06)
+    with scheduler.detecting(['pose']):
+        # Not while the detector is busy
+        assert not scheduler.claim_probe(['pose'])
+    # Nor right after it ran
+    assert not scheduler.claim_probe(['pose'])
+    time.sleep(0.06)
+    assert scheduler.claim_probe(['pose'])
+
+
+def test_probe_replaces_a_stale_estimate():
+    scheduler = Scheduler(alpha=0.2, probe_interval=3600)
+    warm(scheduler, 'pose', 'detect', 5.0)
+    assert scheduler.plan('shirt', ['pose'], Deadline(0.5)) == 'degrade'
+    scheduler.observe_detect(['pose'], 0.01, queued=False, probe=True)
+    assert scheduler.cost('pose', 'detect') == pytest.approx(0.01)
+    assert scheduler.plan('shirt', ['pose'], Deadline(0.5)) == 'detect'
+
+
+def test_unusable_probes_leave_no_state_behind():
+    scheduler = Scheduler(alpha=0.5)
+    warm(scheduler, 'pose', 'detect', 1.0)
+    scheduler.observe_detect(['pose'], 0.5, queued=True, probe=True)
+    scheduler.observe_detect(['pose', 'face'], 0.5, queued=False, probe=True)
+    assert scheduler.cost('pose', 'detect') == pytest.approx(1.0)
+    # Later calls are averaged in as usual
+    scheduler.observe_detect(['pose'], 0.0, queued=False)
+    assert scheduler.cost('pose', 'detect') == pytest.approx(0.5)
+
+
+class FakeDetector:
+    """Detector that records the threads it ran on"""
+
+    def __init__(self, name):
+        self.__name__ = name
+        self.threads = []
+
+    def __call__(self, frame, **hints):
+        self.threads.append(threading.current_thread())
+        return None
+
+
+def no_layers(frame, detection):
+    return []
+
+
+def probing(pipeline):
+    """Collect the probe threads the pipeline starts"""
+    threads = []
+    start_probe = pipeline.start_probe
+    pipeline.start_probe = lambda frame: threads.append(start_probe(frame))
+    return threads
+
+
+def test_degraded_render_probes_off_the_request_path():
+    scheduler = Scheduler(probe_interval=0)
+    detector = FakeDetector('fake_pose')
+    pipeline = TryOnPipeline('shirt', detector, no_layers, scheduler=scheduler)
+    threads = probing(pipeline)
+    warm(scheduler, 'fake_pose', 'detect', 5.0)
+
+    timings = {}
+    frame = np.zeros((64, 64, 3), np.uint8)
+    pipeline.render(frame, timings, deadline=Deadline(1.0))
+    for thread in threads:
+        thread.join()
+
+    # Served from the fallback, without detecting on the request thread
+    assert 'fallback' in timings and 'detect' not in timings
+    assert len(threads) == 1
+    assert detector.threads == [threads[0]]
+    assert scheduler.cost('fake_pose', 'detect') < 1.0
+    assert pipeline.render(frame, deadline=Deadline(1.0)) is not None
+    assert len(detector.threads) == 2
+
+
+def test_outfit_probes_each_detector():
+    scheduler = Scheduler(probe_interval=0)
+    pose, face = FakeDetector('fake_pose'), FakeDetector('fake_face')
+    outfit = OutfitPipeline([
+        TryOnPipeline('shirt', pose, no_layers, scheduler=scheduler),
+        TryOnPipeline('earrings', face, no_layers, scheduler=scheduler),
+    ])
+    outfit.scheduler = scheduler
+    threads = probing(outfit)
+    warm(scheduler, 'fake_pose', 'detect', 5.0)
+    warm(scheduler, 'fake_face', 'detect', 5.0)
+
+    outfit.render(np.zeros((64, 64, 3), np.uint8), deadline=Deadline(1.0))
+    for thread in threads:
+        thread.join()
+
+    assert len(pose.threads) == 1 and len(face.threads) == 1
+    assert scheduler.cost('fake_pose', 'detect') < 1.0
+    assert scheduler.cost('fake_face', 'detect') < 1.0
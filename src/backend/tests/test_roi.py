@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from roi import (RegionError, RegionMemory, crop_region, parse_region,
+                 roi_detector)
+
+
+def spot_frame():
+    """720p frame with one bright 40x40 spot"""
+    frame = np.zeros((720, 1280, 3), np.uint8)
+    frame[300:340, 600:640] = 255
+    return frame
+
+
+def face(frame, session_id=None):
+    """Detector: the spot's corners, normalized to the frame it was given"""
+    face.shapes.append(frame.shape)
+    ys, xs = np.nonzero(frame[..., 0])
+    if not len(xs):
+        return None
+    h, w = frame.shape[:2]
+    # Pixel centres, so float32 landmarks truncate back to the same pixels
+    return np.array([[xs.min() + 0.5, ys.min() + 0.5, 0.0],
+                     [xs.max() + 1.5, ys.max() + 1.5, 0.0]]) / (w, h, 1)
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    face.shapes = []
+
+
+def test_parse_region():
+    assert parse_region('10,20,30.4,40') == [10, 20, 30, 40]
+    assert parse_region([1, 2, 3, 4]) == [1, 2, 3, 4]
+    assert parse_region('') is None
+    for value in ('1,2,3', '1,2,0,4', 'a,b,c,d'):
+        with pytest.raises(RegionError):
+            parse_region(value)
+
+
+def test_crop_region_pads_and_clips():
+    assert crop_region((720, 1280), (600, 300, 40, 40)) == (572, 272, 668, 368)
+    assert crop_region((720, 1280), (0, 0, 200, 200)) == (0, 0, 300, 300)
+    # Crops covering most of the frame are not worth it
+    assert crop_region((720, 1280), (0, 0, 1200, 700)) is None
+
+
+def test_crop_detections_map_back_to_the_full_frame():
+    detect = roi_detector(face, RegionMemory())
+    frame = spot_frame()
+    full = detect(frame)
+    cropped = detect(frame, roi=[600, 300, 40, 40])
+    assert face.shapes[1] == (96, 96, 3)
+    np.testing.assert_allclose(cropped.points, full, atol=1e-6)
+    assert cropped.box(frame.shape) == [600, 300, 40, 40]
+
+
+def test_sessions_reuse_their_last_box_and_fall_back_on_a_miss():
+    memory = RegionMemory()
+    detect = roi_detector(face, memory)
+    frame = spot_frame()
+    detect(frame, session_id='s')
+    assert memory.get('s', 'face', frame.shape) == [600, 300, 40, 40]
+    detect(frame, session_id='s')
+    assert face.shapes[-1] == (96, 96, 3)
+
+    # The spot moved out of the remembered crop: detect on the full frame
+    moved = np.roll(spot_frame(), 300, axis=1)
+    detect(moved, session_id='s')
+    assert face.shapes[-2:] == [(96, 96, 3), (720, 1280, 3)]
+    assert memory.get('s', 'face', moved.shape) == [900, 300, 40, 40]
+
+
+def test_region_memory_expires_and_checks_the_frame_shape():
+    memory = RegionMemory(max_sessions=1, ttl=60)
+    memory.store('a', 'face', (720, 1280), [1, 2, 3, 4])
+    assert memory.get('a', 'face', (360, 640)) is None
+    assert memory.get('a', 'face', (720, 1280)) is None
+    memory.store('a', 'face', (720, 1280), [1, 2, 3, 4])
+    memory.store('b', 'face', (720, 1280), [5, 6, 7, 8])
+    assert memory.get('a', 'face', (720, 1280)) is None
+    assert memory.get('b', 'face', (720, 1280)) == [5, 6, 7, 8]
+    memory.ttl = 0
+    assert memory.get('b', 'face', (720, 1280)) is None
@@ -0,0 +1,446 @@
+"""
+Try-on stages (MediaPipe detectors, placement models) and the pipelines
+built from them for each item type. Kept free of Flask so inference worker
+processes can import it on their own.
+"""
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ml_models.tshirt_tryon import (
+    process_tshirt_frame,
+    load_tshirt,
+    tshirt_placement,
+    calculate_distance,
+    get_coords,
+    fit_color
+)
+from ml_models.assets import asset_store
+from ml_models.compositing import scratch
+from ml_models.earring_tryon import (
+    process_earring_frame,
+    load_earring,
+    earring_box,
+    earring_placements
+)
+from detection_cache import cached_detector, detection_cache
+from deadline import scheduler
+from detectors import DetectorPool
+from inference_pool import execution_mode, inference_worker
+from roi import region_memory, roi_detector
+from landmarks import (
+    Landmarks,
+    as_landmarks,
+    LEFT_EAR,
+    LEFT_SHOULDER,
+    RIGHT_EAR,
+    RIGHT_SHOULDER
+)
+from pipeline import TryOnPipeline, OutfitPipeline, Overlay, Label, ParameterError
+import metrics
+import startup
+
+# MediaPipe is optional and slow to import, so only check that it is
+# installed here; it is imported by the first detector that is created
+def _mediapipe_installed():
+    if 'mediapipe' in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec('mediapipe') is not None
+    except (ImportError, ValueError):
+        return False
+
+
+MEDIAPIPE_AVAILABLE = _mediapipe_installed()
+if not MEDIAPIPE_AVAILABLE:
+    print("MediaPipe not available. Using fallback detection methods.")
+
+_mediapipe = None
+_mediapipe_lock = threading.Lock()
+
+
+def load_mediapipe():
+    """Import MediaPipe once, recording how long the import took"""
+    global _mediapipe
+    with _mediapipe_lock:
+        if _mediapipe is None:
+            start = time.perf_counter()
+            import mediapipe
+            startup.record('mediapipe_import', time.perf_counter() - start)
+            _mediapipe = mediapipe
+    return _mediapipe
+
+
+def create_pose():
+    # Configure with explicit model and input specifications to avoid warnings
+    return load_mediapipe().solutions.pose.Pose(
+        static_image_mode=True, 
+        model_complexity=1,
+        enable_segmentation=False,
+        min_detection_confidence=0.5
+    )
+
+
+def create_face_mesh():
+    return load_mediapipe().solutions.face_mesh.FaceMesh(
+        static_image_mode=True, 
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5
+    )
+
+
+def detector_startup_mode():
+    """
+    How detectors are created, from WEARX_DETECTOR_STARTUP:
+        background (default): warm the pools in background threads, one per
+            pool, while the server already accepts requests
+        eager: warm the pools in parallel before the import finishes
+        lazy: create each detector on the first request that needs it, so
+            a server that only sees t-shirts never loads FaceMesh
+    A process that hands its frames to the inference pool is always lazy:
+    its workers detect, it does not.
+    """
+    mode = os.environ.get("WEARX_DETECTOR_STARTUP", "background").strip().lower()
+    if mode not in ('background', 'eager', 'lazy'):
+        raise ValueError(f"WEARX_DETECTOR_STARTUP must be background, eager or "
+                         f"lazy, not {mode!r}")
+    if execution_mode() == 'process' and not inference_worker():
+        return 'lazy'
+    return mode
+
+
+def warm_detector_names():
+    """Pools warmed at startup, from WEARX_WARM_DETECTORS (default: all)"""
+    names = os.environ.get("WEARX_WARM_DETECTORS")
+    if names is None:
+        return list(DETECTOR_POOLS)
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+# MediaPipe graphs are not safe for concurrent process() calls, so each
+# request checks an instance out of a pool sized from the CPU count
+if MEDIAPIPE_AVAILABLE:
+    pose_pool = DetectorPool('pose', create_pose)
+    face_mesh_pool = DetectorPool('face_mesh', create_face_mesh)
+    DETECTOR_POOLS = {pool.name: pool for pool in (pose_pool, face_mesh_pool)}
+else:
+    pose_pool = None
+    face_mesh_pool = None
+    DETECTOR_POOLS = {}
+
+DETECTOR_STARTUP = detector_startup_mode()
+WARM_DETECTORS = ([name for name in warm_detector_names() if name in DETECTOR_POOLS]
+                  if DETECTOR_STARTUP != 'lazy' else [])
+
+
+def start_detectors():
+    """Start warming the WARM_DETECTORS pools; in eager mode, wait for them"""
+    threads = [DETECTOR_POOLS[name].start_warm_up() for name in WARM_DETECTORS]
+    if DETECTOR_STARTUP == 'eager':
+        for thread in threads:
+            thread.join()
+
+
+def detectors_ready():
+    """True once every pool warmed at startup is ready"""
+    return all(DETECTOR_POOLS[name].state == 'ready' for name in WARM_DETECTORS)
+
+
+def detector_status():
+    """Startup mode, MediaPipe and per-pool status, for the readiness endpoint"""
+    return {
+        'startup': DETECTOR_STARTUP,
+        'mediapipe': {'available': MEDIAPIPE_AVAILABLE,
+                      'imported': _mediapipe is not None},
+        'detectors': {name: dict(pool.status(), warmed=name in WARM_DETECTORS)
+                      for name, pool in DETECTOR_POOLS.items()},
+    }
+
+
+start_detectors()
+
+
+# Function to use a simple approach if advanced detection fails
+def fallback_detection(frame, item_type):
+    height, width = frame.shape[:2]
+    
+    if item_type == 'tshirt' or item_type == 'dress':
+        # Fallback for shirt: assume upper half of image
+        return [width//4, height//8, width//2, height//2]
+    elif item_type == 'earrings':
+        # Fallback for earrings: assume face is in center upper third
+        return [width//3, height//6, width//3, height//3]
+    
+    return None
+
+
+# Detector stages: return a Landmarks array, or None if no person/face was
+# found
+
+def to_rgb(frame):
+    # MediaPipe requires RGB input. It copies the image into its own packet,
+    # so the conversion can go into a per-thread scratch buffer.
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB,
+                        dst=scratch('rgb', frame.shape, np.uint8))
+
+
+def detect_pose(frame):
+    frame_rgb = to_rgb(frame)
+    with pose_pool.checkout() as pose:
+        pose_result = pose.process(frame_rgb)
+    if not pose_result.pose_landmarks:
+        return None
+    return Landmarks.from_mediapipe(pose_result.pose_landmarks.landmark)
+
+
+def detect_face(frame):
+    frame_rgb = to_rgb(frame)
+    with face_mesh_pool.checkout() as face_mesh:
+        face_result = face_mesh.process(frame_rgb)
+    if not face_result.multi_face_landmarks:
+        return None
+    return Landmarks.from_mediapipe(face_result.multi_face_landmarks[0].landmark)
+
+
+# Placement stages: turn landmarks (or None) into layers to composite
+
+def garment_placement(item_type, item_path):
+    """
+    Placement for the generic shirt/dress try-on: a body box from the
+    shoulders, or fallback_detection when there are no landmarks
+    """
+    def place(frame, landmarks):
+        if landmarks is None:
+            body_box = fallback_detection(frame, item_type)
+        else:
+            # Shoulder coordinates
+            (lsx, lsy), (rsx, rsy) = as_landmarks(landmarks).pixels(
+                frame.shape, [LEFT_SHOULDER, RIGHT_SHOULDER]
+            ).tolist()
+            
+            # Calculate body box
+            shoulder_width = abs(rsx - lsx)
+            center_x = (lsx + rsx) // 2
+            x = max(0, center_x - shoulder_width)
+            y = max(0, min(lsy, rsy) - int(shoulder_width * 0.2))
+            width = shoulder_width * 2
+            height = int(width * 1.5)
+            body_box = [x, y, width, height]
+        
+        tshirt = load_tshirt(item_path)
+        return [Overlay(tshirt, *tshirt_placement(body_box, tshirt.anchors))]
+    
+    return place
+
+
+def sized_tshirt_placement(frame, landmarks):
+    """
+    Placement for the dedicated t-shirt try-on that demonstrates using all
+    tshirt_tryon.py functions: shirt sized from the shoulders plus a size label
+    """
+    # T-shirt already run through remove_white_background, from the asset
+    # store (placeholder shape if the image is missing)
+    tshirt = load_tshirt("503.png")
+    
+    if landmarks is None:
+        body_box = fallback_detection(frame, 'tshirt')
+        return [Overlay(tshirt, *tshirt_placement(body_box, tshirt.anchors))]
+    
+    # Demonstrate using get_coords
+    landmarks = as_landmarks(landmarks)
+    l_sh, r_sh = get_coords(landmarks, frame.shape,
+                            [LEFT_SHOULDER, RIGHT_SHOULDER]).tolist()
+    
+    # Demonstrate using calculate_distance
+    shoulder_width = calculate_distance(l_sh, r_sh)
+    
+    # Calculate torso measurements
+    center_x = (l_sh[0] + r_sh[0]) // 2
+    tshirt_width = int(shoulder_width * 2)
+    tshirt_height = int(tshirt_width * 1.4)
+    x = max(0, center_x - tshirt_width // 2)
+    y = max(0, min(l_sh[1], r_sh[1]) - int(tshirt_height * 0.2))
+    
+    # Add measurements display (optional)
+    size = "M"  # Default size
+    expected_width = 42  # Example expected width in cm
+    
+    # Demonstrate using fit_color
+    color = fit_color(shoulder_width / 10, expected_width)
+    
+    return [
+        Overlay(tshirt, x, y, tshirt_width, tshirt_height),
+        Label(f"Size: {size}", (10, 30), color),
+    ]
+
+
+def earrings_placement(frame, landmarks):
+    """
+    Placement for earrings: at the ear landmarks sized from the face box,
+    or estimated from fallback_detection when there is no face
+    """
+    h, w = frame.shape[:2]
+    left_earring = load_earring("left_ear.png")
+    right_earring = load_earring("right_ear.png")
+    
+    if landmarks is None:
+        face_box = fallback_detection(frame, 'earrings')
+        left_box, right_box = earring_placements(face_box, w, left_earring,
+                                                 right_earring)
+        return [Overlay(left_earring, *left_box),
+                Overlay(right_earring, *right_box)]
+    
+    # Get face bounds
+    landmarks = as_landmarks(landmarks)
+    _, _, width, height = landmarks.box(frame.shape)
+    
+    # Get earring positions at the ear landmarks
+    (left_x, left_y), (right_x, right_y) = landmarks.pixels(
+        frame.shape, [LEFT_EAR, RIGHT_EAR]
+    ).tolist()
+    
+    # Size earrings based on face dimensions
+    earring_width = width // 5
+    earring_height = height // 3
+    
+    return [
+        Overlay(left_earring, *earring_box(left_earring, left_x, left_y,
+                                           earring_width, earring_height)),
+        Overlay(right_earring, *earring_box(right_earring, right_x, right_y,
+                                            earring_width, earring_height)),
+    ]
+
+
+# Detectors run on a crop around the request's region or the session's last
+# detection, and consult the near-duplicate frame cache when given a session id
+pose_detector = (roi_detector(cached_detector(detect_pose, detection_cache),
+                              region_memory, padding=0.25)
+                 if pose_pool is not None else None)
+face_detector = (roi_detector(cached_detector(detect_face, detection_cache),
+                              region_memory, padding=0.5)
+                 if face_mesh_pool is not None else None)
+
+# Deadline planning queues detections per detector behind its pool size
+for detector, pool in ((pose_detector, pose_pool), (face_detector, face_mesh_pool)):
+    if pool is not None:
+        scheduler.set_capacity(detector.__name__, pool.size)
+
+# Stacking order when items are combined into an outfit (necklaces, when
+# added, go between garments and earrings)
+Z_GARMENT = 0
+Z_NECKLACE = 10
+Z_EARRINGS = 20
+
+# Pipelines behind /api/try-on, by item type
+PIPELINES = {
+    'tshirt': TryOnPipeline(
+        'tshirt', pose_detector, garment_placement('tshirt', "503.png"),
+        z_order=Z_GARMENT, assets=["503.png"]
+    ),
+    'dress': TryOnPipeline(
+        'dress', pose_detector, garment_placement('dress', "504.png"),
+        z_order=Z_GARMENT, assets=["504.png"]
+    ),
+    'earrings': TryOnPipeline('earrings', face_detector, earrings_placement,
+                              z_order=Z_EARRINGS,
+                              assets=["left_ear.png", "right_ear.png"]),
+}
+
+
+def passthrough_placement(frame, detection):
+    return []
+
+
+# Unknown item types are returned unchanged
+passthrough_pipeline = TryOnPipeline('passthrough', None, passthrough_placement)
+
+# Pipelines behind the dedicated endpoints
+tshirt_pipeline = TryOnPipeline(
+    'tshirt', pose_detector, sized_tshirt_placement,
+    fallback=process_tshirt_frame, key='tshirt-sized', assets=["503.png"]
+)
+earrings_pipeline = TryOnPipeline(
+    'earrings', face_detector, earrings_placement,
+    fallback=process_earring_frame, key='earrings-dedicated',
+    z_order=Z_EARRINGS, assets=["left_ear.png", "right_ear.png"]
+)
+
+# Every pipeline by its unique key, for lookups from worker processes
+PIPELINES_BY_KEY = {
+    pipeline.key: pipeline
+    for pipeline in (*PIPELINES.values(), passthrough_pipeline,
+                     tshirt_pipeline, earrings_pipeline)
+}
+
+
+# Outfit pipelines by their item types in z-order
+_outfits = {}
+
+
+def item_types(item_type):
+    """
+    Item types from a list or a comma-separated string, lowercased
+
+    Raises:
+        ParameterError: item_type is not a string or a list of strings
+    """
+    if isinstance(item_type, str):
+        item_type = item_type.split(',')
+    elif (not isinstance(item_type, (list, tuple))
+          or not all(isinstance(t, str) for t in item_type)):
+        raise ParameterError(f"Item type must be a string or a list of "
+                             f"strings, not {item_type!r}")
+    types = []
+    for t in item_type:
+        t = t.strip().lower()
+        if t and t not in types:
+            types.append(t)
+    return types
+
+
+def get_pipeline(item_type):
+    """
+    Pipeline for an item type, or for several at once (a list, or a
+    comma-separated string such as "tshirt,earrings"). Unknown types are
+    ignored; if none is known the frame is returned unchanged.
+    """
+    types = [t for t in item_types(item_type) if t in PIPELINES]
+    if not types:
+        return passthrough_pipeline
+    if len(types) == 1:
+        return PIPELINES[types[0]]
+    # Same outfit whatever order the items were listed in
+    key = tuple(sorted(types, key=lambda t: PIPELINES[t].z_order))
+    outfit = _outfits.get(key)
+    if outfit is None:
+        outfit = _outfits.setdefault(
+            key, OutfitPipeline([PIPELINES[t] for t in key])
+        )
+    return outfit
+
+
+def pipeline_by_key(key):
+    """Look up a pipeline by its key, including outfit keys"""
+    if key.startswith('outfit:'):
+        return get_pipeline(key[len('outfit:'):])
+    return PIPELINES_BY_KEY[key]
+
+
+asset_cache_stats = metrics.registry.gauge(
+    'tryon_asset_cache', 'Garment asset store statistics', ('stat',)
+)
+
+
+def collect_asset_stats():
+    for stat, value in asset_store.stats().items():
+        asset_cache_stats.set(value, stat=stat)
+
+
+# Registered here rather than by the server so inference workers report it
+metrics.registry.add_collector(collect_asset_stats)
@@ -7,9 +7,27 @@ import { outfits, Outfit } from '@/data';
 import { useCartStore } from '@/store/CartStore';
 import { ShoppingCart } from 'lucide-react';
 
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost), so
+// a kiosk served over plain HTTP on the LAN falls back to random bytes
+const newSessionId = (): string => {
+  if (typeof crypto !== 'undefined') {
+    if (typeof crypto.randomUUID === 'function') {
+      return crypto.randomUUID();
+    }
+    if (typeof crypto.getRandomValues === 'function') {
+      return Array.from(crypto.getRandomValues(new Uint8Array(16)),
+        byte => byte.toString(16).padStart(2, '0')).join('');
+    }
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+};
+
 const TryOn = () => {
   const location = useLocation();
   const videoRef = useRef<HTMLVideoElement>(null);
+  // Lets the backend reuse detections for near-identical consecutive frames;
+  // created once, on the first render
+  const [sessionId] = useState(newSessionId);
   const [selectedOutfit, setSelectedOutfit] = useState<Outfit | null>(null);
   const [showWebcam, setShowWebcam] = useState(false);
   const [cameraActive, setCameraActive] = useState(false);
@@ -135,6 +153,7 @@ const TryOn = () => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-Session-Id': sessionId,
         },
         body: JSON.stringify({
           image: imageData,